@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import sys
+import os.path
+import argparse
+import subprocess
+import tempfile
+import shutil
+import time
+import statistics
+
+#entry point scripts, and the arguments used to start them without doing any real work
+ENTRYPOINTS = [('getstrong.py',['knet','-s']),
+               ('getamps.py',['-h']),
+               ('smcheck.py',['-h']),
+               ('getdyfi.py',['-h']),
+               ('filtertrace.py',['-h'])]
+
+NRUNS = 10 #default number of timed runs per entry point and mode
+
+def runScript(script,scriptargs,pycacheprefix,importtime=False):
+    """
+    Run an entry point script once.
+    @param script: Path to script.
+    @param scriptargs: List of command line arguments for the script.
+    @param pycacheprefix: Folder in which Python should read and write bytecode (PYTHONPYCACHEPREFIX).
+    @keyword importtime: Run Python with -X importtime.
+    @return: Tuple of (elapsed seconds,exit code,stderr output).
+    """
+    env = os.environ.copy()
+    env['PYTHONPYCACHEPREFIX'] = pycacheprefix
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X','importtime']
+    cmd += [script] + scriptargs
+    t1 = time.perf_counter()
+    proc = subprocess.run(cmd,env=env,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - t1
+    return (elapsed,proc.returncode,proc.stderr.decode('utf-8','replace'))
+
+def timeScript(script,scriptargs,nruns):
+    """
+    Time cold and warm starts of an entry point script.
+
+    Cold runs get a new, empty bytecode cache every time, so every module imported has to be compiled from
+    source.  Warm runs share a bytecode cache that has been filled by an untimed run.  (Neither mode can drop
+    the operating system's file cache.)
+    @param script: Path to script.
+    @param scriptargs: List of command line arguments for the script.
+    @param nruns: Number of timed runs in each mode.
+    @return: Tuple of (list of cold run times,list of warm run times,exit code of the last run).
+    """
+    coldtimes = []
+    for i in range(nruns):
+        prefix = tempfile.mkdtemp(prefix='smtools_cold_')
+        try:
+            elapsed,retcode,stderr = runScript(script,scriptargs,prefix)
+        finally:
+            shutil.rmtree(prefix,ignore_errors=True)
+        coldtimes.append(elapsed)
+    warmtimes = []
+    prefix = tempfile.mkdtemp(prefix='smtools_warm_')
+    try:
+        runScript(script,scriptargs,prefix)
+        for i in range(nruns):
+            elapsed,retcode,stderr = runScript(script,scriptargs,prefix)
+            warmtimes.append(elapsed)
+    finally:
+        shutil.rmtree(prefix,ignore_errors=True)
+    return (coldtimes,warmtimes,retcode)
+
+def getSlowestImports(script,scriptargs,nimports):
+    """
+    Find the modules that take the longest to import (including their own imports) when a script starts.
+    @param script: Path to script.
+    @param scriptargs: List of command line arguments for the script.
+    @param nimports: Number of modules to return.
+    @return: List of (cumulative microseconds,module name) tuples, slowest first.
+    """
+    prefix = tempfile.mkdtemp(prefix='smtools_warm_')
+    try:
+        runScript(script,scriptargs,prefix)
+        elapsed,retcode,stderr = runScript(script,scriptargs,prefix,importtime=True)
+    finally:
+        shutil.rmtree(prefix,ignore_errors=True)
+    imports = []
+    for line in stderr.splitlines():
+        #lines look like "import time:       self |  cumulative | module"
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        imports.append((int(parts[1]),parts[2].rstrip()))
+    #nested imports are indented - only count the modules imported directly by the script
+    imports = [(usec,name.strip()) for usec,name in imports if not name.startswith('  ')]
+    imports.sort(reverse=True)
+    return imports[0:nimports]
+
+def main(args):
+    homedir = os.path.dirname(os.path.abspath(__file__))
+    entrypoints = ENTRYPOINTS
+    if args.scripts:
+        unknown = set(args.scripts) - set([entry[0] for entry in ENTRYPOINTS])
+        if len(unknown):
+            print('Unknown program(s): %s' % ', '.join(sorted(unknown)))
+            sys.exit(1)
+        entrypoints = [entry for entry in ENTRYPOINTS if entry[0] in args.scripts]
+    print('%-16s %10s %10s %10s %10s  %s' % ('Script','Cold min','Cold med','Warm min','Warm med','Exit'))
+    for script,scriptargs in entrypoints:
+        scriptpath = os.path.join(homedir,script)
+        coldtimes,warmtimes,retcode = timeScript(scriptpath,scriptargs,args.nruns)
+        print('%-16s %9.3fs %9.3fs %9.3fs %9.3fs  %i' % (script,min(coldtimes),statistics.median(coldtimes),
+                                                       min(warmtimes),statistics.median(warmtimes),retcode))
+        if args.nimports:
+            for usec,module in getSlowestImports(scriptpath,scriptargs,args.nimports):
+                print('    %9.3fs  %s' % (usec/1e6,module))
+
+if __name__ == '__main__':
+    desc = '''Measure how long the smtools command line programs take to start.
+
+    Each program is started with arguments that make it exit right away (e.g., getstrong.py knet -s),
+    NRUNS times with an empty bytecode cache (cold) and NRUNS times with a filled one (warm).  A non-zero
+    exit code usually means that a dependency is missing.
+
+    Time all of the programs, and list the 5 slowest top-level imports of each:
+
+    benchstartup.py -m 5
+
+    Time getstrong.py only, 30 times in each mode:
+
+    benchstartup.py -n 30 getstrong.py
+    '''
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scripts',nargs='*',metavar='SCRIPT',
+                        help='Programs to time (default is all of them): %s.' % ', '.join([entry[0] for entry in ENTRYPOINTS]))
+    parser.add_argument('-n','--runs',dest='nruns',type=int,default=NRUNS,
+                        help='Number of timed runs of each program in each mode (default %i).' % NRUNS)
+    parser.add_argument('-m','--imports',dest='nimports',type=int,default=0,
+                        help='List this many of the slowest modules imported by each program.')
+    pargs = parser.parse_args()
+    main(pargs)
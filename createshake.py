@@ -12,6 +12,9 @@ import json
 from datetime import datetime,timedelta
 from time import strptime
 
+#local imports
+from smtools import webclient
+
 EVENT_TEMPLATE = '''<?xml version="1.0" encoding="US-ASCII" standalone="yes"?>
 <!DOCTYPE earthquake [
 <!ELEMENT  earthquake EMPTY>
@@ -49,7 +52,7 @@ def getEventInfo(weburl):
     parts = urllib.parse.urlsplit(weburl.rstrip('/'))
     eventid = parts.path.split('/')[-1]
     url = BASEURL.replace('[EVENT]',eventid)
-    fh = urllib.request.urlopen(url)
+    fh = webclient.urlopen(url,ttl=webclient.QUERY_TTL)
     data = fh.read()
     fh.close()
     jdict = json.loads(data)
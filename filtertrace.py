@@ -1,9 +1,5 @@
 #!/usr/bin/env python
 
-#define an interactive matplotlib backend
-import matplotlib
-matplotlib.use('TkAgg')
-
 #stdlib
 from collections import OrderedDict
 import sys
@@ -11,11 +7,10 @@ import os.path
 import argparse
 
 #third party
-import matplotlib.pyplot as plt
-import numpy as np
-from obspy.core.utcdatetime import UTCDateTime
+#(numpy, matplotlib and smtools.tracefile, which imports obspy, are imported where they are used, so that
+#--help and argument errors are fast)
 
-from smtools import knet,geonet,turkey,iran,iris,italy,unam,util,orfeus,chile
+from smtools import sources
 
 def readheader(fname):
     hdrdict = OrderedDict()
@@ -32,18 +27,20 @@ def readheader(fname):
     return hdrdict
 
 def trim(toff):
+    from smtools import tracefile
     stime = TRACE.stats['starttime']
     etime = stime + toff
     TRACE.trim(stime,etime)
     fpath,fname = os.path.split(CURRENT_FILE)
     fname,fext = os.path.splitext(fname)
-    outfile = os.path.join(fpath,fname+'.pickle')
+    outfile = os.path.join(fpath,fname+tracefile.EXT)
     print('Trimming trace from %s to %s' % (stime,etime))
     print('Saving trimmed file to %s' % outfile)
-    TRACE.write(outfile,format='PICKLE')
+    tracefile.writesmt([TRACE],outfile)
     
     
 def onclick(event):
+    import matplotlib.pyplot as plt
     global XCLICK
     global YCLICK
     #print 'button=%d, x=%d, y=%d, xdata=%f, ydata=%f'%(event.button, event.x, event.y, event.xdata, event.ydata)
@@ -59,50 +56,28 @@ def onclick(event):
     if event.button == 3: #right button to accept
         trim(XCLICK)
 
+def convert(files):
+    from smtools import tracefile
+    for dfile in files:
+        outfile = tracefile.convertpickle(dfile)
+        print('Converted %s to %s' % (dfile,outfile))
+
 def main(args):
+    if args.doConvert:
+        convert(args.files)
+        sys.exit(0)
     if args.doTrim is False:
         print('Select the pre-processing option you want to use.  See help for list of currently supported options.')
         sys.exit(1)
+    #define an interactive matplotlib backend (only trimming needs matplotlib, which is slow to import)
+    import numpy as np
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
     for dfile in args.files:
         global CURRENT_FILE
         CURRENT_FILE = dfile
-        traces = []
-        if args.source == 'knet':
-            if dfile.endswith('1'): #these files are KikNet downhole (deep) stations
-                continue
-            trace,header = knet.readknet(dfile)
-            traces.append(trace)
-        elif args.source == 'geonet':
-            tracelist,headers = geonet.readgeonet(dfile)
-            traces = traces + tracelist
-        elif args.source == 'turkey':
-            tracelist,headers = turkey.readturkey(dfile)
-            traces = traces + tracelist
-        elif args.source == 'iran':
-            doRotation = True
-            if args.noRotation:
-                doRotation = False
-            tracelist,headers = iran.readiran(dfile,doRotation=doRotation)
-            traces = traces + tracelist
-        elif args.source == 'iris':
-            trace = iris.readiris(dfile)
-            traces.append(trace)
-        elif args.source == 'italy':
-            trace = italy.readitaly(dfile)
-            traces.append(trace)
-        elif args.source == 'chile':
-            trace = chile.readchile(dfile)
-            traces.append(trace)
-        elif args.source == 'unam':
-            tracelist,headers = unam.readunam(dfile)
-            traces = traces + tracelist
-        elif args.source == 'sac':
-            stream = obspy.read(dfile)
-            for trace in stream:
-                traces.append(trace)
-        else:
-            print('Source %s is not supported' % (args.source))
-            sys.exit(1)
+        traces = sources.readFile(args.source,dfile)
         for trace in traces:
             global TRACE
             TRACE = trace
@@ -148,16 +123,21 @@ if __name__ == '__main__':
 
     For each channel in each sensor, an interactive plot will appear.  To select the new ending time for the
     trace, left click on the plot.  A vertical red line will be drawn at that location.  Right click to accept
-    that time, and close the window to proceed to the next trace.
+    that time, and close the window to proceed to the next trace.  Trimmed traces are saved next to the input
+    file in smtools binary format (.smt), which getstrong.py can read with the smt source.
+
+    Convert pickle files written by older versions of this program to smtools binary format:
+
+    filtertrace.py -c pickle ~/data/chile2/*.pickle
     '''
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('source',help='Specify strong motion data source.',choices=['knet','geonet','turkey','iran',
-                                                                                    'iris','italy','unam','orfeus',
-                                                                                    'sac','chile'])
+    parser.add_argument('source',help='Specify strong motion data source.',choices=sources.getSourceNames(readable=True))
     parser.add_argument('files',help='Filenames to process.',nargs="+")
     parser.add_argument('-t','--trim',dest='doTrim',action='store_true',default=False,
                         help='Interactively trim the latter part of a trace.')
+    parser.add_argument('-c','--convert',dest='doConvert',action='store_true',default=False,
+                        help='Convert pickle files to smtools binary (.smt) files.')
     pargs = parser.parse_args()
     main(pargs)
     fname = sys.argv[1]
@@ -6,9 +6,6 @@ import argparse
 import glob
 import os.path
 
-#third party or local imports
-from smtools.trace2xml import amps2xml
-from smtools.taiwan import readTaiwan
 
 SUPPORTED_NETWORKS = {'taiwan':'Taiwan Central Weather Bureau'}
 
@@ -30,6 +27,9 @@ def main(args):
         sys.exit(1)
 
     if args.source == 'taiwan':
+        #imported here so that -l doesn't have to load obspy and neicio
+        from smtools.trace2xml import amps2xml
+        from smtools.taiwan import readTaiwan
         txtfiles = glob.glob(os.path.join(args.inputFolder,'*.txt'))
         for txtfile in txtfiles:
             stationlist = readTaiwan(txtfile)
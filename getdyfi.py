@@ -17,7 +17,7 @@ from neicio.tag import Tag
 from libcomcat import comcat 
 
 #local imports
-from smtools import util
+from smtools import util,webclient
 
 EVENTURL = 'http://comcat.cr.usgs.gov/earthquakes/eventpage/[EVENTID].geojson'
 
@@ -34,7 +34,7 @@ def fetchCDIByParams(etime,lat,lon,config,rawfolder):
     url = EVENTURL.replace('[EVENTID]',eventlist[0]['id'])
     req = urllib.request.Request(url)
     req.add_unredirected_header('User-Agent', 'Custom User-Agent')
-    fh = urllib.request.urlopen(req)
+    fh = webclient.urlopen(req,ttl=webclient.QUERY_TTL)
     data = fh.read()
     fh.close()
     jdict = json.loads(data)
@@ -51,7 +51,7 @@ def fetchCDIByParams(etime,lat,lon,config,rawfolder):
         else:
             print('DYFI product not found for event %s.  Exiting.' % etime)
             sys.exit(1)
-    fh = urllib.request.urlopen(durl)
+    fh = webclient.urlopen(durl,ttl=webclient.QUERY_TTL)
     data = fh.read()
     fh.close()
     urlpath = urllib.parse.urlsplit(durl).path
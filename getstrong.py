@@ -14,31 +14,23 @@ import argparse
 import glob
 import re
 import collections
+import time
+import multiprocessing
 
 #import local
-from smtools import knet,geonet,turkey,iran,iris,italy,unam,util,orfeus,chile
+from smtools import util,sources,webclient
 from smtools import trace2xml
+from smtools.manifest import Manifest
+from smtools.fetcher import StrongMotionFetcherException
 
 #third party
-from obspy.xseed import Parser
-import obspy
+#(obspy, and the smtools modules that import it, are imported by the functions that use them, so that
+#e.g. getstrong.py -s starts quickly)
 
 #constants
 TIMEWINDOW = 60 #number of seconds within which to search for matching event on knet/geonet site
 DISTWINDOW = 50 #number of seconds within which to search for matching event on knet/geonet site
 
-SUPPORTED_NETWORKS = {'knet':'Japanese Strong Motion (NIED)',
-                      'geonet':'New Zealand (GNS)',
-                      'turkey':'Turkish strong motion repository',
-                      'iran':'Iranian strong motion repository',
-                      'iris':'Incorporated Research Institutions for Seismology',
-                      'italy':'Italian strong motion (INGV)',
-                      'unam':'Mexican strong motion data (UNAM)',
-                      'orfeus':'Integrated European strong motion data repository',
-                      'SAC':'Any data in SAC format (must also provide dataless seed in input directory',
-                      'chile':'Calibrated ASCII data from Chilean seismic network',
-                      'pickle':'Calibrated strong motion data from any source',}
-
 def doConfig():
     shakehome = input('Please specify the root folder where ShakeMap is installed: ')
     if not os.path.isdir(shakehome):
@@ -95,17 +87,378 @@ def printTag(tag):
         print('\tPSA 3.0: %f' % (psa30tag.attributes['value']))
         print()
         
+def readFile(source,dfile,args,headonly=False):
+    """
+    Read all of the traces from one data file.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param dfile: Path to data file.
+    @param args: argparse Namespace object.
+    @keyword headonly: If True, read only the headers (traces have no samples, but their npts is set).
+                       Pickle files are always read in full.
+    @return: List of ObsPy Trace objects.
+    """
+    if source == 'sac' and sources.matchesSource('smt',dfile):
+        #SAC traces trimmed by filtertrace.py - read with tracefile.readsmt(), and calibrate as SAC data
+        source = 'smt'
+    return sources.readFile(source,dfile,headonly=headonly,doRotation=not args.noRotation)
+
+def readCachedFile(source,dfile,args,cache=None,headonly=False):
+    """
+    Read all of the traces from one data file, using the binary trace cache for ASCII sources.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param dfile: Path to data file.
+    @param args: argparse Namespace object.
+    @keyword cache: TraceCache object, or None.
+    @keyword headonly: If True, read only the headers.
+    @return: List of ObsPy Trace objects.
+    """
+    if cache is None or not sources.getSource(source)['cached']:
+        return readFile(source,dfile,args,headonly=headonly)
+    tag = source
+    if source == 'iran' and args.noRotation:
+        tag += '-norotation'
+    traces = cache.load(dfile,tag=tag,headonly=headonly)
+    if traces is not None:
+        return traces
+    if headonly:
+        return readFile(source,dfile,args,headonly=True)
+    traces = readFile(source,dfile,args)
+    cache.save(dfile,traces,tag=tag)
+    return traces
+
+def readWorker(source,dfile,args,headonly):
+    """
+    Read all of the traces from one data file in a worker process.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param dfile: Path to data file.
+    @param args: argparse Namespace object.
+    @param headonly: If True, read only the headers.
+    @return: Tuple of (dfile,list of ObsPy Trace objects,error message or None).
+    """
+    cache = None
+    if args.cache or args.cacheDir:
+        from smtools.cache import TraceCache
+        cache = TraceCache(args.cacheDir)
+    try:
+        traces = readCachedFile(source,dfile,args,cache=cache,headonly=headonly)
+    except Exception as msg:
+        return (dfile,[],str(msg))
+    return (dfile,traces,None)
+
+def iterFiles(source,datafiles,args,cache=None,headonly=False,jobs=1):
+    """
+    Read data files in order, using a pool of worker processes if jobs > 1.
+
+    A file that cannot be read is reported with an error message (and no traces) rather than
+    stopping the batch.  With jobs > 1, at most 2*jobs files are read ahead of the consumer.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param datafiles: List of data file paths.
+    @param args: argparse Namespace object.
+    @keyword cache: TraceCache object, or None.
+    @keyword headonly: If True, read only the headers.
+    @keyword jobs: Number of worker processes.
+    @return: Generator of (dfile,list of ObsPy Trace objects,error message or None) tuples, in the order of datafiles.
+    """
+    if jobs <= 1:
+        for dfile in datafiles:
+            try:
+                traces = readCachedFile(source,dfile,args,cache=cache,headonly=headonly)
+            except Exception as msg:
+                yield (dfile,[],str(msg))
+                continue
+            yield (dfile,traces,None)
+        return
+    pool = multiprocessing.Pool(jobs)
+    pending = collections.deque()
+    try:
+        for dfile in datafiles:
+            pending.append(pool.apply_async(readWorker,(source,dfile,args,headonly)))
+            while len(pending) >= 2*jobs:
+                yield pending.popleft().get()
+        while len(pending):
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def hasPrefilter(args):
+    """
+    Determine whether any station prefilters (--max-distance, --bbox, --stations) were requested.
+    @param args: argparse Namespace object.
+    @return: True if traces should be passed through keepTrace().
+    """
+    return args.maxDistance is not None or args.bbox is not None or args.stations is not None
+
+def keepTrace(trace,args,epicenter=None,parser=None):
+    """
+    Apply the station prefilters to a trace (which may be header-only).
+
+    Traces whose coordinates cannot be determined are kept.
+    @param trace: ObsPy Trace object.
+    @param args: argparse Namespace object.
+    @keyword epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @keyword parser: ObsPy Parser object, or None if coordinates are stored in the trace stats.
+    @return: True if the trace passes all of the prefilters.
+    """
+    if not keepStation(trace.stats['network'],trace.stats['station'],args):
+        return False
+    if args.maxDistance is None and args.bbox is None:
+        return True
+    coordinates = trace2xml.getCoordinates(trace,parser)
+    if coordinates is None:
+        return True
+    return keepLocation(coordinates['latitude'],coordinates['longitude'],args,epicenter)
+
+def keepRecord(record,args,epicenter=None):
+    """
+    Apply the station prefilters to an amplitude record (i.e., one re-used from the folder manifest).
+    @param record: Amplitude record dictionary (see trace2xml.getRecord()).
+    @param args: argparse Namespace object.
+    @keyword epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @return: True if the record passes all of the prefilters.
+    """
+    station = record['code'][len(record['netid'])+1:]
+    if not keepStation(record['netid'],station,args):
+        return False
+    return keepLocation(record['lat'],record['lon'],args,epicenter)
+
+def keepStation(network,station,args):
+    """
+    Apply the --stations prefilter.
+    @param network: Network code.
+    @param station: Station code.
+    @param args: argparse Namespace object.
+    @return: True if the station is wanted.
+    """
+    if args.stations is None:
+        return True
+    stations = args.stations.split(',')
+    return station in stations or '%s.%s' % (network,station) in stations
+
+def keepLocation(lat,lon,args,epicenter=None):
+    """
+    Apply the --bbox and --max-distance prefilters.
+    @param lat: Station latitude.
+    @param lon: Station longitude.
+    @param args: argparse Namespace object.
+    @keyword epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @return: True if the station location is wanted.
+    """
+    if args.bbox is not None:
+        lonmin,lonmax,latmin,latmax = args.bbox
+        if lon < lonmin or lon > lonmax or lat < latmin or lat > latmax:
+            return False
+    if args.maxDistance is not None and epicenter is not None:
+        from obspy.core.util.geodetics import gps2DistAzimuth
+        distance,az1,az2 = gps2DistAzimuth(epicenter[0],epicenter[1],lat,lon)
+        if distance/1000.0 > args.maxDistance:
+            return False
+    return True
+
+def streamTraces(fetched):
+    """
+    Pass through the (trace,header) tuples of a fetcher's fetchTraces() generator, turning any error
+    raised while downloading into a StrongMotionFetcherException.
+    @param fetched: Generator of (trace,header) tuples.
+    @return: Generator of (trace,header) tuples.
+    """
+    try:
+        for item in fetched:
+            yield item
+    except StrongMotionFetcherException:
+        raise
+    except Exception as e:
+        raise StrongMotionFetcherException(str(e))
+
+def readTraces(source,datafiles,args,epicenter=None,parser=None,filechannels=None):
+    """
+    Lazily read traces from a list of data files, one file at a time.
+
+    Only the traces from the current file are held in memory, so that trace2xml can reduce each
+    one to its peak values and discard the waveform before the next file is read.
+    With --cache or --cache-dir, ASCII files are parsed once, and later runs map the cached samples instead.
+    With more than one read job, files are parsed by a pool of worker processes, in the same order.
+
+    If station prefilters are in use, the headers of all files are scanned first, so that files with
+    no wanted channels are never read in full.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param datafiles: List of data file paths.
+    @param args: argparse Namespace object.
+    @keyword epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @keyword parser: ObsPy Parser object, or None if coordinates are stored in the trace stats.
+    @keyword filechannels: Dictionary which, if supplied, is filled with data file path:list of channel ids
+                           for each file that was read successfully.
+    @return: Generator of ObsPy Trace objects.
+    """
+    prefilter = hasPrefilter(args)
+    cache = None
+    if args.cache or args.cacheDir:
+        from smtools.cache import TraceCache
+        cache = TraceCache(args.cacheDir)
+    jobs = args.readJobs
+    if jobs is None:
+        jobs = args.jobs
+    if prefilter:
+        keepfiles = []
+        for dfile,headers,error in iterFiles(source,datafiles,args,cache=cache,headonly=True,jobs=jobs):
+            if error is not None:
+                sys.stderr.write('Could not read the headers of data file %s: "%s"\n' % (dfile,error))
+            headers = [trace for trace in headers if keepTrace(trace,args,epicenter,parser)]
+            if len(headers):
+                keepfiles.append(dfile)
+        sys.stderr.write('%i of %i files contain channels passing the station filters.\n' % (len(keepfiles),len(datafiles)))
+        datafiles = keepfiles
+    nfailed = 0
+    for dfile,traces,error in iterFiles(source,datafiles,args,cache=cache,jobs=jobs):
+        if error is not None:
+            sys.stderr.write('Could not read data file %s: "%s"\n' % (dfile,error))
+            nfailed += 1
+        elif filechannels is not None:
+            filechannels[dfile] = ['%s.%s.%s.%s' % (trace.stats['network'],trace.stats['station'],
+                                                    trace.stats['location'],trace.stats['channel']) for trace in traces]
+        #pop from the end of the list (so that each trace can be freed once it has been handled)
+        traces.reverse()
+        while len(traces):
+            trace = traces.pop()
+            if prefilter and not keepTrace(trace,args,epicenter,parser):
+                continue
+            yield trace
+    if nfailed:
+        sys.stderr.write('%i of %i data files could not be read.\n' % (nfailed,len(datafiles)))
+
+def getSACResponse(inputfolder,etime,required=True):
+    """
+    Find the instrument response information that must accompany SAC data files.
+    @param inputfolder: Folder containing SAC data files.
+    @param etime: Origin time of the event (used as the date of RESP file responses).
+    @keyword required: If True, exit when there is no response information, otherwise return (None,None)
+                       so that the SAC files can be skipped (e.g., SAC files found in a folder of mixed data).
+    @return: Tuple of (SeedInventory object or None,seedresp dictionary or None).
+    """
+    import obspy
+    parser = None
+    seedresp = None
+    seedfiles = glob.glob(os.path.join(inputfolder,'*.seed'))
+    respfiles = glob.glob(os.path.join(inputfolder,'*.resp'))
+    if not len(seedfiles):
+        if not len(respfiles):
+            if required:
+                print('A dataless SEED file (ending in .seed) or a RESP file (ending in .resp) must be supplied with input SAC files. Exiting.')
+                sys.exit(1)
+            print('No dataless SEED file (ending in .seed) or RESP file (ending in .resp) found for the SAC files. Skipping them.')
+        else:
+            seedresp = {'filename': respfiles[0],  # RESP filename
+            # when using Trace/Stream.simulate() the "date" parameter can
+            # also be omitted, and the starttime of the trace is then used.
+            'date': obspy.UTCDateTime(etime),
+            # Units to return response in ('DIS', 'VEL' or ACC)
+            'units': 'ACC'
+            }
+    else:
+        #all of the seed files are indexed once, and the indexes reused on later runs
+        from smtools.inventory import SeedInventory
+        parser = SeedInventory(sorted(seedfiles))
+    return (parser,seedresp)
+
+def getManifestKey(args):
+    """
+    Describe the options that change the amplitude records made from the files of an input folder.
+
+    Records kept in the folder manifest are only re-used if this key matches the one they were made with.
+    (The station prefilters are applied to re-used records instead - see keepRecord().)
+    @param args: argparse Namespace object.
+    @return: Dictionary of data source, rotation option, and the names, sizes and modification times of
+             the folder's response (.seed and .resp) files.
+    """
+    responses = []
+    for rfile in sorted(glob.glob(os.path.join(args.inputFolder,'*.seed'))+glob.glob(os.path.join(args.inputFolder,'*.resp'))):
+        fstat = os.stat(rfile)
+        responses.append([os.path.basename(rfile),fstat.st_size,fstat.st_mtime_ns])
+    return {'source':args.source,
+            'noRotation':args.noRotation,
+            'responses':responses}
+
+def findInputFiles(source,inputfolder,manifest=None):
+    """
+    Find the data files for a source in an input folder.
+    @param source: Name of data source (knet, geonet, etc.), or 'auto' to detect the source of each file.
+    @param inputfolder: Folder containing data files.
+    @keyword manifest: Manifest object for the folder (for incremental processing), or None.
+    @return: Tuple of (OrderedDict of source name:list of data files,set of data files unchanged since the
+             manifest was written).
+    """
+    unchanged = set()
+    if manifest is not None:
+        allfiles,unchanged = manifest.scan()
+    elif source == 'auto':
+        allfiles = [os.path.join(inputfolder,fname) for fname in sorted(os.listdir(inputfolder))]
+        allfiles = [dfile for dfile in allfiles if os.path.isfile(dfile)]
+    if source == 'auto':
+        groups,unknown = sources.classifyFiles(allfiles,manifest=manifest,unchanged=unchanged)
+        for dsource,datafiles in groups.items():
+            sys.stderr.write('Found %i %s data files.\n' % (len(datafiles),dsource))
+        if len(unknown):
+            sys.stderr.write('Ignoring %i files in an unrecognized format.\n' % len(unknown))
+        return (groups,unchanged)
+    if manifest is not None:
+        datafiles = [dfile for dfile in allfiles if sources.matchesSource(source,dfile)]
+    else:
+        datafiles = sources.findFiles(source,inputfolder)
+    if source == 'knet' and not len(datafiles):
+        #read un-extracted tar files instead
+        datafiles = glob.glob(os.path.join(inputfolder,'*.tar.gz'))+glob.glob(os.path.join(inputfolder,'*.tar'))
+    if source == 'sac' and not len(datafiles):
+        #traces trimmed by filtertrace.py (still uncalibrated, so they need the folder's response files)
+        datafiles = sources.findFiles('smt',inputfolder) + sources.findFiles('pickle',inputfolder)
+    return (collections.OrderedDict([(source,datafiles)]),unchanged)
+
+def processTraces(source,traces,datafiles,args,parser,seedresp,outfolder,epicenter,deadline,records=None):
+    """
+    Convert traces to peak ground motions, and write them to the source's data file.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param traces: Sequence of ObsPy Trace objects.
+    @param datafiles: List of the data files the traces were read from (removed if -n was given).
+    @param args: argparse Namespace object.
+    @param parser: ObsPy Parser object, or None.
+    @param seedresp: seedresp dictionary, or None.
+    @param outfolder: Folder where the data file should be written.
+    @param epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @param deadline: time.time() value after which channels are skipped (or only PGA computed), or None.
+    @keyword records: List of amplitude records from earlier runs, to which the new records are appended.
+    """
+    stationfile,plotfiles,tag = trace2xml.trace2xml(traces,parser,outfolder,source,doPlot=args.doPlot,seedresp=seedresp,
+                                                    progressive=args.progressive,epicenter=epicenter,
+                                                    flushStations=args.flushStations,flushSeconds=args.flushSeconds,
+                                                    deadline=deadline,deadlinePGA=args.deadlinePGA,
+                                                    jobs=args.jobs,records=records)
+    if args.debug:
+        os.remove(stationfile)
+        for pfile in plotfiles:
+            os.remove(pfile)
+        printTag(tag)
+
+    #if the user specified an input folder, but did not specify to keep, keep anyway
+    if args.nuke:
+        for dfile in datafiles:
+            os.remove(dfile)
+    else:
+        if not args.debug:
+            nchannels = sum([len(stationtag.getChildren('comp')) for stationtag in tag.getChildren('station')])
+            sys.stderr.write('Wrote %i channels to data file %s\n' % (nchannels,stationfile))
+
 def main(args,config):
+    starttime = time.time()
     if args.listSources:
         print('%-15s\t%-40s' % ('Network','Description'))
         print('------------------------------------------')
-        for key,value in SUPPORTED_NETWORKS.items():
-            print('%-15s\t%-40s' % (key,value))
+        for key in sources.getSourceNames():
+            print('%-15s\t%-40s' % (key,sources.getSource(key)['description']))
         sys.exit(0)
         
     if args.doConfig:
         doConfig()
         sys.exit(0)
+    webclient.setTimeout(args.httpTimeout)
+    webclient.setOffline(args.offline)
     if args.eventID and config is None:
         print('To specify event ID, you must have configured the ShakeHome parameter in the config file.')
         print('Re-run with -config.  Returning.')
@@ -123,7 +476,20 @@ def main(args,config):
     if (args.user and not args.password) or (args.password and not args.user):
         print('You must supply both KNET username AND password')
         sys.exit(1)
+
+    if args.maxDistance is not None and not (args.eventID or args.Params):
+        print('The --max-distance option requires an event ID or hypocenter.')
+        sys.exit(1)
+
+    if args.incremental and not args.inputFolder:
+        print('The --incremental option requires an input folder (-i).')
+        sys.exit(1)
+
+    if args.source == 'auto' and not args.inputFolder:
+        print('Specify a data source to download data, or an input folder (-i) to detect the source of each file.')
+        sys.exit(1)
         
+    etime,lat,lon = (None,None,None)
     if args.eventID:
         eventfile = os.path.join(config.get('SHAKEMAP','shakehome'),'data',args.eventID,'input','event.xml')
         etime,lat,lon = util.parseEvent(eventfile)
@@ -133,18 +499,19 @@ def main(args,config):
         lat = args.Params.lat
         lon = args.Params.lon
 
-    #Most formats are pre-calibrated, so we'll set parse to None for those.
-    #Those formats that need a parser object (like SAC data files need a dataless SEED file)
-    #will fill in the parser object below.
-    parser = None
-    seedresp = None
     datafiles = []
+    traces = None
+    manifest = None
+    unchanged = set()
     if not args.inputFolder:
         if args.source == 'orfeus':
+            orfeus = sources.getModule('orfeus')
             stationlist = orfeus.getAmps(lat,lon,etime,args.timeWindow,args.radius)
             outfile,stationlist_tag = trace2xml.amps2xml(stationlist,outfolder,'orfeus')
             print('Wrote amps from %i stations to data file %s\n' % (len(stationlist),outfile))
             sys.exit(0)
+        fetchargs = []
+        fetchkwargs = {}
         if args.source == 'knet':
             if not args.user:
                 user = config.get('KNET','user')
@@ -152,167 +519,88 @@ def main(args,config):
             else:
                 user = args.user
                 password = args.password
-            sys.stderr.write('Fetching strong motion data from NIED...\n')
-            fetcher = knet.KNETFetcher(user,password)
-        elif args.source == 'geonet':
-            sys.stderr.write('Fetching strong motion data from GeoNet...\n')
-            fetcher = geonet.GeonetFetcher()
-        elif args.source == 'turkey':
-            sys.stderr.write('Fetching strong motion data from Turkey...\n')
-            fetcher = turkey.TurkeyFetcher()
-        elif args.source == 'iran':
-            print('Automated downloading of Iran strong motion data is not supported.  Use the -i option instead.')
-            print('Obtain strong motion records from: http://www.bhrc.ac.ir/portal/Default.aspx?tabid=635')
-            sys.exit(1)
-        elif args.source == 'sac':
-            print('Automated downloading of SAC strong motion data is not supported.  Use the -i option instead.')
-            print('SAC is a data standard, not a source.  You will need to have obtained SAC data from your own source.')
-            sys.exit(1)
-        elif args.source == 'chile':
-            print('Automated downloading of Chilean calibrated ASCII strong motion data is not supported.  Use the -i option instead.')
-            sys.exit(1)
-        elif args.source == 'pickle':
-            print('Automated downloading of Chilean calibrated ASCII strong motion data is not supported.  Use the -i option instead.')
-            sys.exit(1)
+            fetchargs = [user,password]
         elif args.source == 'iris':
-            sys.stderr.write('Fetching strong motion and broadband data from IRIS...\n')
-            fetcher = iris.IrisFetcher(verbose=args.verbose) #will get strong motion AND broadband
-        elif args.source == 'italy':
-            print('Automated downloading of Italian strong motion data is not supported.  Use the -i option instead.')
-            sys.exit(1)
-        elif args.source == 'unam':
-            print('Automated downloading of Mexican (UNAM) strong motion data is not supported.  Use the -i option instead.')
-            sys.exit(1)
-        else:
-            print('Data source %s not supported.' % args.source)
+            fetchkwargs['verbose'] = args.verbose #will get strong motion AND broadband
+        fetcher = sources.getFetcher(args.source,*fetchargs,**fetchkwargs)
+        if fetcher is None:
+            print(sources.getSource(args.source)['fetchmsg'])
             sys.exit(1)
+        sys.stderr.write(sources.getSource(args.source)['fetchmsg']+'\n')
         try:
-            datafiles = fetcher.fetch(lat,lon,etime,args.radius,args.timeWindow,rawfolder)
+            if args.source in ['knet','iris']:
+                #hand the downloaded records straight to trace2xml (knet parses them out of the tar file,
+                #iris keeps them in memory), only writing them to disk if we're keeping them
+                keepfolder = rawfolder
+                if args.nuke:
+                    keepfolder = None
+                traces = (trace for trace,header in streamTraces(fetcher.fetchTraces(lat,lon,etime,args.radius,
+                                                                                      args.timeWindow,rawfolder=keepfolder))
+                          if not hasPrefilter(args) or keepTrace(trace,args,(lat,lon)))
+            else:
+                datafiles = fetcher.fetch(lat,lon,etime,args.radius,args.timeWindow,rawfolder)
         except Exception as e:
             print('(Possible) error in trying to download data from %s.  \n"%s"\n' % (args.source,str(e)))
-        sys.stderr.write('Retrieved %i files.\n' % len(datafiles))
+        if traces is None:
+            sys.stderr.write('Retrieved %i files.\n' % len(datafiles))
+        groups = collections.OrderedDict([(args.source,datafiles)])
     else: 
         
         if not os.path.isdir(args.inputFolder):
             print('Could not find folder "%s".  Exiting.' % args.inputFolder)
             sys.exit(1)
         if args.source == 'orfeus':
-            print('Offline data processing not supported for Orfeus.')
+            print(sources.getSource('orfeus')['fetchmsg'])
             sys.exit(1)
-        if args.source == 'knet':
-            datafiles1 = glob.glob(os.path.join(args.inputFolder,'*.NS'))
-            datafiles2 = glob.glob(os.path.join(args.inputFolder,'*.EW'))
-            datafiles3 = glob.glob(os.path.join(args.inputFolder,'*.UD'))
-            datafiles = datafiles1+datafiles2+datafiles3
-        elif args.source == 'geonet':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.V1A'))
-        elif args.source == 'turkey':
-            datafiles1 = glob.glob(os.path.join(args.inputFolder,'*.txt'))
-            datafiles = []
-            for d in datafiles1:
-                dpath,dfile = os.path.split(d)
-                if re.match('[0-9]{4}',dfile) is not None:
-                    datafiles.append(d)
-        elif args.source == 'iran':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.V1'))
-        elif args.source == 'chile':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.asc'))
-        elif args.source == 'pickle':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.pickle'))
-        elif args.source == 'iris':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.sac'))
-        elif args.source == 'italy':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*DAT'))
-        elif args.source == 'sac':
-            datafiles = glob.glob(os.path.join(args.inputFolder,'*.sac'))
-            if not len(datafiles):
-                datafiles = glob.glob(os.path.join(args.inputFolder,'*.pickle'))
-            seedfiles = glob.glob(os.path.join(args.inputFolder,'*.seed'))
-            respfiles = glob.glob(os.path.join(args.inputFolder,'*.resp'))
-            if not len(seedfiles):
-                if not len(respfiles):
-                    print('A dataless SEED file (ending in .seed) or a RESP file (ending in .resp) must be supplied with input SAC files. Exiting.')
-                    sys.exit(1)
-                else:
-                    seedresp = {'filename': respfiles[0],  # RESP filename
-                    # when using Trace/Stream.simulate() the "date" parameter can
-                    # also be omitted, and the starttime of the trace is then used.
-                    'date': obspy.UTCDateTime(etime),
-                    # Units to return response in ('DIS', 'VEL' or ACC)
-                    'units': 'ACC'
-                    }
-            else:
-                parser = Parser(seedfiles[0])
-        elif args.source == 'unam':
-            tdatafiles = glob.glob(os.path.join(args.inputFolder,'*')) #grab everything
-            datafiles = []
-            for dfile in tdatafiles:
-                fname,fext = os.path.splitext(dfile)
-                if re.match('\d',fext[1:]) is not None:
-                    datafiles.append(dfile)
-        else:
-            print('Data source %s not supported.' % args.source)
-            sys.exit(1)
-        
+        if args.incremental:
+            manifest = Manifest(args.inputFolder,key=getManifestKey(args))
+        groups,unchanged = findInputFiles(args.source,args.inputFolder,manifest=manifest)
     
-    traces = []
-    for dfile in datafiles:
-        if args.source == 'knet':
-            if dfile.endswith('1'): #these files are KikNet downhole (deep) stations
+    epicenter = None
+    if lat is not None:
+        epicenter = (lat,lon)
+    deadline = None
+    if args.deadline is not None:
+        deadline = starttime + args.deadline
+    for source,datafiles in groups.items():
+        #Most formats are pre-calibrated, so we'll set parse to None for those.
+        #Those formats that need a parser object (like SAC data files need a dataless SEED file)
+        #will fill in the parser object below.
+        parser = None
+        seedresp = None
+        if source == 'sac' and args.inputFolder:
+            parser,seedresp = getSACResponse(args.inputFolder,etime,required=(args.source == 'sac'))
+            if parser is None and seedresp is None:
                 continue
-            trace,header = knet.readknet(dfile)
-            traces.append(trace)
-        elif args.source == 'geonet':
-            tracelist,headers = geonet.readgeonet(dfile)
-            traces = traces + tracelist
-        elif args.source == 'turkey':
-            tracelist,headers = turkey.readturkey(dfile)
-            traces = traces + tracelist
-        elif args.source == 'iran':
-            doRotation = True
-            if args.noRotation:
-                doRotation = False
-            tracelist,headers = iran.readiran(dfile,doRotation=doRotation)
-            traces = traces + tracelist
-        elif args.source == 'iris':
-            trace = iris.readiris(dfile)
-            traces.append(trace)
-        elif args.source == 'italy':
-            trace = italy.readitaly(dfile)
-            traces.append(trace)
-        elif args.source == 'chile':
-            trace = chile.readchile(dfile)
-            traces.append(trace)
-        elif args.source == 'pickle':
-            stream = obspy.core.read(dfile)
-            for trace in stream:
-                traces.append(trace)
-        elif args.source == 'unam':
-            tracelist,headers = unam.readunam(dfile)
-            traces = traces + tracelist
-        elif args.source == 'sac':
-            stream = obspy.read(dfile)
-            for trace in stream:
-                traces.append(trace)
-        else:
-            print('Source %s is not supported' % (args.source))
-            sys.exit(1)
-    if len(datafiles):
-        sys.stderr.write('Converting %i files to peak ground motion...\n' % len(datafiles))
-        stationfile,plotfiles,tag = trace2xml.trace2xml(traces,parser,outfolder,args.source,doPlot=args.doPlot,seedresp=seedresp)
-        if args.debug:
-            os.remove(stationfile)
-            for pfile in plotfiles:
-                os.remove(pfile)
-            printTag(tag)
-
-        #if the user specified an input folder, but did not specify to keep, keep anyway
-        if args.nuke:
-            for dfile in datafiles:
-                os.remove(dfile)
-        else:
-            if not args.debug:
-                sys.stderr.write('Wrote %i channels to data file %s\n' % (len(traces),stationfile))
+        records = None
+        if manifest is not None:
+            #re-use the amplitudes of files that have not changed since the last run
+            records = manifest.getRecords([dfile for dfile in datafiles if dfile in unchanged])
+            if hasPrefilter(args):
+                records = [record for record in records if keepRecord(record,args,epicenter)]
+            nfiles = len(datafiles)
+            datafiles = [dfile for dfile in datafiles if dfile not in unchanged]
+            sys.stderr.write('%i of %i %s files are new or modified.\n' % (len(datafiles),nfiles,source))
+        filechannels = {}
+        if traces is not None:
+            sys.stderr.write('Converting downloaded records to peak ground motion...\n')
+        elif len(datafiles):
+            sys.stderr.write('Converting %i files to peak ground motion...\n' % len(datafiles))
+            traces = readTraces(source,datafiles,args,epicenter=epicenter,parser=parser,filechannels=filechannels)
+        if traces is None and records:
+            traces = [] #nothing new, but the data file still has to hold the old records
+        if traces is not None:
+            try:
+                processTraces(source,traces,datafiles,args,parser,seedresp,outfolder,epicenter,deadline,records=records)
+            except StrongMotionFetcherException as e:
+                #the downloaded traces are streamed, so download errors only surface while processing
+                print('(Possible) error in trying to download data from %s.  \n"%s"\n' % (args.source,str(e)))
+                sys.exit(1)
+        if manifest is not None:
+            manifest.update(source,filechannels,records)
+        traces = None
+    if manifest is not None:
+        manifest.save()
     sys.exit(0)
 
 if __name__ == '__main__':
@@ -398,12 +686,28 @@ if __name__ == '__main__':
         To download data from Italy:
         Download ASCII corrected files. Copy onto your local machine
         getstrong.py italy -e EVENT ID -i PATH WHERE DATA IS LOCATED
+
+        ###############################################################
+        Rapid response:
+        To process the nearest stations first, rewriting the data file as results arrive,
+        and giving up on (or computing only PGA for) channels not processed within 5 minutes:
+        getstrong.py knet -e EVENTID --progressive --deadline 300 [--deadline-pga]
+        To only read the channels of stations within 100 km of the epicenter (headers of the
+        other files are scanned, but their samples are never read):
+        getstrong.py knet -e EVENTID -i PATH --max-distance 100
+        To keep a binary copy of the parsed ASCII files, so that reprocessing the same folder
+        does not parse them again:
+        getstrong.py knet -e EVENTID -i PATH --cache [--cache-dir CACHEDIR]
+        To process a folder of files from several sources (one data file is written per source):
+        getstrong.py -e EVENTID -i PATH
+        To only process the files added to or modified in a folder since the last run (the amplitudes of
+        the other files are taken from the manifest file written in the folder):
+        getstrong.py -e EVENTID -i PATH --incremental
         '''
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=argparse.RawDescriptionHelpFormatter,)
-    parser.add_argument('source',help='Specify strong motion data source.',choices=['knet','geonet','turkey','iran',
-                                                                                    'iris','italy','unam','orfeus',
-                                                                                    'sac','chile','pickle'])
+    parser.add_argument('source',help='Specify strong motion data source (default: detect the source of each file in the input folder).',
+                        nargs='?',default='auto',choices=sources.getSourceNames()+['auto'])
     parser.add_argument('-s','-sources',dest='listSources',action='store_true',default=False,
                         help='Describe various sources for strong motion data')
     parser.add_argument('-c','-config',dest='doConfig',action='store_true',default=False,
@@ -429,6 +733,36 @@ if __name__ == '__main__':
                         help='Do NOT apply rotation to IRAN longitudinal/transverse channels')
     parser.add_argument('-v','--verbose',dest='verbose',action='store_true',default=False,
                         help='Print out progress/warning messages')
+    parser.add_argument('-j','--jobs',dest='jobs',type=int,default=1,
+                        help='Number of worker processes used to process channels (default: %(default)s).')
+    parser.add_argument('--read-jobs',dest='readJobs',type=int,
+                        help='Number of worker processes used to read data files (defaults to the value of -j).')
+    parser.add_argument('--progressive',dest='progressive',action='store_true',default=False,
+                        help='Process nearest stations first, and rewrite the data file as results arrive')
+    parser.add_argument('--flush-stations',dest='flushStations',type=int,default=trace2xml.FLUSH_STATIONS,
+                        help='In progressive mode, rewrite the data file after this many stations (default: %(default)s).')
+    parser.add_argument('--flush-seconds',dest='flushSeconds',type=float,default=trace2xml.FLUSH_SECONDS,
+                        help='In progressive mode, rewrite the data file after this many seconds (default: %(default)s).')
+    parser.add_argument('--deadline',dest='deadline',type=float,
+                        help='Skip channels not processed within this many seconds of startup')
+    parser.add_argument('--deadline-pga',dest='deadlinePGA',action='store_true',default=False,
+                        help='Compute PGA only (rather than skipping) for channels processed after the deadline')
+    parser.add_argument('--max-distance',dest='maxDistance',type=float,
+                        help='Only process stations within this distance (km) of the epicenter')
+    parser.add_argument('--bbox',dest='bbox',type=float,nargs=4,metavar=('LONMIN','LONMAX','LATMIN','LATMAX'),
+                        help='Only process stations inside this bounding box')
+    parser.add_argument('--stations',dest='stations',
+                        help='Only process these stations (comma separated list of STA or NET.STA codes)')
+    parser.add_argument('--cache',dest='cache',action='store_true',default=False,
+                        help='Cache parsed ASCII data files in binary sidecar files next to them')
+    parser.add_argument('--cache-dir',dest='cacheDir',
+                        help='Cache parsed ASCII data files in this folder instead (implies --cache)')
+    parser.add_argument('--incremental',dest='incremental',action='store_true',default=False,
+                        help='Only process files in the input folder that are new or modified since the last run')
+    parser.add_argument('--http-timeout',dest='httpTimeout',type=float,default=webclient.DEFAULT_TIMEOUT,
+                        help='Seconds to wait for a web server when downloading data (default %(default)s)')
+    parser.add_argument('--offline',dest='offline',action='store_true',default=False,
+                        help='Do not contact any web server - use only catalog and event pages saved in the response cache (~/.smtools/httpcache)')
     pargs = parser.parse_args()
     main(pargs,config)    
     
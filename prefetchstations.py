@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import sys
+import argparse
+
+#local imports
+from smtools.stationcache import StationCache,STATIONDIR
+from smtools.iris import expandChannels
+
+def main(args):
+    channels = expandChannels(args.channels)
+    cache = StationCache(cachedir=args.cachedir,source=args.source)
+    try:
+        inventory = cache.getInventory(args.lat,args.lon,args.radius,channels)
+    except Exception as error:
+        print('Could not download station metadata from %s: %s' % (args.source,error))
+        sys.exit(1)
+    if inventory is None:
+        print('No %s stations with channels %s found within %.1f km of (%.3f,%.3f).' % (args.source,channels,args.radius,args.lat,args.lon))
+        sys.exit(0)
+    contents = inventory.get_contents()
+    print('Station cache in %s holds %i stations (%i channels) within %.1f km of (%.3f,%.3f).' % (cache.cachedir,len(set(contents['stations'])),
+                                                                                                len(set(contents['channels'])),
+                                                                                                args.radius,args.lat,args.lon))
+
+if __name__ == '__main__':
+    desc = '''Download station metadata (coordinates and responses) for a region into the local station cache.
+
+    getstrong.py iris takes station metadata from this cache, and only downloads waveforms.  Regions
+    that have not been prefetched are downloaded on first use.  Running this again for a region that is
+    already cached only downloads the stations that have changed since the last run.
+
+    Warm the cache with the strong motion stations within 500 km of Ridgecrest, CA:
+
+    prefetchstations.py 35.77 -117.60 500
+    '''
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lat',type=float,help='Latitude of region center.')
+    parser.add_argument('lon',type=float,help='Longitude of region center.')
+    parser.add_argument('radius',type=float,help='Radius of region (km).')
+    parser.add_argument('-c','--channels',default='strong motion',
+                        help='"strong motion", "broadband", "short period", or comma separated channel codes (default "strong motion").')
+    parser.add_argument('-s','--source',default='IRIS',
+                        help='FDSN data center (default IRIS).')
+    parser.add_argument('-d','--cachedir',default=STATIONDIR,
+                        help='Station cache folder (default %s).' % STATIONDIR)
+    pargs = parser.parse_args()
+    main(pargs)
@@ -8,13 +8,15 @@ from configparser import ConfigParser,RawConfigParser
 import argparse
 
 #third party imports
-from neicio.shake import ShakeGrid
 from xml.dom import minidom
 import numpy as np
-import matplotlib.pyplot as plt
-from obspy.core.util.geodetics import gps2DistAzimuth
 
 def main(args,config):
+    #these are slow to import, so don't make --help pay for them
+    from neicio.shake import ShakeGrid
+    import matplotlib.pyplot as plt
+    from obspy.core.util.geodetics import gps2DistAzimuth
+    
     eventid = args.eventID
     shakehome = config.get('SHAKEMAP','shakehome')
     xmlfile = os.path.join(shakehome,'data',eventid,'input',args.dataFile)
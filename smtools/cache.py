@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+import hashlib
+
+#third party
+from obspy.core.trace import Trace
+from obspy.core.utcdatetime import UTCDateTime
+import numpy as np
+
+from . import util
+from .sources import SIDECAR_EXT
+
+CACHEVERSION = 1 #bump this when the readers change the way they scale or label data
+SKIPKEYS = ['npts','endtime'] #stats values that are derived from the samples
+
+def encodeValue(value):
+    """
+    Convert a Stats value into something that can be written to JSON.
+    @param value: Stats value (UTCDateTime, AttribDict, numpy scalar, etc.)
+    @return: JSON-serializable version of value.
+    """
+    if isinstance(value,UTCDateTime):
+        return {'__utcdatetime__':str(value)}
+    if hasattr(value,'items'):
+        return dict([(key,encodeValue(subvalue)) for key,subvalue in value.items()])
+    if isinstance(value,(list,tuple)):
+        return [encodeValue(subvalue) for subvalue in value]
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+def decodeValue(value):
+    """
+    Reverse encodeValue().
+    @param value: Value read from JSON.
+    @return: Stats value.
+    """
+    if isinstance(value,dict):
+        if '__utcdatetime__' in value:
+            return UTCDateTime(value['__utcdatetime__'])
+        return dict([(key,decodeValue(subvalue)) for key,subvalue in value.items()])
+    if isinstance(value,list):
+        return [decodeValue(subvalue) for subvalue in value]
+    return value
+
+class TraceCache(object):
+    """
+    Binary cache of the traces parsed from ASCII data files.
+
+    The samples of all of the traces in a data file are saved in one .npy file, and their stats in a
+    JSON file alongside it.  The cache entry is only used if the size and modification time of the data
+    file (and the tag describing how it was read) match the values recorded in the JSON file.
+
+    Cached samples are memory-mapped copy-on-write, so that processing can still modify them
+    in place without touching the cache files.
+    """
+    def __init__(self,cachedir=None):
+        """
+        Constructor
+        @keyword cachedir: Folder in which to store cache files, or None to write them
+                           next to the data files (i.e., data.V1A.smcache.npy).
+        """
+        self.cachedir = cachedir
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def getPaths(self,dfile):
+        """
+        Get the cache file names for a data file.
+        @param dfile: Path to data file.
+        @return: Tuple of (.npy file,.json file) paths.
+        """
+        if self.cachedir is None:
+            base = dfile + SIDECAR_EXT
+        else:
+            dpath = os.path.abspath(dfile)
+            digest = hashlib.sha1(dpath.encode('utf-8')).hexdigest()
+            base = os.path.join(self.cachedir,os.path.basename(dfile)+'.'+digest[0:16])
+        return (base+'.npy',base+'.json')
+
+    def getKey(self,dfile,tag):
+        """
+        Get the values that identify the current contents of a data file.
+        @param dfile: Path to data file.
+        @param tag: String describing the reader and its options.
+        @return: Dictionary of version,size,mtime and tag.
+        """
+        fstat = os.stat(dfile)
+        return {'version':CACHEVERSION,
+                'size':fstat.st_size,
+                'mtime':fstat.st_mtime_ns,
+                'tag':tag}
+
+    def load(self,dfile,tag='',headonly=False):
+        """
+        Load the traces of a data file from the cache.
+        @param dfile: Path to data file.
+        @keyword tag: String describing the reader and its options.
+        @keyword headonly: If True, do not map the samples (see util.headerTrace()).
+        @return: List of ObsPy Trace objects, or None if there is no valid cache entry for the file.
+        """
+        npyfile,jsonfile = self.getPaths(dfile)
+        if not os.path.isfile(jsonfile) or not os.path.isfile(npyfile):
+            return None
+        try:
+            f = open(jsonfile,'rt')
+            jdict = json.load(f)
+            f.close()
+        except ValueError:
+            return None
+        if jdict['key'] != self.getKey(dfile,tag):
+            return None
+        data = None
+        if not headonly:
+            data = np.load(npyfile,mmap_mode='c')
+        traces = []
+        for channel in jdict['channels']:
+            header = decodeValue(channel['stats'])
+            if headonly:
+                header['npts'] = channel['npts']
+                traces.append(util.headerTrace(header))
+                continue
+            offset = channel['offset']
+            trace = Trace(data[offset:offset+channel['npts']],header=header)
+            traces.append(trace)
+        return traces
+
+    def save(self,dfile,traces,tag=''):
+        """
+        Save the traces read from a data file to the cache.
+
+        This must be called before the traces are processed (processing modifies samples in place).
+        @param dfile: Path to data file.
+        @param traces: List of ObsPy Trace objects read from dfile.
+        @keyword tag: String describing the reader and its options.
+        """
+        npyfile,jsonfile = self.getPaths(dfile)
+        channels = []
+        offset = 0
+        for trace in traces:
+            stats = dict([(key,value) for key,value in trace.stats.items() if key not in SKIPKEYS])
+            channels.append({'offset':offset,
+                             'npts':len(trace.data),
+                             'stats':encodeValue(stats)})
+            offset += len(trace.data)
+        data = np.empty(offset,dtype=np.float64)
+        for trace,channel in zip(traces,channels):
+            data[channel['offset']:channel['offset']+channel['npts']] = trace.data
+        jdict = {'key':self.getKey(dfile,tag),
+                 'channels':channels}
+        #write the samples first, and the JSON last, so that a partially written entry is never valid
+        f = open(npyfile+'.tmp','wb')
+        np.save(f,data)
+        f.close()
+        os.replace(npyfile+'.tmp',npyfile)
+        f = open(jsonfile+'.tmp','wt')
+        json.dump(jdict,f)
+        f.close()
+        os.replace(jsonfile+'.tmp',jsonfile)
@@ -7,7 +7,6 @@ import os.path
 import re
 
 #local
-from .trace2xml import trace2xml
 from . import util
 
 #third party
@@ -15,27 +14,26 @@ from obspy.core.trace import Trace
 from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
-from obspy.signal import rotate
 import numpy as np
-import matplotlib.pyplot as plt
 
 INTIMEFMT = '%Y-%m-%dT%H:%M:%S'
 FLOATRE = "[-+]?[0-9]*\.?[0-9]+."
 INTRE = "[-+]?[0-9]*"
 
 
-def readchile(ascfile):
+def readchile(ascfile,headonly=False):
     """
     Read strong motion data from an ASCII data file from Chile.
     @param ascfile: Path to a valid ASCII data file.
+    @keyword headonly: If True, skip the data, and return a trace with no samples (npts is set from the header).
     @return: List of ObsPy Trace objects, containing accelerometer data in m/s.
     """
-    f = open(ascfile,'rt')
+    f = open(ascfile,'rb')
     tracelist = []
     hdrdict = {}
-    startdata = False
-    data = []
-    for line in f.readlines():
+    block = b''
+    for rawline in f:
+        line = rawline.decode('latin-1')
         if line.startswith('#'):
             if line.startswith('# Tiempo'):
                 parts = line.split()
@@ -74,15 +72,21 @@ def readchile(ascfile):
                     raise ValueError('Unsupported units of "%s".' % units)
                 continue
         else:
-            data.append(float(line.strip()))
-    data = np.array(data)
-    data *= calib
+            #first data line - the rest of the file is the data block, one sample per line
+            if not headonly:
+                block = rawline + f.read()
+            break
+    f.close()
     hdrdict['calib'] = calib
     hdrdict['delta'] = 1.0/hdrdict['sampling_rate']
     hdrdict['duration'] = hdrdict['starttime'] + hdrdict['delta']*hdrdict['npts']
     hdrdict['network'] = 'C1' #chile doesn't put network in their headers, so we have to guess here.  C1 is the right answer sometimes.
     hdrdict['units'] = 'acc'
     hdrdict['height'] = 0.0
+    if headonly:
+        return util.headerTrace(hdrdict)
+    data = util.decodeBlock(block,npts=hdrdict['npts'])
+    data *= calib
     stats = Stats(hdrdict)
     trace = Trace(data,header=stats)
     return trace
@@ -92,6 +96,7 @@ if __name__ == '__main__':
     traces = readchile(ascfile)
     trace = traces[0]
     trace.plot()
+    import matplotlib.pyplot as plt
     plt.savefig('chile.png')
     print(trace.data.max())
     print(trace.stats['calib'])
@@ -10,12 +10,15 @@ import sys
 import os.path
 import urllib.parse
 import ftplib
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import urllib.request, urllib.error, urllib.parse
 
 #local
 from .fetcher import StrongMotionFetcher,StrongMotionFetcherException
-from .trace2xml import trace2xml
 from . import util
+from . import webclient
 
 #third party
 from obspy.core.trace import Trace
@@ -23,7 +26,6 @@ from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
 import numpy as np
-import matplotlib.pyplot as plt
 
 #CATBASE = 'http://quakesearch.geonet.org.nz/services/1.0.0/csv?startdate=[START]&enddate=[END]'
 CATBASE = 'http://quakesearch.geonet.org.nz/csv?bbox=165.45410,-49.18170,181.09863,-32.28713&startdate=[START]&enddate=[END]'
@@ -31,6 +33,135 @@ GEOBASE = 'ftp://ftp.geonet.org.nz/strong/processed/Proc/[YEAR]/[MONTH]/'
 TIMEFMT = '%Y-%m-%dT%H:%M:%S'
 NZTIMEDELTA = 2 #number of seconds allowed between GeoNet catalog time and event timestamp on FTP site
 NZCATWINDOW = 5*60 #number of seconds to search around in GeoNet EQ catalog
+FIELDWIDTH = 8 #width of each of the 10 data columns in a V1A data line
+FTP_CONNECTIONS = 4 #number of FTP connections used to download data files at the same time
+FTP_RETRIES = 3 #number of times a data file download is attempted before giving up on it
+
+def listFTPFolder(ftp,folder):
+    """
+    List the contents of an FTP folder, using MLSD if the server supports it.
+    @param ftp: Logged in ftplib.FTP object.
+    @param folder: Path of folder, relative to the current folder.
+    @return: Tuple of (list of file names,list of folder names).  If the server does not support MLSD,
+             all names are returned in both lists.
+    """
+    try:
+        files = []
+        folders = []
+        for name,facts in ftp.mlsd(folder,facts=['type']):
+            ftype = facts.get('type','').lower()
+            if ftype == 'file':
+                files.append(name)
+            elif ftype == 'dir':
+                folders.append(name)
+        return (files,folders)
+    except ftplib.error_perm as msg:
+        if str(msg)[0:3] not in ['500','501','502']: #i.e., a missing folder, rather than MLSD not being supported
+            raise
+    if folder:
+        names = ftp.nlst(folder)
+    else:
+        names = ftp.nlst()
+    names = [posixpath.basename(name) for name in names]
+    return (names,names)
+
+class FTPDownloader(object):
+    """
+    Download files from one FTP folder over several connections at once.
+
+    Each worker thread opens its own connection the first time it needs one.  A file that fails is
+    retried (on a new connection) up to FTP_RETRIES times, and is written to a temporary file first,
+    so that a failed download never leaves a partial data file behind.
+    """
+    def __init__(self,host,folder,connections=FTP_CONNECTIONS,retries=FTP_RETRIES):
+        """
+        Constructor
+        @param host: FTP server host name.
+        @param folder: Absolute path of the remote folder that file names are relative to.
+        @keyword connections: Number of FTP connections to use.
+        @keyword retries: Number of times to try each file.
+        """
+        self.host = host
+        self.folder = folder
+        self.connections = connections
+        self.retries = retries
+        self.local = threading.local()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def getConnection(self):
+        ftp = getattr(self.local,'ftp',None)
+        if ftp is None:
+            ftp = ftplib.FTP(self.host)
+            ftp.login() #anonymous
+            ftp.cwd(self.folder)
+            self.local.ftp = ftp
+            with self.lock:
+                self.opened.append(ftp)
+        return ftp
+
+    def dropConnection(self):
+        ftp = getattr(self.local,'ftp',None)
+        self.local.ftp = None
+        if ftp is not None:
+            try:
+                ftp.close()
+            except ftplib.all_errors:
+                pass
+
+    def retrieve(self,remotefile,localfile):
+        """
+        Download one file (in a worker thread).
+        @param remotefile: Path of file, relative to the remote folder.
+        @param localfile: Path of local output file.
+        @return: Tuple of (localfile,None), or (localfile,error message) if every attempt failed.
+        """
+        error = None
+        for attempt in range(self.retries):
+            try:
+                ftp = self.getConnection()
+                f = open(localfile+'.part','wb')
+                try:
+                    ftp.retrbinary('RETR %s' % remotefile,f.write)
+                finally:
+                    f.close()
+                os.replace(localfile+'.part',localfile)
+                return (localfile,None)
+            except ftplib.error_perm as msg:
+                error = str(msg) #i.e., no such file - trying again won't help
+                break
+            except ftplib.all_errors as msg:
+                error = str(msg)
+                self.dropConnection()
+        if os.path.isfile(localfile+'.part'):
+            os.remove(localfile+'.part')
+        return (localfile,error)
+
+    def retrieveAll(self,filepairs):
+        """
+        Download a list of files.
+        @param filepairs: List of (remote file,local file) tuples.
+        @return: Tuple of (list of local files downloaded,list of (remote file,error message) tuples that failed).
+        """
+        retrieved = []
+        failed = []
+        pool = ThreadPoolExecutor(max_workers=self.connections)
+        try:
+            futures = [pool.submit(self.retrieve,remotefile,localfile) for remotefile,localfile in filepairs]
+            for (remotefile,localfile),future in zip(filepairs,futures):
+                localfile,error = future.result()
+                if error is None:
+                    retrieved.append(localfile)
+                else:
+                    failed.append((remotefile,error))
+        finally:
+            pool.shutdown()
+            for ftp in self.opened:
+                try:
+                    ftp.quit()
+                except ftplib.all_errors:
+                    ftp.close()
+        return (retrieved,failed)
 
 class GeonetFetcher(StrongMotionFetcher):
     def __init__(self):
@@ -85,33 +216,32 @@ class GeonetFetcher(StrongMotionFetcher):
             msg = 'Could not find an FTP data folder called "%s". Returning.' % (urllib.parse.urljoin(neturl,fname))
             raise StrongMotionFetcherException(msg)
 
-        volumes = []
-        dirlist = ftp.nlst()
-        for volume in dirlist:
-            if volume.startswith('Vol'):
-                ftp.cwd(volume)
-                if 'data' not in ftp.nlst():
-                    ftp.cwd('..')
+        #walk the volume folders once, collecting the data files to download
+        eventfolder = ftp.pwd()
+        filepairs = []
+        files,folders = listFTPFolder(ftp,'')
+        for volume in sorted(folders):
+            if not volume.startswith('Vol'):
+                continue
+            try:
+                flist,dlist = listFTPFolder(ftp,posixpath.join(volume,'data'))
+            except ftplib.error_perm:
+                continue #no data folder in this volume
+            for ftpfile in flist:
+                if not ftpfile.endswith('V1A'):
                     continue
-                
-                ftp.cwd('data')
-                flist = ftp.nlst()
-                for ftpfile in flist:
-                    if not ftpfile.endswith('V1A'):
-                        
-                        continue
-                    localfile = os.path.join(os.getcwd(),ftpfile)
-                    if localfile in datafiles:
-                        continue
-                    datafiles.append(localfile)
-                    f = open(localfile,'wb')
-                    sys.stderr.write('Retrieving remote file %s...\n' % ftpfile)
-                    ftp.retrbinary('RETR %s' % ftpfile,f.write)
-                    f.close()
-                ftp.cwd('..')
-                ftp.cwd('..')
-
+                localfile = os.path.join(os.getcwd(),ftpfile)
+                if localfile in datafiles:
+                    continue
+                datafiles.append(localfile)
+                filepairs.append((posixpath.join(volume,'data',ftpfile),localfile))
         ftp.quit()
+
+        downloader = FTPDownloader(urlparts.netloc,eventfolder)
+        datafiles,failed = downloader.retrieveAll(filepairs)
+        for remotefile,error in failed:
+            sys.stderr.write('Could not retrieve remote file %s: %s\n' % (remotefile,error))
+        sys.stderr.write('Retrieved %i of %i data files from GeoNet.\n' % (len(datafiles),len(filepairs)))
         return datafiles
 
     def checkCatalog(self,time,lat,lon,timewindow,distwindow):
@@ -120,7 +250,7 @@ class GeonetFetcher(StrongMotionFetcher):
         url = CATBASE.replace('[START]',stime.strftime(TIMEFMT))
         url = url.replace('[END]',etime.strftime(TIMEFMT))
         try:
-            fh = urllib.request.urlopen(url)
+            fh = webclient.urlopen(url,ttl=webclient.QUERY_TTL)
             data = fh.read().decode('utf-8')
             fh.close()
             lines = data.split('\n')
@@ -221,49 +351,70 @@ def readheader(lines):
 def readheaderlines(f):
     hdrlines = []
     for i in range(0,26):
-        hdrlines.append(f.readline())
+        hdrlines.append(f.readline().decode('latin-1'))
     return hdrlines
 
-def readgeonet(geonetfile):
+def decodeblock(block,npts):
+    """
+    Decode the data block of one V1A component.
+    @param block: Bytes containing the data lines of the component (10 values per line).
+    @param npts: Number of samples in the component.
+    @return: numpy array of samples.
+    """
+    try:
+        return util.decodeBlock(block,npts=npts)
+    except ValueError:
+        #large negative values can run into their neighbours - fall back to the fixed-width columns
+        values = []
+        for line in block.splitlines():
+            line = line.rstrip()
+            values += [float(line[i:i+FIELDWIDTH]) for i in range(0,len(line),FIELDWIDTH)]
+        return np.array(values[0:npts])
+
+def itergeonet(geonetfile,headonly=False):
+    """
+    Read strong motion data from a GeoNet data file, one component at a time.
+
+    The file is read once from top to bottom - each 26 line header is followed by
+    ceil(npts/10) lines of data, which are decoded in one vectorized call.
+    @param geonetfile: Path to a valid GeoNet data file.
+    @keyword headonly: If True, skip the data blocks, and return traces with no samples (npts is set from the header).
+    @return: Generator of (ObsPy Trace object,header dictionary) tuples, containing accelerometer data in m/s.
+    """
+    f = open(geonetfile,'rb')
+    try:
+        hdrlines = readheaderlines(f)
+        while len(hdrlines[-1]):
+            hdrdict = readheader(hdrlines)
+            numlines = int(np.ceil(hdrdict['npts']/10.0))
+            block = b''.join([f.readline() for i in range(0,numlines)])
+            header = hdrdict.copy()
+            if headonly:
+                yield (util.headerTrace(hdrdict),header)
+                hdrlines = readheaderlines(f)
+                continue
+            data = decodeblock(block,hdrdict['npts'])
+            stats = Stats(hdrdict)
+            trace = Trace(data,header=stats)
+            #apply the calibration and convert from mm/s^2 to m/s^2
+            trace.data *= trace.stats['calib'] * 0.001 #convert to m/s^2
+            yield (trace,header)
+            hdrlines = readheaderlines(f)
+    finally:
+        f.close()
+
+def readgeonet(geonetfile,headonly=False):
     """
     Read strong motion data from a GeoNet data file
     @param geonetfile: Path to a valid GeoNet data file.
+    @keyword headonly: If True, skip the data blocks, and return traces with no samples (npts is set from the header).
     @return: List of ObsPy Trace objects, containing accelerometer data in m/s.
     """
-    #notes on implementation:
-    # originally I had written code to read each line of data manually, just
-    # as I was reading the header lines.  However, this became VERY slow for large
-    # files.  I discovered that numpy's genfromtxt function was much faster.  However,
-    # I could not get that function to work when I passed it a file object instead of a file name.
-    # Consequently, the only way I could keep the genfromtxt() method and file pointer in sync was
-    # to read and discard all of the lines of data that genfromtxt() parsed.  While annoying, the combination
-    # of these two seems to still be at least an order of magnitude faster than manually reading the file.
-    
-    f = open(geonetfile,'rt')
     tracelist = []
     headerlist = []
-    totlines = 0
-    hdrlines = readheaderlines(f)
-    while len(hdrlines[-1]):
-        totlines += len(hdrlines)
-        hdrdict = readheader(hdrlines)
-        numlines = int(np.ceil(hdrdict['npts']/10.0))
-        data = np.genfromtxt(geonetfile,skip_header=totlines,max_rows=numlines)
-        totlines += numlines
-        #now we need to set the file position to where we just ended
-        for i in range(0,numlines):
-            f.readline()
-        data = data.flatten()
-        header = hdrdict.copy()
-        stats = Stats(hdrdict)
-        trace = Trace(data,header=stats)
-        #apply the calibration and convert from mm/s^2 to m/s^2
-        trace.data = trace.data * trace.stats['calib'] * 0.001 #convert to m/s^2
-        tracelist.append(trace.copy())
-        headerlist.append(header.copy())
-        hdrlines = readheaderlines(f)
-
-    f.close()
+    for trace,header in itergeonet(geonetfile,headonly=headonly):
+        tracelist.append(trace)
+        headerlist.append(header)
     return (tracelist,headerlist)
 
 if __name__ == '__main__':
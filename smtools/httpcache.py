@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+import time
+import hashlib
+import threading
+import http.client
+import urllib.request
+import urllib.error
+
+CACHEDIR = os.path.join(os.path.expanduser('~'),'.smtools','httpcache') #default folder for cached responses
+MAXBYTES = 100*2**20 #the least recently used responses are removed when the cache grows past this size
+KEEPHEADERS = ['Content-Type','ETag','Last-Modified'] #response headers saved with each response
+
+class ResponseCache(object):
+    """
+    Persistent cache of HTTP responses, keyed by URL and POST body.
+
+    Each response is saved as a body file and a JSON file holding its URL, headers and the time it was
+    last confirmed by the server.  A cached response younger than the ttl given with a request is used
+    without contacting the server.  An older one is revalidated with If-None-Match/If-Modified-Since
+    (when the server gave an ETag or Last-Modified header), so that an unchanged page costs one small
+    304 response instead of a full download.
+
+    When the cache holds more than maxbytes, the least recently used responses are removed.  In offline
+    mode, cached responses are used whatever their age, and requests for anything else fail.
+    """
+    def __init__(self,cachedir=CACHEDIR,maxbytes=MAXBYTES,offline=False):
+        """
+        Constructor
+        @keyword cachedir: Folder in which to store responses.
+        @keyword maxbytes: Size above which the least recently used responses are removed.
+        @keyword offline: Serve only from the cache, never contacting servers.
+        """
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        self.offline = offline
+
+    def getPaths(self,url,data):
+        """
+        Get the cache file names for a request.
+        @param url: URL string.
+        @param data: POST body bytes, or None.
+        @return: Tuple of (body file,JSON file) paths.
+        """
+        sha = hashlib.sha1(url.encode('utf-8'))
+        if data is not None:
+            sha.update(b'\0')
+            sha.update(data)
+        base = os.path.join(self.cachedir,sha.hexdigest())
+        return (base+'.body',base+'.json')
+
+    def load(self,url,data):
+        """
+        Load a cached response.
+        @param url: URL string.
+        @param data: POST body bytes, or None.
+        @return: Tuple of (metadata dictionary,body bytes), or (None,None) if the response is not cached.
+        """
+        bodyfile,jsonfile = self.getPaths(url,data)
+        try:
+            f = open(jsonfile,'rt')
+            meta = json.load(f)
+            f.close()
+            f = open(bodyfile,'rb')
+            body = f.read()
+            f.close()
+        except (OSError,ValueError):
+            return (None,None)
+        if len(body) != meta['size']:
+            return (None,None)
+        #the JSON file modification time is the time of last use, for LRU eviction
+        os.utime(jsonfile)
+        return (meta,body)
+
+    def save(self,url,data,response,body):
+        """
+        Save a response to the cache, and evict old responses if the cache is too large.
+        @param url: URL string.
+        @param data: POST body bytes, or None.
+        @param response: webclient.WebResponse object.
+        @param body: Response body bytes.
+        """
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        bodyfile,jsonfile = self.getPaths(url,data)
+        headers = {}
+        for key in KEEPHEADERS:
+            if response.headers.get(key) is not None:
+                headers[key] = response.headers.get(key)
+        meta = {'url':response.geturl(),
+                'headers':headers,
+                'size':len(body),
+                'checked':time.time()}
+        self.writeFiles(bodyfile,jsonfile,meta,body)
+        self.evict()
+
+    def writeFiles(self,bodyfile,jsonfile,meta,body=None):
+        """
+        Write the files of a cache entry.
+        @param bodyfile: Path to body file.
+        @param jsonfile: Path to JSON file.
+        @param meta: Metadata dictionary.
+        @keyword body: Response body bytes, or None to update only the metadata.
+        """
+        #write the body first, and the JSON last, so that a partially written entry is never used
+        #(the temporary files are unique to this thread, as several fetcher threads may share the cache)
+        tmpext = '.%i.%i.tmp' % (os.getpid(),threading.get_ident())
+        if body is not None:
+            f = open(bodyfile+tmpext,'wb')
+            f.write(body)
+            f.close()
+            os.replace(bodyfile+tmpext,bodyfile)
+        f = open(jsonfile+tmpext,'wt')
+        json.dump(meta,f)
+        f.close()
+        os.replace(jsonfile+tmpext,jsonfile)
+
+    def evict(self):
+        """
+        Remove the least recently used responses until the cache is no larger than maxbytes.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cachedir):
+            if not entry.name.endswith('.json'):
+                continue
+            base = entry.path[0:-len('.json')]
+            try:
+                size = os.path.getsize(base+'.body') + entry.stat().st_size
+                entries.append((entry.stat().st_mtime,base,size))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        for mtime,base,size in entries:
+            if total <= self.maxbytes:
+                break
+            for fname in [base+'.json',base+'.body']:
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+            total -= size
+
+    def urlopen(self,client,url,data=None,timeout=None,ttl=0):
+        """
+        Open a URL through the cache.
+        @param client: webclient.HTTPClient object used to contact the server.
+        @param url: URL string or urllib.request.Request object.
+        @keyword data: Request body bytes (for a POST), or None.
+        @keyword timeout: Number of seconds to wait, or None for the client default.
+        @keyword ttl: Number of seconds for which a cached response is used without contacting the server.
+        @return: webclient.WebResponse object.
+        """
+        #imported here, as webclient imports this module
+        from .webclient import WebResponse
+        headers = {}
+        if isinstance(url,urllib.request.Request):
+            if data is None:
+                data = url.data
+            headers.update(url.header_items())
+            url = url.full_url
+        bodyfile,jsonfile = self.getPaths(url,data)
+        meta,body = self.load(url,data)
+        if meta is not None and (self.offline or time.time() - meta['checked'] < ttl):
+            return WebResponse(meta['url'],200,'OK',makeHeaders(meta['headers']),body)
+        if self.offline:
+            raise urllib.error.URLError('%s is not in the response cache, and downloads are turned off (offline mode)' % url)
+        if meta is not None:
+            if 'ETag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        response = client.urlopen(url,data=data,timeout=timeout,headers=headers)
+        if response.status == 304 and meta is not None:
+            meta['checked'] = time.time()
+            self.writeFiles(bodyfile,jsonfile,meta)
+            return WebResponse(meta['url'],200,'OK',makeHeaders(meta['headers']),body)
+        if response.status == 200:
+            self.save(url,data,response,response.getvalue())
+        return response
+
+def makeHeaders(hdict):
+    """
+    Turn a dictionary of saved response headers back into a header object.
+    @param hdict: Dictionary of header name:value.
+    @return: http.client.HTTPMessage object.
+    """
+    headers = http.client.HTTPMessage()
+    for key,value in hdict.items():
+        headers[key] = value
+    return headers
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+import hashlib
+
+from .cache import encodeValue,decodeValue
+
+INDEXVERSION = 1 #bump this when the contents of the index files change
+INDEXDIR = os.path.join(os.path.expanduser('~'),'.smtools','seedindex') #default folder for index files
+HASHBLOCK = 2**20 #number of bytes read at a time when hashing a seed file
+PAZKEYS = ['poles','zeros'] #poles and zeros dictionary values that are lists of complex numbers
+
+class SeedInventoryException(Exception):
+    """
+    Raised when a channel can not be found in a SeedInventory.
+    """
+
+def getFileHash(seedfile):
+    """
+    Get the SHA1 digest of the contents of a file.
+    @param seedfile: Path to file.
+    @return: Hexadecimal digest string.
+    """
+    sha = hashlib.sha1()
+    f = open(seedfile,'rb')
+    block = f.read(HASHBLOCK)
+    while len(block):
+        sha.update(block)
+        block = f.read(HASHBLOCK)
+    f.close()
+    return sha.hexdigest()
+
+def encodePAZ(paz):
+    """
+    Convert a poles and zeros dictionary into something that can be written to JSON.
+    @param paz: Poles and zeros dictionary, as returned by Parser.getPAZ().
+    @return: Copy of paz in which complex poles and zeros are [real,imaginary] pairs.
+    """
+    jpaz = {}
+    for key,value in paz.items():
+        if key in PAZKEYS:
+            jpaz[key] = [[complex(c).real,complex(c).imag] for c in value]
+        else:
+            jpaz[key] = encodeValue(value)
+    return jpaz
+
+def decodePAZ(jpaz):
+    """
+    Reverse encodePAZ().
+    @param jpaz: Poles and zeros dictionary read from JSON.
+    @return: Poles and zeros dictionary, as returned by Parser.getPAZ().
+    """
+    paz = {}
+    for key,value in jpaz.items():
+        if key in PAZKEYS:
+            paz[key] = [complex(real,imag) for real,imag in value]
+        else:
+            paz[key] = decodeValue(value)
+    return paz
+
+def buildIndex(seedfile):
+    """
+    Parse a dataless SEED file, and pull out everything getstrong.py needs to know about its channels.
+    @param seedfile: Path to dataless SEED file.
+    @return: Dictionary with keys inventory (as returned by Parser.getInventory()) and epochs
+             (channel id:list of dictionaries with keys start,end,paz,coordinates), in JSON-serializable form.
+    """
+    #obspy.xseed is slow to import, and is only needed when a seed file has not been indexed yet
+    from obspy.xseed import Parser
+    parser = Parser(seedfile)
+    inventory = parser.getInventory()
+    epochs = {}
+    for channel in inventory['channels']:
+        channel_id = channel['channel_id']
+        start = channel['start_date']
+        epoch = {'start':start,
+                 'end':channel['end_date'] or None,
+                 'paz':encodePAZ(parser.getPAZ(channel_id,datetime=start)),
+                 'coordinates':parser.getCoordinates(channel_id,datetime=start)}
+        epochs.setdefault(channel_id,[]).append(encodeValue(epoch))
+    return {'inventory':encodeValue(inventory),
+            'epochs':epochs}
+
+class SeedInventory(object):
+    """
+    Station metadata from one or more dataless SEED files, indexed by channel id and epoch.
+
+    Parsing a large dataless SEED file takes seconds, so the first time a file is seen its poles and
+    zeros, coordinates and station/instrument names are written to a JSON index file named after the
+    SHA1 digest of the seed file.  Later runs (and other copies of the same seed file) load the index
+    instead, and an edited seed file is simply re-indexed, as its digest changes.
+
+    SeedInventory has the getPAZ(), getCoordinates() and getInventory() methods of obspy.xseed.Parser,
+    so it can be passed to trace2xml in place of a Parser.
+    """
+    def __init__(self,seedfiles,cachedir=INDEXDIR):
+        """
+        Constructor - loads (or builds) the index of each seed file.
+        @param seedfiles: List of paths to dataless SEED files.  Channels found in more than one
+                          file are taken from the first file listed.
+        @keyword cachedir: Folder in which to store index files.
+        """
+        self.cachedir = cachedir
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.epochs = {}
+        self.inventory = {'networks':[],'stations':[],'channels':[]}
+        for seedfile in seedfiles:
+            index = self.loadIndex(seedfile)
+            for channel_id,epochs in index['epochs'].items():
+                if channel_id not in self.epochs:
+                    self.epochs[channel_id] = decodeValue(epochs)
+            inventory = decodeValue(index['inventory'])
+            for key in self.inventory.keys():
+                self.inventory[key] += inventory.get(key,[])
+
+    def loadIndex(self,seedfile):
+        """
+        Load the index of a seed file, building it if necessary.
+        @param seedfile: Path to dataless SEED file.
+        @return: Index dictionary (see buildIndex()).
+        """
+        digest = getFileHash(seedfile)
+        indexfile = os.path.join(self.cachedir,digest+'.json')
+        if os.path.isfile(indexfile):
+            try:
+                f = open(indexfile,'rt')
+                index = json.load(f)
+                f.close()
+                if index['version'] == INDEXVERSION and index['sha1'] == digest:
+                    return index
+            except (ValueError,KeyError):
+                pass
+        index = buildIndex(seedfile)
+        index['version'] = INDEXVERSION
+        index['sha1'] = digest
+        f = open(indexfile+'.tmp','wt')
+        json.dump(index,f)
+        f.close()
+        os.replace(indexfile+'.tmp',indexfile)
+        return index
+
+    def getEpoch(self,seed_id,datetime=None):
+        """
+        Find the epoch of a channel in effect at a given time.
+        @param seed_id: Channel id (NET.STA.LOC.CHA).
+        @keyword datetime: UTCDateTime, or None for the most recent epoch.
+        @return: Dictionary with keys start,end,paz,coordinates.
+        """
+        if seed_id not in self.epochs:
+            raise SeedInventoryException('No channel found with the given SEED id: %s' % seed_id)
+        epochs = self.epochs[seed_id]
+        if datetime is None:
+            return max(epochs,key=lambda epoch:epoch['start'])
+        for epoch in epochs:
+            if epoch['start'] <= datetime and (epoch['end'] is None or datetime <= epoch['end']):
+                return epoch
+        raise SeedInventoryException('No epoch of channel %s covers %s' % (seed_id,datetime))
+
+    def getPAZ(self,seed_id,datetime=None):
+        """
+        Get the poles and zeros of a channel.
+        @param seed_id: Channel id (NET.STA.LOC.CHA).
+        @keyword datetime: UTCDateTime, or None for the most recent epoch.
+        @return: Poles and zeros dictionary, as returned by Parser.getPAZ().
+        """
+        return decodePAZ(self.getEpoch(seed_id,datetime)['paz'])
+
+    def getCoordinates(self,seed_id,datetime=None):
+        """
+        Get the coordinates of a channel.
+        @param seed_id: Channel id (NET.STA.LOC.CHA).
+        @keyword datetime: UTCDateTime, or None for the most recent epoch.
+        @return: Dictionary with latitude,longitude,elevation (and local_depth) keys.
+        """
+        return dict(self.getEpoch(seed_id,datetime)['coordinates'])
+
+    def getInventory(self):
+        """
+        Get the networks, stations and channels of all of the seed files.
+        @return: Dictionary with networks,stations,channels keys, as returned by Parser.getInventory().
+        """
+        return self.inventory
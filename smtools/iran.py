@@ -11,7 +11,6 @@ import os.path
 import re
 
 #local
-from .trace2xml import trace2xml
 from . import util
 
 #third party
@@ -19,9 +18,7 @@ from obspy.core.trace import Trace
 from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
-from obspy.signal import rotate
 import numpy as np
-import matplotlib.pyplot as plt
 
 INTIMEFMT = '%Y/%m/%d %H:%M:%S'
 FLOATRE = "[-+]?[0-9]*\.?[0-9]+."
@@ -91,17 +88,18 @@ def readheader(lines):
 def readheaderlines(f):
     hdrlines = []
     for i in range(0,27):
-        hdrlines.append(f.readline())
+        hdrlines.append(f.readline().decode('latin-1'))
     return hdrlines
 
-def readiran(iranfile,doRotation=True):
+def readiran(iranfile,doRotation=True,headonly=False):
     """
     Read strong motion data from a Iran data file
     @param iranfile: Path to a valid Iran data file.
     @keyword doRotation: Apply back-azimuth rotation of L & T channels to NS and EW.
+    @keyword headonly: If True, skip the data blocks, and return traces with no samples (no rotation is applied, and npts is set from the header).
     @return: List of ObsPy Trace objects, containing accelerometer data in m/s.
     """
-    f = open(iranfile,'rt')
+    f = open(iranfile,'rb')
     tracelist = []
     headerlist = []
     try:
@@ -111,20 +109,18 @@ def readiran(iranfile,doRotation=True):
     while len(hdrlines[-1]):
         hdrdict = readheader(hdrlines)
         numlines = int(np.ceil(hdrdict['npts']/10.0))
-        data = []
-        for i in range(0,numlines):
-            line = f.readline()
-            parts = line.strip().split()
-            mdata = [float(p) for p in parts]
-            data = data + mdata
-        data = np.array(data)
+        block = b''.join([f.readline() for i in range(0,numlines)])
         header = hdrdict.copy()
-        stats = Stats(hdrdict)
-        trace = Trace(data,header=stats)
-        #apply the calibration and convert from mm/s^2 to m/s^2
-        trace.data = trace.data * trace.stats['calib'] * 0.98 #convert to m/s^2 from g/10
-        tracelist.append(trace.copy())
-        headerlist.append(header.copy())
+        if headonly:
+            trace = util.headerTrace(hdrdict)
+        else:
+            data = util.decodeBlock(block)
+            stats = Stats(hdrdict)
+            trace = Trace(data,header=stats)
+            #apply the calibration and convert from mm/s^2 to m/s^2
+            trace.data *= trace.stats['calib'] * 0.98 #convert to m/s^2 from g/10
+        tracelist.append(trace)
+        headerlist.append(header)
         endblock = f.readline()
         hdrlines = readheaderlines(f)
 
@@ -135,7 +131,8 @@ def readiran(iranfile,doRotation=True):
     #original NS and EW channels.  We presume that the "L" channel will rotate back to become NS, and
     #"T" will become EW.
     #First, find the channel called L*
-    if doRotation:
+    if doRotation and not headonly:
+        from obspy.signal import rotate
         channels = [h['channel'][0:1] for h in headerlist]
         lidx = channels.index('L')
         tidx = channels.index('T')
@@ -143,9 +140,10 @@ def readiran(iranfile,doRotation=True):
         tdata = tracelist[tidx].data
         backaz = headerlist[0]['rotation']['L']
         ndata,edata = rotate.rotate_RT_NE(ldata,tdata,backaz)
-        tracelist[lidx].data = ndata.copy()
+        #write the rotated data back in place, rather than allocating new arrays
+        ldata[:] = ndata
         tracelist[lidx].stats['channel'] = 'H1' #most probably NS, but we're being cautious
-        tracelist[tidx].data = edata.copy()
+        tdata[:] = edata
         tracelist[tidx].stats['channel'] = 'H2' #most probably EW, but we're being cautious
     
     return (tracelist,headerlist)
@@ -155,6 +153,7 @@ if __name__ == '__main__':
     traces,headers = readiran(iranfile)
     trace = traces[0]
     trace.plot()
+    import matplotlib.pyplot as plt
     plt.savefig('iran.png')
     print(trace.data.max())
     print(trace.stats['calib'])
@@ -5,14 +5,14 @@ import sys
 import datetime
 import os.path
 import re
-import pickle
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor,as_completed
 
 #third party
 from obspy import read, Stream
 from obspy.fdsn import Client as FDSN_Client
-from obspy.iris.client import Client as IrisClient
-from obspy.xseed.parser import Parser
-from obspy.core.util import NamedTemporaryFile
 from obspy import UTCDateTime
 from obspy.core.util import geodetics
 from obspy.core import AttribDict
@@ -23,10 +23,17 @@ from obspy.core import AttribDict
 #local imports
 from .fetcher import StrongMotionFetcher,StrongMotionFetcherException
 from .trace2xml import trace2xml
+from .stationcache import StationCache,attach
+from .sources import SAC_IACC
 
 TIMEFMT = '%Y-%m-%dT%H:%M:%S'
 RADIUS = 3.6 #degrees within which to search for stations
 WAVERATE = 1 #km/s assumed slowest rate for wave propagation to nearfield stations
+PWAVERATE = 8 #km/s assumed fastest rate (P waves), for the start of distance dependent time windows
+BULK_STATIONS = 25 #number of stations in each bulk waveform request
+BULK_REQUESTS = 4 #number of bulk waveform requests in flight at the same time
+BULK_RETRIES = 3 #number of times a bulk waveform request is attempted before giving up on its stations
+RETRY_DELAY = 2 #seconds to wait before retrying a failed request (doubled after each failure)
 
 def unique_list(seq):  # make a list only contain unique values and keep their order
     seen = set()
@@ -84,51 +91,188 @@ def getdata(network, station, location, channel, t1, t2, attach_response=True,
             client = FDSN_Client(clientname)
             st = client.get_waveforms(network, station, location, channel,
                                       t1, t2, attach_response=True)
-            try:
-                st.merge(fill_value='interpolate')
-            except:
-                print('bulk merge failed, trying station by station')
-                st_new = Stream()
-                stationlist = unique_list([trace.stats.station for trace in st])
-                for sta in stationlist:
-                    temp = st.select(station=sta)
-                    try:
-                        temp.merge(fill_value='interpolate')
-                        st_new += temp
-                    except Exception as e:
-                        print(e)
-                        print('%s would not merge - deleting it') % (sta,)
-                st = st_new
-            st.detrend('linear')
-            #find min start time
-            mint = min([trace.stats.starttime for trace in st])
-            st.trim(starttime=mint, pad=True, fill_value=0)
+            st = cleanStream(st)
         except Exception as e:
             print(e)
             return
         #make sure it's in the same order as it was originally input
-        order = [trace.stats.station for trace in st]
-        st_ordered = Stream()
-        temp = station.split(',')
-        for sta in temp:
-            while sta in order:
-                indx = order.index(sta)
-                st_ordered.append(st[indx])
-                st.pop(indx)
-                try:
-                    order = [trace.stats.station for trace in st]
-                except:
-                    order = ['', '']
+        st_ordered = orderStream(st,station.split(','))
         #save files
         if savedat:
             st_ordered.write(folderdat+'/'+filename, format="PICKLE")
     return st_ordered
 
-def getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=0.05, cosfilt=None, water_level=60., csvfile=None, verbal=False):
+def cleanStream(st):
+    """
+    Merge the pieces of each channel, detrend, and pad the traces of each station to a common start time.
+    @param st: ObsPy Stream of raw data.
+    @return: Cleaned ObsPy Stream (channels that would not merge are dropped).
+    """
+    try:
+        st.merge(fill_value='interpolate')
+    except:
+        print('bulk merge failed, trying station by station')
+        st_new = Stream()
+        stationlist = unique_list([trace.stats.station for trace in st])
+        for sta in stationlist:
+            temp = st.select(station=sta)
+            try:
+                temp.merge(fill_value='interpolate')
+                st_new += temp
+            except Exception as e:
+                print(e)
+                print('%s would not merge - deleting it' % (sta,))
+        st = st_new
+    st.detrend('linear')
+    #pad the channels of each station to their earliest start time (stations may have been
+    #requested with different time windows, so they are not padded to a common start)
+    for sta in unique_list([trace.stats.station for trace in st]):
+        temp = st.select(station=sta)
+        mint = min([trace.stats.starttime for trace in temp])
+        temp.trim(starttime=mint, pad=True, fill_value=0)
+    return st
+
+def orderStream(st,stations):
+    """
+    Put the traces of a stream in the order of a list of stations.
+    @param st: ObsPy Stream.
+    @param stations: List of station codes.
+    @return: New ObsPy Stream holding the traces of the listed stations, in that order.
+    """
+    st_ordered = Stream()
+    for sta in stations:
+        st_ordered += st.select(station=sta)
+    return st_ordered
+
+def getStationWindows(inventory,lat,lon,etime,tstart,tend):
+    """
+    Get a data time window for each station of an inventory, from its distance to the epicenter.
+
+    A window starts tstart seconds (usually negative) after the earliest P arrival (at PWAVERATE), and
+    ends tend seconds after the slowest waves (at WAVERATE) arrive, so a station at the epicenter gets
+    [etime+tstart,etime+tend] and more distant stations get later and longer windows.
+    @param inventory: ObsPy Inventory (from Client.get_stations()).
+    @param lat: Latitude of epicenter.
+    @param lon: Longitude of epicenter.
+    @param etime: UTCDateTime origin time.
+    @param tstart: Seconds from the P arrival to the start of the window.
+    @param tend: Seconds from the arrival of the slowest waves to the end of the window.
+    @return: Dictionary of (network,station):(UTCDateTime start,UTCDateTime end).
+    """
+    windows = {}
+    for network in inventory:
+        for station in network:
+            distance,az1,az2 = geodetics.gps2DistAzimuth(lat,lon,station.latitude,station.longitude)
+            distance = distance/1000.0
+            windows[(network.code,station.code)] = (etime + distance/PWAVERATE + tstart,
+                                                    etime + distance/WAVERATE + tend)
+    return windows
+
+def getBulkLines(inventory,location,channels,t1,t2,windows=None):
+    """
+    Make FDSN bulk dataselect request lines for the stations of an inventory.
+    @param inventory: ObsPy Inventory (from Client.get_stations()).
+    @param location: Comma separated location codes, or '*'.
+    @param channels: Comma separated channel codes (wildcards allowed).
+    @param t1: UTCDateTime start time.
+    @param t2: UTCDateTime end time.
+    @keyword windows: Dictionary of (network,station):(start,end) time windows (see getStationWindows()),
+                      used instead of t1,t2 for the stations it holds, or None.
+    @return: OrderedDict of (network,station):list of (network,station,location,channel,t1,t2) tuples.
+    """
+    bulk = OrderedDict()
+    for code in inventory.get_contents()['stations']:
+        net,sta = code.split()[0].split('.')[0:2]
+        if (net,sta) in bulk:
+            continue
+        start,end = (t1,t2)
+        if windows is not None and (net,sta) in windows:
+            start,end = windows[(net,sta)]
+        bulk[(net,sta)] = [(net,sta,loc,cha,start,end) for loc in location.split(',') for cha in channels.split(',')]
+    return bulk
+
+def getbulkdata(bulk,clientname='IRIS',nstations=BULK_STATIONS,nrequests=BULK_REQUESTS,retries=BULK_RETRIES,
+                attach_response=True):
+    """
+    Download waveforms in several bulk requests at once.
+
+    The stations are split into chunks of nstations, each fetched with one FDSN bulk dataselect request,
+    and at most nrequests chunks are in flight at a time.  A failed chunk is retried (after RETRY_DELAY
+    seconds, doubling each time) up to retries times, after which its stations are reported and left out.
+    @param bulk: OrderedDict of (network,station):list of bulk request lines (see getBulkLines()).
+    @keyword clientname: FDSN data center name ('IRIS','NCEDC', etc.)
+    @keyword nstations: Number of stations in each bulk request.
+    @keyword nrequests: Number of bulk requests in flight at the same time.
+    @keyword retries: Number of times each bulk request is attempted.
+    @keyword attach_response: Have the data center attach responses to the traces (costs a metadata
+                              request for each bulk request).
+    @return: ObsPy Stream of all of the data downloaded, in the order of the stations in bulk, or None
+             if no data was found.
+    """
+    stations = list(bulk.keys())
+    chunks = [stations[i:i+nstations] for i in range(0,len(stations),nstations)]
+    local = threading.local()
+    def fetchChunk(chunk):
+        #each thread keeps its own client
+        if getattr(local,'client',None) is None:
+            local.client = FDSN_Client(clientname)
+        lines = []
+        for key in chunk:
+            lines += bulk[key]
+        delay = RETRY_DELAY
+        for attempt in range(retries):
+            try:
+                return local.client.get_waveforms_bulk(lines,attach_response=attach_response)
+            except Exception as error:
+                if str(error).find('No data') > -1:
+                    return Stream() #the data center has nothing for these stations - no point retrying
+                if attempt == retries - 1:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+    st = Stream()
+    pool = ThreadPoolExecutor(max_workers=nrequests)
+    try:
+        futures = {}
+        for chunk in chunks:
+            futures[pool.submit(fetchChunk,chunk)] = chunk
+        for future in as_completed(futures):
+            try:
+                st += future.result()
+            except Exception as error:
+                chunk = futures[future]
+                print('Could not download data for stations %s: %s' % (','.join(['.'.join(key) for key in chunk]),error))
+    finally:
+        pool.shutdown()
+    if not len(st):
+        return None
+    st = cleanStream(st)
+    return orderStream(st,unique_list([sta for net,sta in stations]))
+
+def correctTrace(trace, output, cosfilt, water_level):
+    """
+    Remove the instrument response from a trace.
+    @param trace: ObsPy Trace with response attached - corrected in place.
+    @param output: 'ACC' or 'VEL'.
+    @param cosfilt: Tuple of four corners, in Hz, for cosine filter, or None.
+    @param water_level: Water level to use in station correction.
+    @return: True if the response was removed, False (after printing a message) if it could not be.
+    """
+    try:
+        trace.remove_response(output=output, pre_filt=cosfilt, water_level=water_level)
+    except Exception:
+        print('Failed to remove response for %s, deleting this station' % (trace.stats.station + trace.stats.channel,))
+        return False
+    trace.stats.gmparam = AttribDict()
+    return True
+
+def getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=0.05, cosfilt=None, water_level=60., csvfile=None, verbal=False, outputs=('ACC', 'VEL')):
     """
     Performs station correction (st must have response info attached to it) - removes trends and tapers with 5 percent cosine taper before doing station correction, adds as field in st and prints out results, option to save csv file
     All values in m/s and/or m/s**2
+    Each trace is corrected once for each output needed (the outputs asked for, ACC if pga or psa are asked for, and VEL if pgv is asked for).  The last of these reuses the trace of st, so the traces of st are changed.
     USAGE
+    stacc, stvel = getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=0.05, cosfilt=None, water_level=60., csvfile=None, verbal=False, outputs=('ACC', 'VEL'))
 
     INPUTS
     st - stream of obspy traces of raw seismic data with response information attached - best if visually inspected in case there are data problems
@@ -141,13 +285,16 @@ def getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=
     water_level - water level to use in station correction
     csvfile - full file path of csvfile to output with results, None if don't want to output csvfile
     verbal - if True, will print out all results to screen
+    outputs - corrected streams wanted back: 'ACC' and/or 'VEL'
 
     OUTPUTS
-    stacc - stream of data corrected to acceleration with pga's, pgv's and psa's attached, stored as AttribDict in in tr.stats.gmparam
+    stacc - stream of data corrected to acceleration with pga's, pgv's and psa's attached, stored as AttribDict in in tr.stats.gmparam (None if not needed)
     csvfile
-    stvel - stream of data corrected to velocity with pga's, pgv's and psa's attached, stored as AttribDict in in tr.stats.gmparam
+    stvel - stream of data corrected to velocity with pga's, pgv's and psa's attached, stored as AttribDict in in tr.stats.gmparam (None if not needed)
     """
-    from obspy.core import AttribDict
+    import numpy as np
+
+    needed = [output for output in ['ACC', 'VEL'] if output in outputs or (output == 'ACC' and (pga or psa)) or (output == 'VEL' and pgv)]
 
     st.detrend('demean')
     st.detrend('linear')
@@ -160,62 +307,46 @@ def getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=
         except:
             print('Could not attach lats and lons, continuing')
 
-    stacc = st.copy()
-    # Build place to store gm parameters
-    for trace in stacc:
-        trace.stats.gmparam = AttribDict()
-
-    try:
-        stacc.remove_response(output='ACC', pre_filt=cosfilt, water_level=water_level)
-    except:
-        print('Failed to do bulk station correction, trying one at a time')
-        stacc = st.copy()  # Start with fresh data
-        removeid = []
-        for trace in stacc:
-            try:
-                trace.remove_response(output='ACC', pre_filt=cosfilt, water_level=water_level)
-            except:
-                print('Failed to remove response for %s, deleting this station' % (trace.stats.station + trace.stats.channel,))
-                removeid.append(trace.id)
-        for rmid in removeid:  # Delete uncorrected ones
-            for tr in stacc.select(id=rmid):
-                stacc.remove(tr)
-
-    stvel = st.copy()
-    # Build place to store gm parameters
-    for trace in stvel:
-        trace.stats.gmparam = AttribDict()
-    try:
-        stvel.remove_response(output='VEL', pre_filt=cosfilt, water_level=water_level)
-    except:
-        print('Failed to do bulk station correction, trying one at a time')
-        stvel = st.copy()  # Start with fresh data
-        removeid = []
-        for trace in stvel:
-            try:
-                trace.remove_response(output='VEL', pre_filt=cosfilt, water_level=water_level)
-            except:
-                print('Failed to remove response for %s, deleting this station' % (trace.stats.station + trace.stats.channel,))
-                removeid.append(trace.id)
-        for rmid in removeid:  # Delete uncorrected ones
-            for tr in stvel.select(id=rmid):
-                stvel.remove(tr)
+    # Correct each trace to each output needed - only the extra outputs need a copy of the raw trace,
+    # and traces that fail are left out of all of the outputs
+    corrected = dict([(output, Stream()) for output in needed])
+    for trace in st:
+        traces = {}
+        for k, output in enumerate(needed):
+            if k < len(needed) - 1:
+                ctrace = trace.copy()
+            else:
+                ctrace = trace
+            if not correctTrace(ctrace, output, cosfilt, water_level):
+                break
+            traces[output] = ctrace
+        else:
+            for output in needed:
+                corrected[output].append(traces[output])
+    stacc = corrected.get('ACC')
+    stvel = corrected.get('VEL')
+    # gm parameters are stored in both streams
+    gmstreams = [stream for stream in [stacc, stvel] if stream is not None]
 
     if pga is True:
         for j, trace in enumerate(stacc):
-            trace.stats.gmparam['pga'] = np.abs(trace.max())  # in obspy, max gives the max absolute value of the data
-            stvel[j].stats.gmparam['pga'] = np.abs(trace.max())
+            value = np.abs(trace.max())  # in obspy, max gives the max absolute value of the data
+            for stream in gmstreams:
+                stream[j].stats.gmparam['pga'] = value
             if verbal is True:
-                print('%s - PGA = %1.3f m/s') % (trace.id, np.abs(trace.max()))
+                print('%s - PGA = %1.3f m/s' % (trace.id, value))
 
     if pgv is True:
         for j, trace in enumerate(stvel):
-            trace.stats.gmparam['pgv'] = np.abs(trace.max())
-            stacc[j].stats.gmparam['pgv'] = np.abs(trace.max())
+            value = np.abs(trace.max())
+            for stream in gmstreams:
+                stream[j].stats.gmparam['pgv'] = value
             if verbal is True:
-                print('%s - PGV = %1.3f m/s') % (trace.id, np.abs(trace.max()))
+                print('%s - PGV = %1.3f m/s' % (trace.id, value))
 
     if psa is True:
+        #obspy.signal is slow to import, and is only needed for spectral accelerations
+        from obspy.signal.invsim import seisSim, cornFreq2Paz
         for j, trace in enumerate(stacc):
             out = []
             for T in periods:
@@ -232,74 +363,103 @@ def getpeaks(st, pga=True, pgv=True, psa=True, periods=[0.3, 1.0, 3.0], damping=
                     psa1 = abs(min(dd))
                 out.append(psa1)
                 if verbal is True:
-                    print('%s - PSA at %1.1f sec = %1.3f m/s^2') % (trace.id, T, psa1)
-            trace.stats.gmparam['periods'] = periods
-            trace.stats.gmparam['psa'] = out
-            stvel[j].stats.gmparam['periods'] = periods
-            stvel[j].stats.gmparam['psa'] = out
+                    print('%s - PSA at %1.1f sec = %1.3f m/s^2' % (trace.id, T, psa1))
+            for stream in gmstreams:
+                stream[j].stats.gmparam['periods'] = periods
+                stream[j].stats.gmparam['psa'] = out
 
     if csvfile is not None:
         import csv
-        with open(csvfile, 'wb') as csvfile1:
+        ststa = gmstreams[0]
+        with open(csvfile, 'wt', newline='') as csvfile1:
             writer = csv.writer(csvfile1)
-            writer.writerow(['Id']+[tr.id for tr in st])
+            writer.writerow(['Id']+[tr.id for tr in ststa])
             try:
-                test = [tr.stats.coordinates['latitude'] for tr in st]
-                writer.writerow(['Lat']+[tr.stats.coordinates['latitude'] for tr in st])
-                writer.writerow(['Lon']+[tr.stats.coordinates['longitude'] for tr in st])
+                test = [tr.stats.coordinates['latitude'] for tr in ststa]
+                writer.writerow(['Lat']+[tr.stats.coordinates['latitude'] for tr in ststa])
+                writer.writerow(['Lon']+[tr.stats.coordinates['longitude'] for tr in ststa])
             except:
                 print('Could not print out lats/lons to csvfile')
             if pga is True:
-                writer.writerow(['PGA (m/s^2)']+[tr.stats.gmparam['pga'] for tr in stacc])
+                writer.writerow(['PGA (m/s^2)']+[tr.stats.gmparam['pga'] for tr in ststa])
             if pgv is True:
-                writer.writerow(['PGV (m/s)']+[tr.stats.gmparam['pgv'] for tr in stvel])
+                writer.writerow(['PGV (m/s)']+[tr.stats.gmparam['pgv'] for tr in ststa])
             if psa is True:
                 for k, period in enumerate(periods):
-                    writer.writerow(['PSA (m/s^2) at %1.1f sec, %1.0fpc damping' % (period, 100*damping)]+[tr.stats.gmparam['psa'][k] for tr in stacc])
+                    writer.writerow(['PSA (m/s^2) at %1.1f sec, %1.0fpc damping' % (period, 100*damping)]+[tr.stats.gmparam['psa'][k] for tr in ststa])
 
     return stacc, stvel
 
-def getepidata(event_lat, event_lon, event_time, tstart=-5., tend=200., minradiuskm=0., maxradiuskm=20., channels='*', location='*', source='IRIS'):
+def expandChannels(channels):
+    """
+    Turn a channel group name into channel codes.
+    @param channels: 'strong motion', 'broadband', 'short period', or comma separated channel codes.
+    @return: Comma separated channel codes (wildcards allowed), without spaces.
+    """
+    if channels.lower() == 'strong motion':
+        return 'EN*,HN*,BN*,EL*,HL*,BL*'
+    if channels.lower() == 'broadband':
+        return 'BH*,HH*'
+    if channels.lower() == 'short period':
+        return 'EH*'
+    return channels.replace(' ', '')  # Get rid of spaces
+
+def getepidata(event_lat, event_lon, event_time, tstart=-5., tend=200., minradiuskm=0., maxradiuskm=20., channels='*', location='*', source='IRIS', stationcache=None, windowbydistance=False):
     """
     Automatically pull existing data within a certain distance of the epicenter (or any lat/lon coordinates) and attach station coordinates to data
     USAGE
-    st = getepidata(event_lat, event_lon, event_time, tstart=-5., tend=200., minradiuskm=0., maxradiuskm=20., channels='*', location='*', source='IRIS')
+    st = getepidata(event_lat, event_lon, event_time, tstart=-5., tend=200., minradiuskm=0., maxradiuskm=20., channels='*', location='*', source='IRIS', stationcache=None, windowbydistance=False)
     INPUTS
     event_lat = latitude of event in decimal degrees
     event_lon = longitude of event in decimal degrees
     event_time = Event time in UTC in any format obspy's UTCDateTime can parse - e.g. '2016-02-05T19:57:26'
     tstart = number of seconds to add to event time for start time of data (use negative number to start before event_time)
     tend = number of seconds to add to event time for end time of data
+    windowbydistance = if True, tstart and tend are instead relative to the expected arrival times at each station (see getStationWindows), so that distant stations get later and longer windows
     radiuskm = radius to search for data
     channels = 'strong motion' to get all strong motion channels (excluding low sample rate ones), 'broadband' to get all broadband instruments, 'short period' for all short period channels, otherwise a single line of comma separated channel codes, * wildcards are okay, e.g. channels = '*N*,*L*'
     location = comma separated list of location codes allowed, or '*' for all location codes
     source = FDSN source, 'IRIS', 'NCEDC', 'GEONET' etc., see list here http://docs.obspy.org/archive/0.10.2/packages/obspy.fdsn.html
+    stationcache = StationCache for the same source, from which to take station coordinates and responses, or None to ask the data center every time
 
     OUTPUTS
     st = obspy stream containing data from within requested area
     """
     event_time = UTCDateTime(event_time)
-    client = FDSN_Client(source)
 
-    if channels.lower() == 'strong motion':
-        channels = 'EN*,HN*,BN*,EL*,HL*,BL*'
-    elif channels.lower() == 'broadband':
-        channels = 'BH*,HH*'
-    elif channels.lower() == 'short period':
-        channels = 'EH*'
-    else:
-        channels = channels.replace(' ', '')  # Get rid of spaces
+    channels = expandChannels(channels)
 
     t1 = UTCDateTime(event_time) + tstart
     t2 = UTCDateTime(event_time) + tend
+    if windowbydistance:
+        t2 += maxradiuskm/WAVERATE  # end of the window of the most distant station
+
+    if stationcache is not None:
+        #metadata comes from the cache (at response level), so only the waveforms are downloaded
+        inventory = stationcache.getInventory(event_lat, event_lon, maxradiuskm, channels, minradius=minradiuskm, starttime=t1, endtime=t2)
+        if inventory is None:
+            print('No stations found')
+            return
+        windows = None
+        if windowbydistance:
+            windows = getStationWindows(inventory,event_lat,event_lon,event_time,tstart,tend)
+        bulk = getBulkLines(inventory,location.replace(' ',''),channels,t1,t2,windows=windows)
+        st = getbulkdata(bulk,clientname=source,attach_response=False)
+        if st is None:
+            print('No data returned')
+            return
+        for traceid in attach(st,inventory):
+            print('Could not attach response and coordinates for %s' % traceid)
+        return st
 
+    client = FDSN_Client(source)
     inventory = client.get_stations(latitude=event_lat, longitude=event_lon, minradius=minradiuskm/111.32, maxradius=maxradiuskm/111.32, channel=channels, level='channel', startbefore=t1, endafter=t2)
-    temp = inventory.get_contents()
-    netnames = temp['networks']
-    stas = temp['stations']
-    stanames = [n.split('.')[1].split()[0] for n in stas]
 
-    st = getdata(','.join(unique_list(netnames)), ','.join(unique_list(stanames)), location, channels, t1, t2, attach_response=True, clientname=source)
+    windows = None
+    if windowbydistance:
+        windows = getStationWindows(inventory,event_lat,event_lon,event_time,tstart,tend)
+    bulk = getBulkLines(inventory,location.replace(' ',''),channels,t1,t2,windows=windows)
+    st = getbulkdata(bulk,clientname=source)
 
     if st is None:
         print('No data returned')
@@ -331,8 +491,48 @@ def parseSAC(sacpz):
     return sacdict
 
 class IrisFetcher(StrongMotionFetcher):
-    def __init__(self,verbose=False):
+    def __init__(self,verbose=False,stationcache=None):
+        """
+        Constructor
+        @keyword verbose: Print progress messages.
+        @keyword stationcache: StationCache holding IRIS station metadata, or None to use the default cache.
+        """
         self.verbose = verbose
+        if stationcache is None:
+            stationcache = StationCache(source='IRIS')
+        self.stationcache = stationcache
+
+    def getTraces(self,lat,lon,etime,radius,timewindow):
+        """
+        Download the strong motion records associated with an event, and correct them to acceleration.
+        @param lat: Latitude associated with event
+        @param lon: Longitude associated with event
+        @param etime: UTC time of event
+        @param radius: Distance window (km) within which to search for events on IRIS.
+        @param timewindow: Time window (sec) within which to search for events on IRIS.
+        @return: List of ObsPy Trace objects (acceleration records only), with coordinates and sac
+                 dictionaries in their stats, as they would be written to (and read back from) SAC files.
+        """
+        etimestr = etime.strftime('%Y-%m-%dT%H:%M:%S')
+        st = getepidata(lat, lon, etimestr, tstart=-3,
+                                   tend=+timewindow, minradiuskm=0., maxradiuskm=radius,
+                                   channels='strong motion', location='*', source='IRIS',
+                                   stationcache=self.stationcache, windowbydistance=True)
+        traces = []
+        if st is None:
+            return traces
+        stacc,stvel = getpeaks(st,pga=False,pgv=False,psa=False,outputs=('ACC',))
+        for trace in stacc:
+            isAcc = trace.stats['processing'][-1].lower().find('acc') > -1
+            if not isAcc:
+                continue #skip if this isn't an acceleration record
+            trace.stats['sac'] = {}
+            trace.stats['sac']['stla'] = trace.stats['coordinates']['latitude']
+            trace.stats['sac']['stlo'] = trace.stats['coordinates']['longitude']
+            trace.stats['sac']['stel'] = trace.stats['coordinates']['elevation']
+            trace.stats['sac']['idep'] = SAC_IACC #marks the SAC files as calibrated acceleration
+            traces.append(trace)
+        return traces
 
     def fetch(self,lat,lon,etime,radius,timewindow,outfolder):
         """
@@ -345,36 +545,86 @@ class IrisFetcher(StrongMotionFetcher):
         @param outfolder: Folder where retrieved strong motion mini-SEED data files should be written.
         @return: List of strong motion mini-SEED data files.
         """
-        etimestr = etime.strftime('%Y-%m-%dT%H:%M:%S')
-        st = getepidata(lat, lon, etimestr, tstart=-3,
-                                   tend=+timewindow, minradiuskm=0., maxradiuskm=radius,
-                                   channels='strong motion', location='*', source='IRIS')
         seedfiles = []
-        if st is not None:
-            stacc,stvel = getpeaks(st,pga=False,pgv=False,psa=False)
-            for trace in stacc:
-                isAcc = trace.stats['processing'][-1].lower().find('acc') > -1
-                if not isAcc:
-                    continue #skip if this isn't an acceleration record
-                nscl = '%s_%s_%s_%s.sac' % (trace.stats['network'],trace.stats['station'],
-                                             trace.stats['channel'],trace.stats['location'])
-                seedfile = os.path.join(outfolder,nscl)
-                trace.stats['sac'] = {}
-                trace.stats['sac']['stla'] = trace.stats['coordinates']['latitude']
-                trace.stats['sac']['stlo'] = trace.stats['coordinates']['longitude']
-                trace.stats['sac']['stel'] = trace.stats['coordinates']['elevation']
-                trace.write(seedfile,format='SAC')
-                seedfiles.append(seedfile)
+        for trace in self.getTraces(lat,lon,etime,radius,timewindow):
+            seedfile = os.path.join(outfolder,getSACName(trace))
+            trace.write(seedfile,format='SAC')
+            seedfiles.append(seedfile)
         return seedfiles
 
-def readiris(seedfile): #trivial, since we saved as a seed file
-    trace = read(seedfile)[0]
+    def fetchTraces(self,lat,lon,etime,radius,timewindow,rawfolder=None):
+        """
+        Retrieve the strong motion records associated with an event, without writing them to disk first.
+
+        The records are downloaded and corrected to acceleration right away, and handed out by the
+        returned generator as they would be read back from the SAC files written by fetch().  If rawfolder
+        is given, a copy of each record is written to a SAC file there by a background thread, so that
+        archiving the data does not hold up the conversion to peak ground motions.
+        @param lat: Latitude associated with event
+        @param lon: Longitude associated with event
+        @param etime: UTC time of event
+        @param radius: Distance window (km) within which to search for events on IRIS.
+        @param timewindow: Time window (sec) within which to search for events on IRIS.
+        @keyword rawfolder: Folder where SAC files should also be written, or None to not retain them.
+        @return: Generator of (ObsPy Trace object,header dictionary) tuples, where the header is the
+                 trace's sac dictionary.
+        """
+        traces = self.getTraces(lat,lon,etime,radius,timewindow)
+        return self.iterTraces(traces,rawfolder=rawfolder)
+
+    def iterTraces(self,traces,rawfolder=None):
+        """
+        Hand out downloaded traces, archiving them to SAC files in the background.
+        @param traces: List of ObsPy Trace objects (see getTraces()).
+        @keyword rawfolder: Folder where SAC files should also be written, or None to not retain them.
+        @return: Generator of (ObsPy Trace object,header dictionary) tuples.
+        """
+        pool = None
+        futures = {}
+        if rawfolder is not None:
+            pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            #hand the traces out in order, dropping our reference to each one as we go
+            traces.reverse()
+            while len(traces):
+                trace = traces.pop()
+                if pool is not None:
+                    #archive a copy, as trace2xml filters the samples in place
+                    sacfile = os.path.join(rawfolder,getSACName(trace))
+                    futures[pool.submit(trace.copy().write,sacfile,format='SAC')] = sacfile
+                yield (setSACStats(trace),trace.stats['sac'])
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+                for future,sacfile in futures.items():
+                    if future.exception() is not None:
+                        sys.stderr.write('Could not write SAC file %s: "%s"\n' % (sacfile,future.exception()))
+
+def getSACName(trace):
+    """
+    Get the name of the SAC file a trace is archived to.
+    @param trace: ObsPy Trace object.
+    @return: File name (NET_STA_CHA_LOC.sac).
+    """
+    return '%s_%s_%s_%s.sac' % (trace.stats['network'],trace.stats['station'],
+                                trace.stats['channel'],trace.stats['location'])
+
+def setSACStats(trace):
+    """
+    Copy the coordinates in a trace's sac dictionary into the main stats dictionary, as trace2xml expects.
+    @param trace: ObsPy Trace object with a sac dictionary in its stats.
+    @return: The same trace.
+    """
     #stuff the coordinates back into the main stats dict
     trace.stats['lat'] = trace.stats['sac']['stla']
     trace.stats['lon'] = trace.stats['sac']['stlo']
     trace.stats['height'] = trace.stats['sac']['stel']
     trace.stats['units'] = 'acc'
     return trace
+
+def readiris(seedfile,headonly=False): #trivial, since we saved as a seed file
+    trace = read(seedfile,headonly=headonly)[0]
+    return setSACStats(trace)
     
 if __name__ == '__main__':
     ifetch = IrisFetcher()
@@ -15,8 +15,8 @@ from xml.dom import minidom
 
 #local
 from .fetcher import StrongMotionFetcher,StrongMotionFetcherException
-from .trace2xml import trace2xml
 from . import util
+from . import webclient
 
 #third party
 from obspy.core.trace import Trace
@@ -24,8 +24,6 @@ from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
 import numpy as np
-import matplotlib.pyplot as plt
-from bs4 import BeautifulSoup
 
 HEADERS = {'STATION_CODE':'station',
            'STREAM':'channel',
@@ -46,12 +44,13 @@ URL = 'http://itaca.mi.ingv.it/ItacaNet/CadmoDriver?_action_prepare_find_div=1&_
 def fetchItaly(starttime,endtime):
     url = URL.replace('STARTTIME',starttime.strftime('%Y-%m-%d'))
     url = url.replace('STOPTIME',endtime.strftime('%Y-%m-%d'))
-    fh = urllib.request.urlopen(url)
+    fh = webclient.urlopen(url)
     data = fh.read()
     fh.close()
     startidx = data.find('<table class="CADMOMAINTABLE">')
     endidx = data.find('<!-- end of CADMOMAINTABLE -->')
     newdata = data[startidx:endidx]
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(newdata)
     rows = soup.findAll('tr')
     for row in rows[1:]:
@@ -62,17 +61,26 @@ def fetchItaly(starttime,endtime):
         etime = datetime.strptime(anchor.string,'%Y-%m-%d %H:%M:%S')
         print(eventid,str(etime))
 
-def readitaly(datafile):
-    f = open(datafile,'rt')
+def readitaly(datafile,headonly=False):
+    """
+    Read strong motion data from an Italian (ITACA) ASCII data file.
+    @param datafile: Path to a valid ITACA ASCII data file.
+    @keyword headonly: If True, skip the data, and return a trace with no samples (npts is set from the header).
+    @return: ObsPy Trace object, containing accelerometer data in m/s.
+    """
+    f = open(datafile,'rb')
     #header needs: station,channel,location,npts,starttime,sampling_rate,delta,calib,lat,lon,height,duration,endtime,maxacc,network
-    data = []
+    block = b''
     hdrdict = {}
-    for line in f.readlines():
+    for rawline in f:
+        line = rawline.decode('latin-1')
         if not len(line.strip()):
             continue
         if not line.find(':') > -1:
-            data.append(float(line.strip()))
-            continue
+            #first data line - the rest of the file is the data block, one sample per line
+            if not headonly:
+                block = rawline + f.read()
+            break
 
         key,value = line.split(':')
         key = key.strip()
@@ -81,7 +89,7 @@ def readitaly(datafile):
             continue
         hdrkey = HEADERS[key]
         if hdrkey == 'starttime':
-            value = UTCDateTime(datetime.datetime.strptime(value,TIMEFMT))
+            value = UTCDateTime(datetime.strptime(value,TIMEFMT))
         elif hdrkey not in ['station','channel','location','network']:
             value = float(value)
         hdrdict[hdrkey] = value
@@ -91,12 +99,14 @@ def readitaly(datafile):
     hdrdict['npts'] = int(hdrdict['npts'])
     hdrdict['calib'] = 1.0
     hdrdict['units'] = 'acc'
-    data = np.array(data)
     header = hdrdict.copy()
+    if headonly:
+        return util.headerTrace(hdrdict)
+    data = util.decodeBlock(block,npts=hdrdict['npts'])
     stats = Stats(hdrdict)
     trace = Trace(data,header=stats)
     #apply the calibration and convert from mm/s^2 to m/s^2
-    trace.data = trace.data * trace.stats['calib'] * 0.01 #convert to m/s^2
+    trace.data *= trace.stats['calib'] * 0.01 #convert to m/s^2
     return trace
 
 if __name__ == '__main__':
@@ -6,6 +6,7 @@ import re
 import sys
 import os.path
 import tarfile
+import io
 import ftplib
 import urllib.parse
 import base64
@@ -15,15 +16,14 @@ import urllib.request, urllib.parse, urllib.error
 
 #local
 from .fetcher import StrongMotionFetcher,StrongMotionFetcherException
-from .trace2xml import trace2xml
 from . import util
+from . import webclient
 
 #third party
 from obspy.core.trace import Trace
 from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 import numpy as np
-import matplotlib.pyplot as plt
 
 TIMEFMT = '%Y/%m/%d %H:%M:%S'
 DATEPAT = '[0-9]{4}/[0-9]{2}/[0-9]{2}-[0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{2}'
@@ -43,6 +43,7 @@ CGIPARAMS['datakind'] = 'all'
 
 KIKNETURL = 'http://www.kyoshin.bosai.go.jp/cgi-bin/kyoshin/quick/list_eqid_en.cgi?1+YEAR+QUARTER'
 CGI = 'http://www.kyoshin.bosai.go.jp/cgi-bin/kyoshin/auth/makearc?%s'
+DATAEXTENSIONS = ['NS','EW','UD','NS2','EW2','UD2'] #K-NET and KikNet surface channels (KikNet downhole channels end in 1)
 
 class KNETFetcher(StrongMotionFetcher):
     """
@@ -78,6 +79,39 @@ class KNETFetcher(StrongMotionFetcher):
         os.remove(tarfile)
         return datafiles
 
+    def fetchTraces(self,lat,lon,etime,radius,timewindow,rawfolder=None):
+        """
+        Retrieve the strong motion records associated with an event, without extracting them to disk.
+
+        The tar file is downloaded, and the data files inside it are parsed straight from the (compressed)
+        tar stream as the returned generator is consumed.  The tar file is deleted when the generator is exhausted.
+        @param lat: Latitude associated with event
+        @param lon: Longitude associated with event
+        @param etime: UTC time of event
+        @param radius: Distance window (km) within which to search for events on K-NET FTP site.
+        @param timewindow: Time window (sec) within which to search for events on K-NET FTP site.
+        @keyword rawfolder: Folder where the raw data files should also be written, or None to not retain them.
+        @return: Generator of (ObsPy Trace object,header dictionary) tuples.
+        """
+        jptime = etime + timedelta(seconds=JPTIMEOFF)
+        tarfile = self.fetchKNet(self.user,self.password,jptime,timewindow)
+        if tarfile is None:
+            raise StrongMotionFetcherException('No K-NET data was found within %i seconds of %s (JST).  Returning.' % (timewindow,jptime))
+        return self.iterTraces(tarfile,rawfolder=rawfolder)
+
+    def iterTraces(self,tarfilename,rawfolder=None):
+        """
+        Parse the data files inside a downloaded tar file, then delete it.
+        @param tarfilename: Tar file retrieved from K-NET.
+        @keyword rawfolder: Folder where the raw data files should also be written, or None to not retain them.
+        @return: Generator of (ObsPy Trace object,header dictionary) tuples.
+        """
+        try:
+            for trace,header in iterknettar(tarfilename,rawfolder=rawfolder):
+                yield (trace,header)
+        finally:
+            os.remove(tarfilename)
+
     def extractAllDataFiles(self,tarfilename,tarfolder):
         """
         Unpack data files from tar file retrieved from K-NET and KikNet.
@@ -134,7 +168,7 @@ class KNETFetcher(StrongMotionFetcher):
         jpquarter = str(quarters[jptime.month])
         url = KIKNETURL.replace('YEAR',jpyear)
         url = url.replace('QUARTER',jpquarter)
-        fh = urllib.request.urlopen(url)
+        fh = webclient.urlopen(url,ttl=webclient.QUERY_TTL)
         data = fh.read()
         fh.close()
         sidx = data.find('<SELECT NAME="eqidlist"')
@@ -163,7 +197,7 @@ class KNETFetcher(StrongMotionFetcher):
             req = urllib.request.Request(requesturl)
             base64string = base64.encodestring('%s:%s' % (user, password))[:-1]
             req.add_header("Authorization", "Basic %s" % base64string)
-            handle = urllib.request.urlopen(req)
+            handle = webclient.urlopen(req)
             data = handle.read()
             handle.close()
             localfile = os.path.join(os.getcwd(),dtime.strftime('%Y%m%d%H%M%S')+'.tar')
@@ -281,34 +315,106 @@ def readheader(hdrlines):
         hdrdict['units'] = 'acc' #this will be in all of the headers I read
     return hdrdict
 
-def readknet(knetfilename):
+def isknetfile(fname):
+    """
+    Determine from its name whether a K-NET/KikNet file holds data from a surface channel.
+    @param fname: File name or path.
+    @return: True if the file extension is one of DATAEXTENSIONS.
+    """
+    fext = os.path.splitext(fname)[1].lstrip('.').upper()
+    return fext in DATAEXTENSIONS
+
+def iterknettar(tarfilename,rawfolder=None,headonly=False):
+    """
+    Parse the KNet ASCII files inside a K-NET or KikNet tar file, without extracting them.
+
+    The tar file is read as a stream, and nested archives (eventid.knt.tar.gz, eventid.kik.tar.gz) are
+    streamed in turn.  Downhole (*1) and non-data members are skipped without being parsed.
+    @param tarfilename: Path to a (possibly compressed) tar file retrieved from K-NET.
+    @keyword rawfolder: Folder where the raw data files should also be written, or None to not retain them.
+    @keyword headonly: If True, parse only the header of each member (see readknet).
+    @return: Generator of (ObsPy Trace object,header dictionary) tuples.
+    """
+    tarball = tarfile.open(name=tarfilename,mode='r|*')
+    try:
+        for trace,header in itertarball(tarball,rawfolder,headonly):
+            yield (trace,header)
+    finally:
+        tarball.close()
+
+def itertarball(tarball,rawfolder,headonly):
+    """
+    Parse the KNet ASCII files in an open (stream mode) tar file, recursing into nested tar files.
+    """
+    for member in tarball:
+        if not member.isfile():
+            continue
+        fname = os.path.basename(member.name)
+        if fname.endswith('.gz'):
+            tarball2 = tarfile.open(fileobj=tarball.extractfile(member),mode='r|gz')
+            for trace,header in itertarball(tarball2,rawfolder,headonly):
+                yield (trace,header)
+            tarball2.close()
+            continue
+        if not isknetfile(fname):
+            continue
+        if headonly and rawfolder is None:
+            yield readknet(tarball.extractfile(member),headonly=True)
+            continue
+        data = tarball.extractfile(member).read()
+        if rawfolder is not None:
+            f = open(os.path.join(rawfolder,fname),'wb')
+            f.write(data)
+            f.close()
+        yield readknet(io.BytesIO(data),headonly=headonly)
+
+def readknetfile(dfile,headonly=False):
+    """
+    Read the surface channel traces from a KNet ASCII file, or from a K-NET/KikNet tar file.
+    @param dfile: Path to KNet ASCII file or tar file.
+    @keyword headonly: If True, parse only the headers (see readknet).
+    @return: List of ObsPy Trace objects (empty for KikNet downhole files).
+    """
+    if dfile.endswith('.tar') or dfile.endswith('.gz'): #un-extracted K-NET/KikNet tar file
+        return [trace for trace,header in iterknettar(dfile,headonly=headonly)]
+    if dfile.endswith('1'): #these files are KikNet downhole (deep) stations
+        return []
+    trace,header = readknet(dfile,headonly=headonly)
+    return [trace]
+
+def readknet(knetfilename,headonly=False):
     """
     Read a KNet ASCII file, and return an ObsPy Trace object, plus a dictionary of header values.
 
-    @param knetfilename: String path to valid KNet ASCII file, as described here: http://www.kyoshin.bosai.go.jp/kyoshin/man/knetform_en.html
+    @param knetfilename: String path to valid KNet ASCII file, as described here: http://www.kyoshin.bosai.go.jp/kyoshin/man/knetform_en.html,
+                         or a binary file object (i.e., a tar file member) containing one.
+    @keyword headonly: If True, stop at the end of the header, and return a trace with no samples
+                       (npts is estimated from the record duration and sampling rate).
     @return: ObsPy Trace object, and a dictionary of some of the header values found in the input file.
     """
-    data = []
     hdrdict = {}
-    f = open(knetfilename,'rt')
-    dataOn = False
+    if hasattr(knetfilename,'read'):
+        f = knetfilename
+    else:
+        f = open(knetfilename,'rb')
     headerlines = []
-    for line in f.readlines():
-        if line.startswith('Memo'):
+    for line in f:
+        if line.startswith(b'Memo'):
             hdrdict = readheader(headerlines)
-            dataOn = True
-            continue
-        if not dataOn:
-            headerlines.append(line)
-            continue
-        if dataOn:
-            parts = line.strip().split()
-            mdata = [float(p) for p in parts]
-            data = data + mdata
-    f.close()
+            break
+        headerlines.append(line.decode('latin-1'))
+    #everything after the Memo line is the data block, 8 samples per line
+    data = None
+    if not headonly:
+        data = util.decodeBlock(f.read())
+    if f is not knetfilename:
+        f.close()
 
     #fill in the values usually expected in Stats as best we can
-    hdrdict['npts'] = len(data)
+    if data is None:
+        hdrdict['npts'] = int(round(hdrdict['duration']*hdrdict['sampling_rate']))
+    else:
+        hdrdict['npts'] = len(data)
     elapsed = float(hdrdict['npts'])/float(hdrdict['sampling_rate'])
     hdrdict['endtime'] = hdrdict['starttime'] + elapsed
     hdrdict['network'] = 'NIED'
@@ -317,13 +423,14 @@ def readknet(knetfilename):
     #The Stats constructor appears to modify the fields in the input dictionary - let's save
     #a copy
     header = hdrdict.copy()
+    if headonly:
+        return (util.headerTrace(hdrdict),header)
     
-    data = np.array(data)
     stats = Stats(hdrdict)
     trace = Trace(data,header=stats)
 
     #apply the calibration and convert to m/s^2
-    trace.data = trace.data * trace.stats['calib'] * 0.01 #convert to m/s^2
+    trace.data *= trace.stats['calib'] * 0.01 #convert to m/s^2
     
     return (trace,header)
     
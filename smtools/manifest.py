@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+
+MANIFEST_NAME = '.smtools_manifest.json' #name of the manifest file written in each input folder
+MANIFEST_VERSION = 1 #bump this when the amplitude records change
+
+def encodeValue(value):
+    #numpy scalars (peak values, coordinates) are not JSON serializable
+    if hasattr(value,'item'):
+        return value.item()
+    raise TypeError('%s is not JSON serializable' % repr(value))
+
+def isComplete(record):
+    """
+    Check whether an amplitude record holds all of the peak values of its channel.
+    @param record: Amplitude record dictionary (see trace2xml.getRecord()), or None if the channel has no record.
+    @return: True if the record is complete (PGV is computed last, and is skipped in PGA-only mode).
+    """
+    return record is not None and 'pgv' in record
+
+class Manifest(object):
+    """
+    Record of the data files in an input folder, and the amplitude records derived from each of them.
+
+    For each file, the manifest stores its size, modification time, detected data source, the channels
+    it produced and their amplitude records.  On a rerun, scan() compares the folder to the manifest in
+    one os.scandir() pass, so that only added or modified files have to be read and processed again -
+    the amplitude records of the other files are taken from the manifest.
+
+    The manifest also stores a key describing the options the records were made with.  If the key
+    given for this run differs, the stored files are forgotten, so that every file counts as modified.
+    """
+    def __init__(self,folder,key=None):
+        """
+        Constructor - loads the folder's manifest, if there is one.
+        @param folder: Input folder.
+        @keyword key: JSON serializable value (e.g., a dictionary) of the options that affect the amplitude records.
+        """
+        self.folder = folder
+        self.filename = os.path.join(folder,MANIFEST_NAME)
+        self.key = key
+        self.files = {}
+        self.stats = {}
+        if os.path.isfile(self.filename):
+            try:
+                f = open(self.filename,'rt')
+                jdict = json.load(f)
+                f.close()
+                #compare the keys as they are written, i.e. with tuples turned into lists
+                if jdict['version'] == MANIFEST_VERSION and jdict.get('key') == json.loads(json.dumps(key)):
+                    self.files = jdict['files']
+            except (ValueError,KeyError):
+                self.files = {}
+
+    def scan(self):
+        """
+        List the files in the folder, and compare them to the manifest.
+        @return: Tuple of (list of all file paths,set of paths of unchanged files).
+        """
+        self.stats = {}
+        unchanged = set()
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or entry.name == MANIFEST_NAME:
+                continue
+            fstat = entry.stat()
+            self.stats[entry.name] = (fstat.st_size,fstat.st_mtime_ns)
+            if entry.name in self.files:
+                fdict = self.files[entry.name]
+                if (fdict['size'],fdict['mtime']) == self.stats[entry.name]:
+                    unchanged.add(entry.path)
+        #files that have been removed from the folder no longer contribute records
+        for fname in list(self.files.keys()):
+            if fname not in self.stats:
+                del self.files[fname]
+        allfiles = [os.path.join(self.folder,fname) for fname in sorted(self.stats.keys())]
+        return (allfiles,unchanged)
+
+    def getSource(self,dfile):
+        """
+        Get the data source recorded for an unchanged file.
+        @param dfile: Path to data file.
+        @return: Name of data source, or None if the file is not in the manifest.
+        """
+        fname = os.path.basename(dfile)
+        if fname not in self.files:
+            return None
+        return self.files[fname]['source']
+
+    def getRecords(self,datafiles):
+        """
+        Get the amplitude records previously derived from a list of files.
+        @param datafiles: List of data file paths.
+        @return: List of amplitude record dictionaries (see trace2xml.getRecord()).
+        """
+        records = []
+        for dfile in datafiles:
+            fname = os.path.basename(dfile)
+            if fname in self.files:
+                records += self.files[fname]['records']
+        return records
+
+    def update(self,source,filechannels,records):
+        """
+        Record the channels and amplitude records derived from newly processed files.
+
+        A file is only recorded if every one of its channels produced a full record.  Files with channels
+        that were dropped by the station prefilters, skipped after the deadline, or reduced to PGA only
+        are left out, so that they count as new on the next run and are processed again.
+        @param source: Name of data source (knet, geonet, etc.)
+        @param filechannels: Dictionary of data file path:list of channel ids read from the file.
+        @param records: List of amplitude records, which may include records of other files.
+        """
+        recorddict = {}
+        for record in records:
+            recorddict[record['channel_id']] = record
+        for dfile,channels in filechannels.items():
+            fname = os.path.basename(dfile)
+            if not all([isComplete(recorddict.get(channel)) for channel in channels]):
+                self.files.pop(fname,None)
+                continue
+            if fname not in self.stats:
+                fstat = os.stat(dfile)
+                self.stats[fname] = (fstat.st_size,fstat.st_mtime_ns)
+            size,mtime = self.stats[fname]
+            self.files[fname] = {'size':size,
+                                 'mtime':mtime,
+                                 'source':source,
+                                 'channels':channels,
+                                 'records':[recorddict[channel] for channel in channels]}
+
+    def save(self):
+        """
+        Write the manifest to the input folder.
+        """
+        jdict = {'version':MANIFEST_VERSION,
+                 'key':self.key,
+                 'files':self.files}
+        f = open(self.filename+'.tmp','wt')
+        json.dump(jdict,f,default=encodeValue)
+        f.close()
+        os.replace(self.filename+'.tmp',self.filename)
@@ -9,10 +9,12 @@ import re
 import sys
 import json
 import math
+from concurrent.futures import ThreadPoolExecutor,as_completed
 
 #local imports
 from neicmap.distance import sdist
 from .trace2xml import amps2xml
+from . import webclient
 
 #third party
 from bs4 import BeautifulSoup
@@ -25,9 +27,10 @@ DETAILURL = 'http://145.23.252.222:8080/opencms/rrsm/select-events/results/event
 DATEFMT = '%Y-%m-%d'
 TIMEFMT = '%Y-%m-%d %H:%M:%S'
 FLOATPAT = '[+-]?(?=\d*[.eE])(?=\.?\d)\d*\.?\d*(?:[eE][+-]?\d+)?'
+WORKERS = 8 #number of station detail pages downloaded at the same time
 
 def getEventList(url):
-    fh = urllib.request.urlopen(url)
+    fh = webclient.urlopen(url,ttl=webclient.QUERY_TTL)
     data = fh.read().decode('utf-8')
     fh.close()
     tstart = data.find('<tbody>')
@@ -56,7 +59,7 @@ def getEventList(url):
     return eventlist
 
 def getChannels(durl):
-    fh = urllib.request.urlopen(durl)
+    fh = webclient.urlopen(durl)
     data = fh.read().decode('utf-8')
     fh.close()
     tstart = data.find('<tbody>')
@@ -98,7 +101,7 @@ def getNumber(numberstr):
     return number
 
 def getStationList(eurl,eventid):
-    fh = urllib.request.urlopen(eurl)
+    fh = webclient.urlopen(eurl)
     data = fh.read().decode('utf-8')
     fh.close()
     tstart = data.find('<tbody>')
@@ -109,17 +112,8 @@ def getStationList(eurl,eventid):
     root = minidom.parseString(xmlstr)
     rows = root.getElementsByTagName('tr')
     stationlist = []
-    ic = 0
-    lastdec = 0
-    #print len(rows)
-    sys.stderr.write('% Progress:\n')
-    sys.stderr.write('0...')
+    durls = []
     for row in rows:
-        pct = math.floor((ic/float(len(rows)))*100/10)*10
-        #print ic,pct
-        if pct > lastdec:
-            lastdec += 10
-            sys.stderr.write('%i...' % lastdec)
         stationdict = {}
         cells = row.getElementsByTagName('td')
         stationdict['code'] = cells[1].firstChild.data.strip()
@@ -131,10 +125,29 @@ def getStationList(eurl,eventid):
         durl = DETAILURL.replace('[EVENTID]',eventid)
         durl = durl.replace('[NET]',net)
         durl = durl.replace('[STA]',sta)
-        channeldict = getChannels(durl)
-        stationdict['channels'] = channeldict.copy()
         stationlist.append(stationdict)
-        ic += 1
+        durls.append(durl)
+    root.unlink()
+
+    #download and parse the station detail pages WORKERS at a time, keeping the stations in page order
+    ic = 0
+    lastdec = 0
+    sys.stderr.write('% Progress:\n')
+    sys.stderr.write('0...')
+    pool = ThreadPoolExecutor(max_workers=WORKERS)
+    try:
+        futures = {}
+        for stationdict,durl in zip(stationlist,durls):
+            futures[pool.submit(getChannels,durl)] = stationdict
+        for future in as_completed(futures):
+            futures[future]['channels'] = future.result()
+            ic += 1
+            pct = math.floor((ic/float(len(durls)))*100/10)*10
+            while pct > lastdec:
+                lastdec += 10
+                sys.stderr.write('%i...' % lastdec)
+    finally:
+        pool.shutdown(cancel_futures=True)
     sys.stderr.write('\n')
     return stationlist
         
@@ -169,7 +182,7 @@ if __name__ == '__main__':
     url = sys.argv[1]
     url = url.replace('#summary','')
     url += '.json'
-    fh = urllib.request.urlopen(url)
+    fh = webclient.urlopen(url)
     data = fh.read()
     fh.close()
     jdict = json.loads(data)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import sys
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+#third party
+from obspy.core.trace import Trace
+import numpy as np
+
+class SharedTraceTransport(object):
+    """
+    Hand ObsPy Trace objects to worker processes without pickling their sample arrays.
+
+    The publishing process copies each trace's samples once into a multiprocessing.shared_memory
+    segment, and sends the worker only a small descriptor (segment name, npts, dtype and stats).  Each
+    trace gets a segment of its own, so that it can be freed as soon as that channel is done.
+    The worker maps the segment with attach(), and the publisher reclaims the segment with release()
+    once the worker's results for that channel are in.
+
+    Only the publisher tracks the segments (so that they are cleaned up if it dies): workers attach
+    without registering them with the resource tracker (see openSegment()).
+    """
+    def __init__(self):
+        resource_tracker.ensure_running()
+        self.segments = {}
+
+    def publish(self,trace):
+        """
+        Copy a trace's samples into a new shared memory segment.
+        @param trace: ObsPy Trace object.
+        @return: Descriptor dictionary, with keys segment,npts,dtype,stats.
+        """
+        data = np.ascontiguousarray(trace.data)
+        shm = shared_memory.SharedMemory(create=True,size=max(data.nbytes,1))
+        buffer = np.ndarray(data.shape,dtype=data.dtype,buffer=shm.buf)
+        buffer[:] = data
+        del buffer
+        self.segments[shm.name] = shm
+        descriptor = {'segment':shm.name,
+                      'npts':len(data),
+                      'dtype':data.dtype.str,
+                      'stats':trace.stats}
+        return descriptor
+
+    def release(self,descriptor):
+        """
+        Free the shared memory segment holding a published trace.
+        @param descriptor: Descriptor dictionary returned by publish().
+        """
+        shm = self.segments.pop(descriptor['segment'],None)
+        if shm is None:
+            return
+        shm.close()
+        #a worker attaching on Python < 3.13 drops the segment from the (shared) resource tracker, so
+        #register it again, so that unlink() has a registration to remove
+        resource_tracker.register(shm._name,'shared_memory')
+        shm.unlink()
+
+    def close(self):
+        """
+        Free all segments that have not yet been released.
+        """
+        for name in list(self.segments.keys()):
+            self.release({'segment':name})
+
+def openSegment(name):
+    """
+    Attach to an existing shared memory segment, leaving it untracked by the resource tracker.
+
+    The process that creates a segment owns it.  If an attaching process registered it as well, its
+    resource tracker would unlink the segment (or warn about a leak) when the process exits, and with a
+    tracker shared with the publisher, the registration would be dropped by whichever process
+    unregistered it first.  Python 3.13 supports this with track=False; older versions register every
+    segment a process opens, so the registration is removed again right after attaching (the publisher
+    restores it before unlinking the segment - see SharedTraceTransport.release()).
+    @param name: Segment name.
+    @return: SharedMemory object.
+    """
+    if sys.version_info >= (3,13):
+        return shared_memory.SharedMemory(name=name,track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name,'shared_memory')
+    return shm
+
+def attach(descriptor):
+    """
+    Map a published trace into the current process without copying its samples.
+
+    The returned trace's data is a view into the shared segment, so the shared memory object must
+    be kept until the trace is no longer used, and then closed with detach().
+    @param descriptor: Descriptor dictionary returned by SharedTraceTransport.publish().
+    @return: Tuple of (ObsPy Trace object,SharedMemory object).
+    """
+    shm = openSegment(descriptor['segment'])
+    dtype = np.dtype(descriptor['dtype'])
+    data = np.ndarray((descriptor['npts'],),dtype=dtype,buffer=shm.buf)
+    trace = Trace(data,header=descriptor['stats'])
+    return (trace,shm)
+
+def detach(shm):
+    """
+    Unmap a shared segment from the current process.
+    @param shm: SharedMemory object returned by attach().
+    """
+    try:
+        shm.close()
+    except BufferError:
+        pass #a numpy view is still alive somewhere; the mapping goes away when the process exits
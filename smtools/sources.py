@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+#stdlib imports
+from collections import OrderedDict
+import importlib
+import fnmatch
+import struct
+import glob
+import os.path
+
+#local imports
+from .manifest import MANIFEST_NAME
+
+SNIFFBYTES = 2048 #number of bytes read from the start of a file to detect its format
+SIDECAR_EXT = '.smcache' #extension added to data file names for trace cache sidecar files (see cache.TraceCache)
+SAC_UNDEFINED = -12345.0 #value of SAC header fields that are not set
+SAC_IACC = 8 #SAC IDEP (dependent variable) value for acceleration
+
+def sniffknet(head):
+    return head.startswith(b'Origin Time')
+
+def sniffturkey(head):
+    return head.find(b'STATION ID') > -1
+
+def sniffunam(head):
+    return head.find(b'CLAVE DE LA ESTACION') > -1 or head.find(b'NOMBRE DE LA ESTACION') > -1
+
+def sniffitaly(head):
+    return head.find(b'STATION_CODE') > -1 and head.find(b'DATA_TIME_FIRST_SAMPLE') > -1
+
+def sniffchile(head):
+    return head.startswith(b'#') and head.find(b'# Estacion') > -1
+
+def sniffsac(head):
+    #the SAC header version (NVHDR, always 6) is the 7th integer header value, 304 bytes in
+    if len(head) < 632:
+        return False
+    for order in ['<','>']:
+        if struct.unpack(order+'i',head[304:308])[0] == 6:
+            return True
+    return False
+
+def sniffiris(head):
+    #SAC files written by the IRIS fetcher are already corrected to acceleration (IDEP, the 17th integer
+    #header value), and carry the station coordinates (STLA and STLO, the 32nd and 33rd float values)
+    if not sniffsac(head):
+        return False
+    for order in ['<','>']:
+        if struct.unpack(order+'i',head[304:308])[0] != 6:
+            continue
+        idep = struct.unpack(order+'i',head[344:348])[0]
+        stla,stlo = struct.unpack(order+'ff',head[124:132])
+        return idep == SAC_IACC and stla != SAC_UNDEFINED and stlo != SAC_UNDEFINED
+    return False
+
+def unamname(fname):
+    #UNAM file extensions are station sequence numbers (e.g., SCT19910101.123)
+    return os.path.splitext(fname)[1][1:].isdigit()
+
+def sniffsmt(head):
+    return head.startswith(b'SMTRACE1')
+
+def sniffpickle(head):
+    return head.startswith(b'\x80')
+
+#Registry of supported strong motion data sources.  For each source:
+#description - Text displayed by getstrong.py -s.
+#module      - Module containing the reader and fetcher, imported the first time they are needed.
+#reader      - Name of the function in module that reads a data file (None if data files are not supported).
+#returns     - What the reader returns: 'list' (of traces), 'tuple' (list of traces,list of headers), 'trace' or 'stream'.
+#options     - Keyword arguments supported by the reader (of headonly, doRotation).
+#patterns    - Glob patterns matching the data file names.
+#namecheck   - Function that further checks a file name matched by patterns, or None.
+#sniffer     - Function that checks the first SNIFFBYTES bytes of a file, or None if the file name is all we can go on.
+#detect      - True if files of this source should be recognized in folders of mixed data.
+#cached      - True if parsed files are worth keeping in the binary trace cache (i.e., slow ASCII formats).
+#fetcher     - Name of the StrongMotionFetcher class in module, or None if data can not be downloaded.
+#fetchmsg    - Message displayed when downloading data, or when downloading is not supported.
+SOURCE_KEYS = ['description','module','reader','returns','options','patterns','namecheck','sniffer',
+               'detect','cached','fetcher','fetchmsg']
+SOURCES = OrderedDict()
+SOURCES['knet'] = {'description':'Japanese Strong Motion (NIED)',
+                   'module':'smtools.knet',
+                   'reader':'readknetfile',
+                   'returns':'list',
+                   'options':['headonly'],
+                   'patterns':['*.NS','*.EW','*.UD'],
+                   'namecheck':None,
+                   'sniffer':sniffknet,
+                   'detect':True,
+                   'cached':True,
+                   'fetcher':'KNETFetcher',
+                   'fetchmsg':'Fetching strong motion data from NIED...'}
+SOURCES['geonet'] = {'description':'New Zealand (GNS)',
+                     'module':'smtools.geonet',
+                     'reader':'readgeonet',
+                     'returns':'tuple',
+                     'options':['headonly'],
+                     'patterns':['*.V1A'],
+                     'namecheck':None,
+                     'sniffer':None,
+                     'detect':True,
+                     'cached':True,
+                     'fetcher':'GeonetFetcher',
+                     'fetchmsg':'Fetching strong motion data from GeoNet...'}
+SOURCES['turkey'] = {'description':'Turkish strong motion repository',
+                     'module':'smtools.turkey',
+                     'reader':'readturkey',
+                     'returns':'tuple',
+                     'options':['headonly'],
+                     'patterns':['[0-9][0-9][0-9][0-9]*.txt'],
+                     'namecheck':None,
+                     'sniffer':sniffturkey,
+                     'detect':True,
+                     'cached':True,
+                     'fetcher':'TurkeyFetcher',
+                     'fetchmsg':'Fetching strong motion data from Turkey...'}
+SOURCES['iran'] = {'description':'Iranian strong motion repository',
+                   'module':'smtools.iran',
+                   'reader':'readiran',
+                   'returns':'tuple',
+                   'options':['headonly','doRotation'],
+                   'patterns':['*.V1'],
+                   'namecheck':None,
+                   'sniffer':None,
+                   'detect':True,
+                   'cached':True,
+                   'fetcher':None,
+                   'fetchmsg':'Automated downloading of Iran strong motion data is not supported.  Use the -i option instead.\nObtain strong motion records from: http://www.bhrc.ac.ir/portal/Default.aspx?tabid=635'}
+SOURCES['iris'] = {'description':'Incorporated Research Institutions for Seismology',
+                   'module':'smtools.iris',
+                   'reader':'readiris',
+                   'returns':'trace',
+                   'options':['headonly'],
+                   'patterns':['*.sac'],
+                   'namecheck':None,
+                   'sniffer':sniffiris,
+                   'detect':True, #checked before generic SAC data
+                   'cached':False,
+                   'fetcher':'IrisFetcher',
+                   'fetchmsg':'Fetching strong motion and broadband data from IRIS...'}
+SOURCES['italy'] = {'description':'Italian strong motion (INGV)',
+                    'module':'smtools.italy',
+                    'reader':'readitaly',
+                    'returns':'trace',
+                    'options':['headonly'],
+                    'patterns':['*DAT'],
+                    'namecheck':None,
+                    'sniffer':sniffitaly,
+                    'detect':True,
+                    'cached':True,
+                    'fetcher':None,
+                    'fetchmsg':'Automated downloading of Italian strong motion data is not supported.  Use the -i option instead.'}
+SOURCES['unam'] = {'description':'Mexican strong motion data (UNAM)',
+                   'module':'smtools.unam',
+                   'reader':'readunam',
+                   'returns':'tuple',
+                   'options':['headonly'],
+                   'patterns':['*.[0-9]*'],
+                   'namecheck':unamname,
+                   'sniffer':sniffunam,
+                   'detect':True,
+                   'cached':True,
+                   'fetcher':None,
+                   'fetchmsg':'Automated downloading of Mexican (UNAM) strong motion data is not supported.  Use the -i option instead.'}
+SOURCES['orfeus'] = {'description':'Integrated European strong motion data repository',
+                     'module':'smtools.orfeus',
+                     'reader':None,
+                     'returns':None,
+                     'options':[],
+                     'patterns':[],
+                     'namecheck':None,
+                     'sniffer':None,
+                     'detect':False,
+                     'cached':False,
+                     'fetcher':None,
+                     'fetchmsg':'Offline data processing not supported for Orfeus.'}
+SOURCES['sac'] = {'description':'Any data in SAC format (must also provide dataless seed in input directory',
+                  'module':'obspy',
+                  'reader':'read',
+                  'returns':'stream',
+                  'options':['headonly'],
+                  'patterns':['*.sac'],
+                  'namecheck':None,
+                  'sniffer':sniffsac,
+                  'detect':True,
+                  'cached':False,
+                  'fetcher':None,
+                  'fetchmsg':'Automated downloading of SAC strong motion data is not supported.  Use the -i option instead.\nSAC is a data standard, not a source.  You will need to have obtained SAC data from your own source.'}
+SOURCES['chile'] = {'description':'Calibrated ASCII data from Chilean seismic network',
+                    'module':'smtools.chile',
+                    'reader':'readchile',
+                    'returns':'trace',
+                    'options':['headonly'],
+                    'patterns':['*.asc'],
+                    'namecheck':None,
+                    'sniffer':sniffchile,
+                    'detect':True,
+                    'cached':True,
+                    'fetcher':None,
+                    'fetchmsg':'Automated downloading of Chilean calibrated ASCII strong motion data is not supported.  Use the -i option instead.'}
+SOURCES['pickle'] = {'description':'Calibrated strong motion data from any source',
+                     'module':'obspy',
+                     'reader':'read',
+                     'returns':'stream',
+                     'options':[],
+                     'patterns':['*.pickle'],
+                     'namecheck':None,
+                     'sniffer':sniffpickle,
+                     'detect':True,
+                     'cached':False,
+                     'fetcher':None,
+                     'fetchmsg':'Automated downloading of pickled strong motion data is not supported.  Use the -i option instead.'}
+SOURCES['smt'] = {'description':'Calibrated strong motion data in smtools binary format (see filtertrace.py)',
+                  'module':'smtools.tracefile',
+                  'reader':'readsmt',
+                  'returns':'list',
+                  'options':['headonly'],
+                  'patterns':['*.smt'],
+                  'namecheck':None,
+                  'sniffer':sniffsmt,
+                  'detect':True,
+                  'cached':False,
+                  'fetcher':None,
+                  'fetchmsg':'Automated downloading of smtools binary strong motion data is not supported.  Use the -i option instead.'}
+
+def checkSources():
+    """
+    Make sure that every registry entry has all of the SOURCE_KEYS (and nothing else), so that a
+    mistake in an entry shows up when the module is imported, rather than when a file is classified.
+    """
+    for name,entry in SOURCES.items():
+        missing = [key for key in SOURCE_KEYS if key not in entry]
+        extra = [key for key in entry.keys() if key not in SOURCE_KEYS]
+        if len(missing) or len(extra):
+            raise KeyError('Data source %s is missing keys %s, has unknown keys %s' % (name,missing,extra))
+
+checkSources()
+
+def getSourceNames(readable=False):
+    """
+    Get the names of the registered data sources.
+    @keyword readable: If True, only return sources whose data files can be read.
+    @return: List of source names, in registry order.
+    """
+    return [name for name,entry in SOURCES.items() if not readable or entry['reader'] is not None]
+
+def getSource(source):
+    """
+    Get the registry entry for a data source.
+    @param source: Name of data source (knet, geonet, etc.)
+    @return: Dictionary describing the source (see SOURCES).
+    """
+    if source not in SOURCES:
+        raise KeyError('Data source %s not supported.' % source)
+    return SOURCES[source]
+
+def getModule(source):
+    """
+    Import (on first use) the module implementing a data source.
+    @param source: Name of data source (knet, geonet, etc.)
+    @return: Module object.
+    """
+    return importlib.import_module(getSource(source)['module'])
+
+def getFetcher(source,*args,**kwargs):
+    """
+    Create the fetcher object for a data source.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param args: Arguments to the fetcher constructor (i.e., K-NET user and password).
+    @param kwargs: Keyword arguments to the fetcher constructor.
+    @return: StrongMotionFetcher object, or None if the source does not support downloading.
+    """
+    entry = getSource(source)
+    if entry['fetcher'] is None:
+        return None
+    return getattr(getModule(source),entry['fetcher'])(*args,**kwargs)
+
+def readFile(source,dfile,headonly=False,doRotation=True):
+    """
+    Read all of the traces from one data file with the reader registered for a data source.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param dfile: Path to data file.
+    @keyword headonly: If True, read only the headers (ignored by pickle files).
+    @keyword doRotation: Apply back-azimuth rotation of Iran L & T channels to NS and EW.
+    @return: List of ObsPy Trace objects.
+    """
+    entry = getSource(source)
+    if entry['reader'] is None:
+        raise KeyError('Reading data files is not supported for source %s.' % source)
+    kwargs = {}
+    if 'headonly' in entry['options']:
+        kwargs['headonly'] = headonly
+    if 'doRotation' in entry['options']:
+        kwargs['doRotation'] = doRotation
+    result = getattr(getModule(source),entry['reader'])(dfile,**kwargs)
+    if entry['returns'] == 'tuple':
+        return result[0]
+    if entry['returns'] == 'trace':
+        return [result]
+    return list(result)
+
+def isSmtoolsFile(fname):
+    """
+    Check whether a file was written by smtools itself (a trace cache sidecar or a folder manifest),
+    rather than being a data file.
+    @param fname: File name or path.
+    @return: True if the file should never be read as data.
+    """
+    fname = os.path.basename(fname)
+    return fname == MANIFEST_NAME or fname.find(SIDECAR_EXT) > -1
+
+def matchesSource(source,fname):
+    """
+    Check whether a file name matches one of the glob patterns (and the name check) of a data source.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param fname: File name or path.
+    @return: True if the file name matches.
+    """
+    if isSmtoolsFile(fname):
+        return False
+    entry = getSource(source)
+    fname = os.path.basename(fname)
+    for pattern in entry['patterns']:
+        if fnmatch.fnmatch(fname,pattern):
+            return entry['namecheck'] is None or entry['namecheck'](fname)
+    return False
+
+def findFiles(source,folder):
+    """
+    Find the data files of a data source in a folder, by name.
+    @param source: Name of data source (knet, geonet, etc.)
+    @param folder: Folder to search.
+    @return: List of data file paths.
+    """
+    datafiles = []
+    for pattern in getSource(source)['patterns']:
+        for dfile in glob.glob(os.path.join(folder,pattern)):
+            if dfile not in datafiles and matchesSource(source,dfile):
+                datafiles.append(dfile)
+    return datafiles
+
+def readHead(dfile):
+    f = open(dfile,'rb')
+    head = f.read(SNIFFBYTES)
+    f.close()
+    return head
+
+def detectSource(dfile):
+    """
+    Determine the data source of a file from its name and first bytes.
+
+    Sources whose patterns match the file name are tried first - a match is confirmed by the source's
+    sniffer, if it has one.  Otherwise, the sniffers of the remaining sources are tried in turn.
+    @param dfile: Path to data file.
+    @return: Name of data source, or None if the format was not recognized.
+    """
+    if isSmtoolsFile(dfile):
+        return None
+    names = [name for name,entry in SOURCES.items() if entry['detect']]
+    matched = [name for name in names if matchesSource(name,dfile)]
+    candidates = matched + [name for name in names if name not in matched]
+    head = None
+    for name in candidates:
+        sniffer = SOURCES[name]['sniffer']
+        if sniffer is None:
+            if name in matched:
+                return name
+            continue
+        if head is None:
+            head = readHead(dfile)
+        if sniffer(head):
+            return name
+    return None
+
+def classifyFiles(datafiles,manifest=None,unchanged=None):
+    """
+    Group a list of files (i.e., a folder of mixed data) by data source.
+    @param datafiles: List of file paths.  Files written by smtools itself (see isSmtoolsFile()) are skipped.
+    @keyword manifest: smtools.manifest.Manifest object, from which the source of unchanged files is taken, or None.
+    @keyword unchanged: Set of paths of files unchanged since the manifest was written, or None.
+    @return: Tuple of (OrderedDict of source name:list of data files,list of unrecognized files).
+    """
+    groups = OrderedDict()
+    unknown = []
+    for dfile in datafiles:
+        if isSmtoolsFile(dfile):
+            continue
+        source = None
+        if manifest is not None and unchanged is not None and dfile in unchanged:
+            source = manifest.getSource(dfile)
+        if source is None:
+            source = detectSource(dfile)
+        if source is None:
+            unknown.append(dfile)
+            continue
+        if source not in groups:
+            groups[source] = []
+        groups[source].append(dfile)
+    return (groups,unknown)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import os.path
+import json
+import time
+import copy
+
+#third party
+from obspy import read_inventory,UTCDateTime
+from obspy.fdsn import Client as FDSN_Client
+from obspy.station.inventory import Inventory
+from obspy.core.util.geodetics import gps2DistAzimuth
+from obspy.core import AttribDict
+
+STATIONDIR = os.path.join(os.path.expanduser('~'),'.smtools','stationxml') #default folder for cached metadata
+INDEX_NAME = 'index.json' #name of the file listing the cached regions and stations
+INDEX_VERSION = 1
+MAXAGE = 7*86400 #seconds after which a region is checked for updated stations
+
+class StationCache(object):
+    """
+    Local store of FDSN station metadata, at response level.
+
+    The metadata of each station (all of its channels and epochs, with coordinates and responses) is kept
+    in one StationXML file.  An index records the circular regions that have been downloaded, and when.
+    A request for a region inside a downloaded one is served from the cache.  If the region was downloaded
+    before the requested time window ended, or more than MAXAGE seconds ago, only the stations updated
+    since then are downloaded (FDSN updatedafter), and their files replaced.
+
+    With the cache, the fetcher only has to download waveforms: coordinates and responses are attached
+    to the traces from the cached metadata (see attach()).
+    """
+    def __init__(self,cachedir=STATIONDIR,source='IRIS'):
+        """
+        Constructor
+        @keyword cachedir: Folder in which to store StationXML files (in a sub-folder for each data center).
+        @keyword source: FDSN data center name ('IRIS','NCEDC', etc.)
+        """
+        cachedir = os.path.join(cachedir,source)
+        self.cachedir = cachedir
+        self.source = source
+        self.client = None
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.indexfile = os.path.join(cachedir,INDEX_NAME)
+        self.regions = []
+        self.stations = {}
+        if os.path.isfile(self.indexfile):
+            try:
+                f = open(self.indexfile,'rt')
+                jdict = json.load(f)
+                f.close()
+                if jdict['version'] == INDEX_VERSION:
+                    self.regions = jdict['regions']
+                    self.stations = jdict['stations']
+            except (ValueError,KeyError):
+                pass
+
+    def getClient(self):
+        if self.client is None:
+            self.client = FDSN_Client(self.source)
+        return self.client
+
+    def saveIndex(self):
+        jdict = {'version':INDEX_VERSION,
+                 'regions':self.regions,
+                 'stations':self.stations}
+        f = open(self.indexfile+'.tmp','wt')
+        json.dump(jdict,f)
+        f.close()
+        os.replace(self.indexfile+'.tmp',self.indexfile)
+
+    def findRegion(self,lat,lon,radius,channels):
+        """
+        Find a downloaded region that contains a circle.
+        @param lat: Latitude of circle center.
+        @param lon: Longitude of circle center.
+        @param radius: Radius of circle (km).
+        @param channels: Comma separated channel codes the region must have been downloaded with.
+        @return: Region dictionary (keys lat,lon,radius,channels,fetched), or None.
+        """
+        for region in self.regions:
+            if region['channels'] != channels:
+                continue
+            distance,az1,az2 = gps2DistAzimuth(lat,lon,region['lat'],region['lon'])
+            if distance/1000.0 + radius <= region['radius']:
+                return region
+        return None
+
+    def mergeChannels(self,code,station):
+        """
+        Merge the channels already cached for a station with newly downloaded ones.
+        @param code: Station code (NET.STA).
+        @param station: Newly downloaded ObsPy Station.
+        @return: ObsPy Station holding the new channels, plus the cached channels (epochs) they don't replace.
+        """
+        if code not in self.stations:
+            return station
+        fname = os.path.join(self.cachedir,self.stations[code]['file'])
+        if not os.path.isfile(fname):
+            return station
+        newkeys = set([(c.location_code,c.code,c.start_date) for c in station.channels])
+        channels = []
+        for network in read_inventory(fname,format='STATIONXML'):
+            for oldstation in network:
+                for channel in oldstation.channels:
+                    if (channel.location_code,channel.code,channel.start_date) not in newkeys:
+                        channels.append(channel)
+        if not len(channels):
+            return station
+        station = copy.copy(station)
+        station.channels = channels + station.channels
+        return station
+
+    def store(self,inventory):
+        """
+        Save the stations of an inventory, one StationXML file per station.
+        A station that is already cached keeps the channels it has that are not in the inventory (e.g.
+        channels downloaded for a different channel list), so regions sharing a station don't overwrite
+        each other's channels.
+        @param inventory: ObsPy Inventory at response level.
+        """
+        for network in inventory:
+            for station in network:
+                code = '%s.%s' % (network.code,station.code)
+                station = self.mergeChannels(code,station)
+                stnetwork = copy.copy(network)
+                stnetwork.stations = [station]
+                stinventory = Inventory(networks=[stnetwork],source=inventory.source)
+                fname = code + '.xml'
+                tmpfile = os.path.join(self.cachedir,fname+'.tmp')
+                stinventory.write(tmpfile,format='STATIONXML')
+                os.replace(tmpfile,os.path.join(self.cachedir,fname))
+                self.stations[code] = {'lat':station.latitude,
+                                       'lon':station.longitude,
+                                       'file':fname}
+
+    def download(self,lat,lon,radius,channels,updatedafter=None):
+        """
+        Download the metadata of the stations in a circle.
+        @param lat: Latitude of circle center.
+        @param lon: Longitude of circle center.
+        @param radius: Radius of circle (km).
+        @param channels: Comma separated channel codes (wildcards allowed).
+        @keyword updatedafter: UTCDateTime - only download stations updated after this time.
+        """
+        kwargs = {}
+        if updatedafter is not None:
+            kwargs['updatedafter'] = updatedafter
+        try:
+            inventory = self.getClient().get_stations(latitude=lat,longitude=lon,maxradius=radius/111.32,
+                                                      channel=channels,level='response',**kwargs)
+        except Exception as error:
+            if str(error).find('No data') < 0:
+                raise
+            return #nothing (new) in this region
+        self.store(inventory)
+
+    def update(self,lat,lon,radius,channels,endtime=None):
+        """
+        Make sure the cache holds current metadata for the stations in a circle.
+        @param lat: Latitude of circle center.
+        @param lon: Longitude of circle center.
+        @param radius: Radius of circle (km).
+        @param channels: Comma separated channel codes (wildcards allowed).
+        @keyword endtime: UTCDateTime end of the time window the metadata is needed for, or None.
+        """
+        now = time.time()
+        region = self.findRegion(lat,lon,radius,channels)
+        if region is None:
+            self.download(lat,lon,radius,channels)
+            self.regions.append({'lat':lat,'lon':lon,'radius':radius,'channels':channels,'fetched':now})
+        elif now - region['fetched'] > MAXAGE or (endtime is not None and endtime.timestamp > region['fetched']):
+            self.download(region['lat'],region['lon'],region['radius'],channels,
+                          updatedafter=UTCDateTime(region['fetched']))
+            region['fetched'] = now
+        else:
+            return
+        self.saveIndex()
+
+    def getInventory(self,lat,lon,radius,channels,minradius=0.,starttime=None,endtime=None):
+        """
+        Get the metadata of the stations in a circle, downloading only what the cache is missing.
+        @param lat: Latitude of circle center.
+        @param lon: Longitude of circle center.
+        @param radius: Radius of circle (km).
+        @param channels: Comma separated channel codes (wildcards allowed).
+        @keyword minradius: Leave out stations closer than this to the center (km).
+        @keyword starttime: UTCDateTime - keep only the channel epochs in effect between starttime and endtime.
+        @keyword endtime: UTCDateTime - see starttime.
+        @return: ObsPy Inventory at response level, or None if there are no stations.
+        """
+        self.update(lat,lon,radius,channels,endtime=endtime)
+        inventory = None
+        for code,sdict in sorted(self.stations.items()):
+            distance,az1,az2 = gps2DistAzimuth(lat,lon,sdict['lat'],sdict['lon'])
+            if distance/1000.0 < minradius or distance/1000.0 > radius:
+                continue
+            stinventory = read_inventory(os.path.join(self.cachedir,sdict['file']),format='STATIONXML')
+            if inventory is None:
+                inventory = stinventory
+            else:
+                inventory += stinventory
+        if inventory is None:
+            return None
+        kwargs = {}
+        if starttime is not None:
+            kwargs['starttime'] = starttime
+        if endtime is not None:
+            kwargs['endtime'] = endtime
+        #keep only the channels asked for, in the time window
+        selected = None
+        for pattern in channels.split(','):
+            subset = inventory.select(channel=pattern,**kwargs)
+            if selected is None:
+                selected = subset
+            else:
+                selected += subset
+        if not len(selected.get_contents()['channels']):
+            return None
+        return selected
+
+def attach(st,inventory):
+    """
+    Attach responses and coordinates from an inventory to the traces of a stream.
+    @param st: ObsPy Stream.
+    @param inventory: ObsPy Inventory at response level.
+    @return: List of ids of traces for which no metadata was found.
+    """
+    missing = []
+    for trace in st:
+        try:
+            trace.stats.response = inventory.get_response(trace.id,trace.stats.starttime)
+            coord = inventory.get_coordinates(trace.id,trace.stats.starttime)
+            trace.stats.coordinates = AttribDict({'latitude': coord['latitude'],
+                                                  'longitude': coord['longitude'],
+                                                  'elevation': coord['elevation']})
+        except Exception:
+            missing.append(trace.id)
+    return missing
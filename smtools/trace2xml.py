@@ -6,19 +6,23 @@ warnings.filterwarnings("ignore")
 #stdlib imports
 import sys
 import os.path
+import time
+import collections
+import multiprocessing
 from datetime import datetime
+from collections import OrderedDict
 
 #third party imports
-from obspy import read
-from obspy.signal.invsim import seisSim, cornFreq2Paz
-from obspy.xseed.parser import Parser
-from neicio.tag import Tag
-import matplotlib.pyplot as plt
-from matplotlib import dates
+#(obspy, neicio and matplotlib are slow to import, so they are imported by the functions that use them -
+#getstrong.py and getamps.py import this module at startup)
 
 FILTER_FREQ = 0.02
 CORNERS = 4
 
+FLUSH_STATIONS = 10 #in progressive mode, rewrite the data file after this many new stations
+FLUSH_SECONDS = 30 #... or after this many seconds, whichever comes first
+PEAK_KEYS = ['accmax','maxacc'] #header peak acceleration values written by K-NET and GeoNet
+
 SOURCES = {'knet':'JP',
            'geonet':'GeoNet'}
 
@@ -38,6 +42,7 @@ def smPSA(data, samp_rate):
     :return: PSA03, PSA10, PSA30
     """
 
+    from obspy.signal.invsim import seisSim, cornFreq2Paz
     D = 0.05	# 5% damping
 
     out = []
@@ -74,6 +79,7 @@ def amps2xml(stationlist,outfolder,netsource):
        - psa10
        - psa30
     '''
+    from neicio.tag import Tag
     stationlist_tag = Tag('stationlist',attributes={'created':datetime.utcnow().strftime('%s')})
     for station in stationlist:
         name = station['name']
@@ -107,205 +113,456 @@ def amps2xml(stationlist,outfolder,netsource):
         stationlist_tag.addChild(stationtag)
 
     outfile = os.path.join(outfolder,'%s_dat.xml' % netsource)
-    stationlist_tag.renderToXML(filename=outfile,ntabs=1)
+    writeXML(stationlist_tag,outfile)
     return (outfile,stationlist_tag)
-            
 
-def trace2xml(traces,parser,outfolder,netsource,doPlot=False,seedresp=None):
+def writeXML(stationlist_tag,outfile):
+    """
+    Write a stationlist tag to a file atomically.
+
+    The XML is rendered to a temporary file in the same folder, which then replaces the output file,
+    so that ShakeMap never sees a partially written data file.
+    @param stationlist_tag: neicio Tag object containing station tags.
+    @param outfile: Path to output XML data file.
+    """
+    tmpfile = outfile + '.tmp'
+    stationlist_tag.renderToXML(filename=tmpfile,ntabs=1)
+    os.replace(tmpfile,outfile)
+
+def getCoordinates(trace,parser=None):
+    """
+    Get the station coordinates for a trace.
+    @param trace: ObsPy Trace object.
+    @param parser: ObsPy Parser (or smtools.inventory.SeedInventory) object, or None if coordinates are
+                   stored in the trace stats.
+    @return: Dictionary with latitude,longitude,elevation keys, or None if coordinates could not be found.
+    """
+    stats = trace.stats
+    if parser is not None:
+        channel_id = '%s.%s.%s.%s' % (stats['network'],stats['station'],stats['location'],stats['channel'])
+        return parser.getCoordinates(channel_id,datetime=stats['starttime'])
+    try:
+        return {'latitude':stats['lat'],
+                'longitude':stats['lon'],
+                'elevation':stats['height']}
+    except:
+        try:
+            return {'latitude':stats['coordinates']['latitude'],
+                    'longitude':stats['coordinates']['longitude'],
+                    'elevation':stats['coordinates']['elevation']}
+        except:
+            pass
+    try:
+        #SAC files read straight from disk keep their coordinates in the sac header
+        return {'latitude':stats['sac']['stla'],
+                'longitude':stats['sac']['stlo'],
+                'elevation':stats['sac']['stel']}
+    except:
+        return None
+
+def rankTraces(traces,parser=None,epicenter=None):
+    """
+    Sort traces so that the most useful stations for a rapid ShakeMap are processed first.
+
+    Stations are ordered by epicentral distance (if an epicenter is supplied), then by the largest
+    peak acceleration found in their headers (K-NET "Max. Acc", GeoNet max acceleration).  Channels
+    from the same station are kept together, in their original order.
+    @param traces: Sequence of ObsPy Trace objects.
+    @param parser: ObsPy Parser object, or None if coordinates are stored in the trace stats.
+    @param epicenter: Tuple of (lat,lon) of the earthquake, or None.
+    @return: List of ObsPy Trace objects.
+    """
+    from obspy.core.util.geodetics import gps2DistAzimuth
+    traces = list(traces)
+    stationkeys = {}
+    for trace in traces:
+        code = '%s.%s' % (trace.stats['network'],trace.stats['station'])
+        distance = float('inf')
+        coordinates = getCoordinates(trace,parser)
+        if epicenter is not None and coordinates is not None:
+            distance,az1,az2 = gps2DistAzimuth(epicenter[0],epicenter[1],
+                                               coordinates['latitude'],coordinates['longitude'])
+        peak = 0.0
+        for key in PEAK_KEYS:
+            if key in trace.stats:
+                peak = abs(trace.stats[key])
+        if code in stationkeys:
+            sdist,speak = stationkeys[code]
+            stationkeys[code] = (min(sdist,distance),max(speak,peak))
+        else:
+            stationkeys[code] = (distance,peak)
+    def sortkey(trace):
+        code = '%s.%s' % (trace.stats['network'],trace.stats['station'])
+        distance,peak = stationkeys[code]
+        return (distance,-peak,code)
+    return sorted(traces,key=sortkey)
+
+def makeStationList(stationtags):
+    """
+    Assemble station tags into a top level stationlist tag.
+    @param stationtags: Sequence of station Tag objects.
+    @return: stationlist Tag object.
+    """
+    from neicio.tag import Tag
+    stationlist_tag = Tag('stationlist',attributes={'created':datetime.utcnow().strftime('%s')})
+    for stationtag in stationtags:
+        stationlist_tag.addChild(stationtag)
+    return stationlist_tag
+
+
+def getStationInfo(vdict,net,station,channel_id,netsource):
+    """
+    Get the descriptive station attributes needed in a ShakeMap station tag.
+    @param vdict: Inventory dictionary (as returned by Parser.getInventory()), or None.
+    @param net: Network code.
+    @param station: Station code.
+    @param channel_id: Channel id (NET.STA.LOC.CHA).
+    @param netsource: Name of data source (knet, geonet, etc.)
+    @return: Tuple of (station_name,instrument,source).
+    """
+    station_name = 'UNK'
+    if vdict is not None:
+        for sta in vdict['stations']:
+            if sta['station_id'] == '%s.%s' % (net,station):
+                station_name = sta['station_name']
+                break
+        instrument = 'UNK'
+        for cha in vdict['channels']:
+            if cha['channel_id'] == channel_id:
+                instrument = cha['instrument']
+                break
+        source = ''
+        for netw in vdict['networks']:
+            if netw['network_code'] == net:
+                source = netw['network_name']
+                break
+    else:
+        station_name = station
+        instrument = ''
+        source = ''
+    if source == '':
+        if netsource in SOURCES:
+            source = SOURCES[netsource]
+    return (station_name,instrument,source)
+
+def getPeaks(trace,paz=None,seedresp=None,pgaOnly=False,doPlot=False,outfolder=None):
+    """
+    Calibrate a trace and derive its peak ground motion values.
+
+    The trace data is modified in place (no copies are made), so the trace should be discarded afterwards.
+    @param trace: ObsPy Trace object.
+    @keyword paz: Poles and zeros dictionary used to calibrate the trace, or None if the trace is calibrated.
+    @keyword seedresp: RESP file dictionary (see Trace.simulate()) used to calibrate non-acceleration traces.
+    @keyword pgaOnly: Compute only PGA, skipping PSA and PGV.
+    @keyword doPlot: Make a QA plot of acceleration and velocity in outfolder.
+    @keyword outfolder: Folder where QA plots should be written.
+    @return: Dictionary with any of the keys pga,psa03,psa10,psa30 (%g), pgv (cm/s), and plotfile.
+             Empty if no peak values could be derived.
+    """
+    peaks = {}
+    channel_id = trace.id
+    #If we have separate calibration data, apply it here
+    if paz is not None:
+        trace.simulate(paz_remove=paz,remove_sensitivity=True,simulate_sensitivity=False)
+        trace.stats['units'] = 'acc' #ASSUMING THAT ANY SAC DATA IS ACCELERATION!
+    else:
+        if trace.stats['units'] != 'acc':
+            if seedresp is None:
+                raise Exception('Must have a PolesAndZeros data structure (i.e., from dataless SEED) or a RESP file.')
+            else:
+                pre_filt = (0.01, 0.02, 20, 30)
+                try:
+                    trace.simulate(paz_remove=None, pre_filt=pre_filt, seedresp=seedresp)
+                except Exception as error:
+                    pass
+
+    if pgaOnly and trace.stats['units'] != 'acc':
+        return peaks #no PGA to be had from a velocity record
+
+    if doPlot:
+        import matplotlib.pyplot as plt
+        from matplotlib import dates
+        hfmt = dates.DateFormatter('%H:%M:%S') #used for formatting dates in plots
+    if trace.stats['units'] == 'acc':
+        delta = trace.stats['sampling_rate']
+        trace.detrend('linear')
+        trace.detrend('demean')
+        trace.taper(max_percentage=0.05, type='cosine')
+        
+        
+        trace.filter('highpass',freq=FILTER_FREQ,zerophase=True,corners=CORNERS)
+        
+        trace.detrend('linear')
+        trace.detrend('demean')
+
+        # Get the Peak Ground Acceleration, converted to %g
+        peaks['pga'] = abs(trace.max())/0.0981
+        if pgaOnly:
+            return peaks
+
+        (psa03, psa10, psa30) = smPSA(trace, delta)
+
+        #convert accelerations to %g
+        peaks['psa03'] = psa03/0.0981
+        peaks['psa10'] = psa10/0.0981
+        peaks['psa30'] = psa30/0.0981
+
+        #plot the acceleration (top) and velocity
+        if doPlot:
+            plt.clf()
+            ax1 = plt.subplot(2,1,1)
+            atimes = trace.times()
+            atimes = [(trace.stats['starttime'] + t).datetime for t in atimes]
+            matimes = dates.date2num(atimes)
+            plt.plot(matimes,trace.data)
+            ax1.xaxis.set_major_locator(dates.MinuteLocator())
+            ax1.xaxis.set_major_formatter(hfmt)
+            plt.title('Acceleration %s' % channel_id)
+            plt.ylabel('$m/s^2$')
+            plt.xticks([])
+            #labels = ax1.get_xticklabels()
+            #ax1.set_xticklabels( labels, rotation=45 ) ;
+
+    #we're done with the acceleration, so integrate in place rather than copying
+    if trace.stats['units'] != 'vel': #don't integrate the broadband
+        trace.integrate() # trace now has velocity
+
+    if doPlot:
+        vtimes = trace.times()
+        vtimes = [(trace.stats['starttime'] + t).datetime for t in vtimes]
+        mvtimes = dates.date2num(vtimes)
+        if 'pga' in peaks:
+            ax2 = plt.subplot(2,1,2)
+        else:
+            ax2 = plt.subplot(1,1,1)
+        plt.plot(mvtimes,trace.data)
+        ax2.xaxis.set_major_locator(dates.MinuteLocator())
+        ax2.xaxis.set_major_formatter(hfmt)
+        plt.title('Velocity %s' % channel_id)
+        plt.ylabel('$m/s$')
+        plt.xticks(rotation=30)
+        pngfile = os.path.join(outfolder,'%s.png' % channel_id)
+        plt.savefig(pngfile)
+        peaks['plotfile'] = pngfile
+        plt.close()
+
+    # Get the Peak Ground Velocity, converted to cm/s
+    peaks['pgv'] = abs(trace.max()) * 100
+    return peaks
+
+def getChannelInfo(trace,parser,vdict,netsource):
+    """
+    Get the station metadata for a trace, as the start of an amplitude record.
+    @param trace: ObsPy Trace object.
+    @param parser: ObsPy Parser object, or None if the trace is calibrated and contains coordinates.
+    @param vdict: Inventory dictionary (as returned by Parser.getInventory()), or None.
+    @param netsource: Name of data source (knet, geonet, etc.)
+    @return: Tuple of (record,paz), where record is a dictionary with keys channel_id,code,netid,channel,
+             name,insttype,source,lat,lon and paz is the poles and zeros dictionary used to calibrate
+             the trace (None if parser is None), or (None,None) if the trace has no coordinates.
+    """
+    net = trace.stats['network']
+    station = trace.stats['station']
+    location = trace.stats['location']
+    channel = trace.stats['channel']
+    channel_id = '%s.%s.%s.%s' % (net,station,location,channel)
+    coordinates = getCoordinates(trace,parser)
+    if coordinates is None:
+        sys.stderr.write('Could not get station coordinates from trace object of station %s\n' % station)
+        return (None,None)
+    paz = None
+    if parser is not None:
+        paz = parser.getPAZ(channel_id,datetime=trace.stats['starttime'])
+    station_name,instrument,source = getStationInfo(vdict,net,station,channel_id,netsource)
+    record = {'channel_id':channel_id,
+              'code':'%s.%s' % (net,station),
+              'netid':net,
+              'channel':channel,
+              'name':station_name,
+              'insttype':instrument,
+              'source':source,
+              'lat':coordinates['latitude'],
+              'lon':coordinates['longitude']}
+    return (record,paz)
+
+def getRecord(trace,parser,vdict,netsource,seedresp=None,pgaOnly=False,doPlot=False,outfolder=None):
+    """
+    Reduce a trace to a small amplitude record, from which the ShakeMap data file can be assembled.
+    @param trace: ObsPy Trace object.
+    @param parser: ObsPy Parser object, or None if the trace is calibrated and contains coordinates.
+    @param vdict: Inventory dictionary (as returned by Parser.getInventory()), or None.
+    @param netsource: Name of data source (knet, geonet, etc.)
+    @keyword seedresp,pgaOnly,doPlot,outfolder: See getPeaks().
+    @return: Amplitude record dictionary (see getChannelInfo()), including the peak values returned by
+             getPeaks(), or None if the trace has no coordinates.
+    """
+    record,paz = getChannelInfo(trace,parser,vdict,netsource)
+    if record is None:
+        return None
+    record.update(getPeaks(trace,paz=paz,seedresp=seedresp,pgaOnly=pgaOnly,doPlot=doPlot,outfolder=outfolder))
+    return record
+
+def getSharedPeaks(descriptor,paz,seedresp,pgaOnly,doPlot,outfolder):
+    """
+    Worker process function: run getPeaks() on a trace published to shared memory.
+    @param descriptor: Descriptor returned by shmtransport.SharedTraceTransport.publish().
+    @return: Dictionary of peak values returned by getPeaks().
+    """
+    from . import shmtransport
+    trace,shm = shmtransport.attach(descriptor)
+    try:
+        peaks = getPeaks(trace,paz=paz,seedresp=seedresp,pgaOnly=pgaOnly,doPlot=doPlot,outfolder=outfolder)
+    finally:
+        del trace
+        shmtransport.detach(shm)
+    return peaks
+
+def iterRecords(traces,parser,vdict,netsource,seedresp=None,doPlot=False,outfolder=None,
+                deadline=None,deadlinePGA=False,jobs=1):
+    """
+    Reduce traces to amplitude records, in the order the traces are given.
+
+    With jobs > 1, the peak values are computed by a pool of worker processes.  Each trace's samples
+    are handed to the workers through shared memory (see shmtransport), and the segment is freed as
+    soon as that channel's peak values come back.
+    @param traces: Sequence (or iterator) of ObsPy Trace objects.
+    @keyword jobs: Number of worker processes.
+    @keyword deadline,deadlinePGA: See trace2xml().
+    @return: Generator of amplitude record dictionaries (see getRecord()).
+    """
+    pgaOnly = False
+    if jobs > 1:
+        from . import shmtransport
+        transport = shmtransport.SharedTraceTransport()
+        pool = multiprocessing.Pool(jobs)
+        pending = collections.deque()
+    try:
+        for trace in traces:
+            if deadline is not None and not pgaOnly and time.time() > deadline:
+                if not deadlinePGA:
+                    sys.stderr.write('Deadline reached, skipping remaining channels.\n')
+                    break
+                sys.stderr.write('Deadline reached, computing PGA only for remaining channels.\n')
+                pgaOnly = True
+            if jobs <= 1:
+                record = getRecord(trace,parser,vdict,netsource,seedresp=seedresp,pgaOnly=pgaOnly,
+                                   doPlot=doPlot,outfolder=outfolder)
+                del trace #release the waveform before reading the next one
+                if record is not None:
+                    yield record
+                continue
+            record,paz = getChannelInfo(trace,parser,vdict,netsource)
+            if record is None:
+                continue
+            descriptor = transport.publish(trace)
+            del trace
+            result = pool.apply_async(getSharedPeaks,(descriptor,paz,seedresp,pgaOnly,doPlot,outfolder))
+            pending.append((record,descriptor,result))
+            #keep a bounded number of channels in flight, so memory stays flat
+            while len(pending) >= 2*jobs:
+                record,descriptor,result = pending.popleft()
+                record.update(result.get())
+                transport.release(descriptor)
+                yield record
+        if jobs > 1:
+            while len(pending):
+                record,descriptor,result = pending.popleft()
+                record.update(result.get())
+                transport.release(descriptor)
+                yield record
+    finally:
+        if jobs > 1:
+            pool.terminate()
+            transport.close()
+
+def records2tag(records):
+    """
+    Assemble amplitude records (see getRecord()) into a stationlist tag.
+
+    Records from the same station are grouped into one station tag, in the order the stations first appear.
+    @param records: Sequence of amplitude record dictionaries.
+    @return: stationlist Tag object.
+    """
+    from neicio.tag import Tag
+    stationtags = OrderedDict()
+    for record in records:
+        #make the component tag to hold the measurements
+        comptag = Tag('comp',attributes={'name':record['channel']})
+        for key,tkey in [('pga','acc'),('psa03','psa03'),('psa10','psa10'),('psa30','psa30'),('pgv','vel')]:
+            if key in record:
+                comptag.addChild(Tag(tkey,attributes={'value':record[key]}))
+        code = record['code']
+        if code not in stationtags:
+            stationtags[code] = Tag('station',attributes={'code':code,'name':record['name'],
+                                                          'insttype':record['insttype'],'source':record['source'],
+                                                          'netid':record['netid'],'commtype':'DIG',
+                                                          'lat':record['lat'],'lon':record['lon'],
+                                                          'loc':record['name']})
+        stationtags[code].addChild(comptag)
+    return makeStationList(list(stationtags.values()))
+
+def trace2xml(traces,parser,outfolder,netsource,doPlot=False,seedresp=None,
+              progressive=False,epicenter=None,flushStations=FLUSH_STATIONS,flushSeconds=FLUSH_SECONDS,
+              deadline=None,deadlinePGA=False,jobs=1,records=None):
     """
     Calibrate accelerometer data, derive peak ground motion values, and write a ShakeMap-compatible data file.
 
     Takes a sequence of ObsPy Trace objects and an ObsPy Parser (such as from a dataless SEED file) and
     calibrates the data in the Traces, derives peak ground motions for each (pga,pgv,psa) and then 
     writes those data to a ShakeMap-compatible XML data file.
+
+    Each trace is reduced to a small amplitude record as soon as it is processed, and is not referenced
+    afterwards, so passing a generator of traces keeps memory use flat in the number of channels.
+    (Progressive mode has to see every trace to rank them, and so holds them all in memory.)
     
-    @param traces - Sequence of ObsPy Trace objects, containing acceleration data in units of m/s^2.
-    @param parser - ObsPy Parser object.  Can also be None, in which case calibration step is NOT performed, and station coordinates will have to be present in the input traces.
+    @param traces - Sequence (or iterator) of ObsPy Trace objects, containing acceleration data in units of m/s^2.
+    @param parser - ObsPy Parser object (or smtools.inventory.SeedInventory, which reads all of the seed files in a folder).  Can also be None, in which case calibration step is NOT performed, and station coordinates will have to be present in the input traces.
     @param outfolder - Path (string) where output data XML files and QA plots should be written.
     @param netsource - Name of data source (knet, geonet, etc.)
+    @keyword progressive - Process the nearest stations first (see rankTraces), and rewrite the data file
+                           every flushStations stations or flushSeconds seconds, so ShakeMap can start from partial data.
+    @keyword epicenter - Tuple of (lat,lon) used to rank stations by distance in progressive mode.
+    @keyword flushStations - Number of new stations after which the data file is rewritten in progressive mode.
+    @keyword flushSeconds - Number of seconds after which the data file is rewritten in progressive mode.
+    @keyword deadline - Time (seconds since the epoch, as from time.time()) after which remaining channels are 
+                        skipped, or reduced to PGA only if deadlinePGA is True.
+    @keyword deadlinePGA - Compute PGA only (rather than skipping) for channels processed after the deadline.
+    @keyword jobs - Number of worker processes used to compute peak values (see iterRecords).
+    @keyword records - List of amplitude records (see getRecord()) to include in the data file, i.e. from an
+                       earlier run.  The records of the new traces are appended to this list.
     """
     if parser is not None:
         vdict = parser.getInventory()
     else:
         vdict = None
-    #Make the top level tag - stationlist
-    stationlist_tag = Tag('stationlist',attributes={'created':datetime.utcnow().strftime('%s')})
-    first_station = 1
-    current_tag = ''
-    plotfiles = []
-    hfmt = dates.DateFormatter('%H:%M:%S') #used for formatting dates in plots
-    for trace in traces:
-        net = trace.stats['network']
-        station = trace.stats['station']
-        location = trace.stats['location']
-        channel = trace.stats['channel']
-        channel_id = '%s.%s.%s.%s' % (net,station,location,channel)
-        if parser is not None:
-            paz = parser.getPAZ(channel_id)
-            coordinates = parser.getCoordinates(channel_id)
-        else:
-            try:
-                coordinates = {'latitude':trace.stats['lat'],
-                               'longitude':trace.stats['lon'],
-                               'elevation':trace.stats['height']}
-            except:
-                try:
-                    coordinates = {'latitude':trace.stats['coordinates']['latitude'],
-                                   'longitude':trace.stats['coordinates']['longitude'],
-                                   'elevation':trace.stats['coordinates']['elevation']}
-                except:
-                    sys.stderr.write('Could not get station coordinates from trace object of station %s\n' % station)
-                    continue
-
-        #If we have separate calibration data, apply it here
-        if parser is not None:
-            trace.simulate(paz_remove=paz,remove_sensitivity=True,simulate_sensitivity=False)
-            trace.stats['units'] = 'acc' #ASSUMING THAT ANY SAC DATA IS ACCELERATION!
-        else:
-            if trace.stats['units'] != 'acc':
-                if seedresp is None:
-                    raise Exception('Must have a PolesAndZeros data structure (i.e., from dataless SEED) or a RESP file.')
-                else:
-                    pre_filt = (0.01, 0.02, 20, 30)
-                    try:
-                        trace.simulate(paz_remove=None, pre_filt=pre_filt, seedresp=seedresp)
-                    except Exception as error:
-                        pass
-
-        #make the component tag to hold the measurements
-        comptag = Tag('comp',attributes={'name':channel})
-        if trace.stats['units'] == 'acc':
-            delta = trace.stats['sampling_rate']
-            trace.detrend('linear')
-            trace.detrend('demean')
-            trace.taper(max_percentage=0.05, type='cosine')
-            
-            
-            trace.filter('highpass',freq=FILTER_FREQ,zerophase=True,corners=CORNERS)
-            
-            trace.detrend('linear')
-            trace.detrend('demean')
-
-            # Get the Peak Ground Acceleration
-            pga = abs(trace.max())
-
-            (psa03, psa10, psa30) = smPSA(trace, delta)
-
-            #convert accelerations to %g
-            psa03 = psa03/0.0981
-            psa10 = psa10/0.0981
-            psa30 = psa30/0.0981
-            pga = pga/0.0981
-
-            #make the tags for the individual measurements, add them to comp tag
-            psa03tag = Tag('psa03',attributes={'value':psa03})
-            psa10tag = Tag('psa10',attributes={'value':psa10})
-            psa30tag = Tag('psa30',attributes={'value':psa30})
-            acctag = Tag('acc',attributes={'value':pga})
-
-            comptag.addChild(acctag)
-            comptag.addChild(psa03tag)
-            comptag.addChild(psa10tag)
-            comptag.addChild(psa30tag)
-            
-            #plot the acceleration (top) and velocity
-            if doPlot:
-                plt.clf()
-                ax1 = plt.subplot(2,1,1)
-                atimes = trace.times()
-                atimes = [(trace.stats['starttime'] + t).datetime for t in atimes]
-                matimes = dates.date2num(atimes)
-                plt.plot(matimes,trace.data)
-                ax1.xaxis.set_major_locator(dates.MinuteLocator())
-                ax1.xaxis.set_major_formatter(hfmt)
-                plt.title('Acceleration %s' % channel_id)
-                plt.ylabel('$m/s^2$')
-                plt.xticks([])
-                #labels = ax1.get_xticklabels()
-                #ax1.set_xticklabels( labels, rotation=45 ) ;
-
-        if trace.stats['units'] == 'vel': #don't integrate the broadband
-            vtimes = trace.times()
-            vtimes = [(trace.stats['starttime'] + t).datetime for t in vtimes]
-            mvtimes = dates.date2num(vtimes)
-            vtrace = trace.copy()
-        else:
-            vtrace = trace.copy()
-            vtrace.integrate() # vtrace now has velocity
-            vtimes = vtrace.times()
-            vtimes = [(vtrace.stats['starttime'] + t).datetime for t in vtimes]
-            mvtimes = dates.date2num(vtimes)
-        if doPlot:
-            if trace.stats['units'] == 'acc':
-                ax2 = plt.subplot(2,1,2)
-            else:
-                ax2 = plt.subplot(1,1,1)
-            plt.plot(mvtimes,vtrace.data)
-            ax2.xaxis.set_major_locator(dates.MinuteLocator())
-            ax2.xaxis.set_major_formatter(hfmt)
-            plt.title('Velocity %s' % channel_id)
-            plt.ylabel('$m/s$')
-            plt.xticks(rotation=30)
-            pngfile = os.path.join(outfolder,'%s.png' % channel_id)
-            plt.savefig(pngfile)
-            plotfiles.append(pngfile)
-            plt.close()
-
-        # Get the Peak Ground Velocity
-        pgv = abs(vtrace.max())
-
-        #convert velocity to cm/s
-        pgv = pgv * 100
-
-        #make the tags for the individual measurements
-        veltag = Tag('vel',attributes={'value':pgv})
-        comptag.addChild(veltag)
-
-        code = '%s.%s' % (net,station)
-        if current_tag == code:		# Same station: just add the comp tag
-            stationtag.addChild(comptag)
-        else:				# New station: start a new station tag
-            if not first_station:	# Close out the previous station
-                stationlist_tag.addChild(stationtag)
-            station_name = 'UNK'
-            if vdict is not None:
-                for sta in vdict['stations']:
-                    if sta['station_id'] == '%s.%s' % (net,station):
-                        station_name = sta['station_name']
-                        break
-                instrument = 'UNK'
-                for cha in vdict['channels']:
-                    if cha['channel_id'] == channel_id:
-                        instrument = cha['instrument']
-                        break
-                source = ''
-                for netw in vdict['networks']:
-                    if netw['network_code'] == net:
-                        source = netw['network_name']
-                        break
-            else:
-                station_name = trace.stats['station']
-                instrument = ''
-                source = ''
-            if source == '':
-                if netsource in SOURCES:
-                    source = SOURCES[netsource]
-            lat = coordinates['latitude']
-            lon = coordinates['longitude']
-            stationtag = Tag('station',attributes={'code':code,'name':station_name,
-                                                   'insttype':instrument,'source':source,
-                                                   'netid':net,'commtype':'DIG',
-                                                   'lat':lat,'lon':lon,
-                                                   'loc':station_name})
-            stationtag.addChild(comptag)
-            current_tag = code
-            first_station = 0
-
-    if not first_station:	# Add the final station to the list
-        stationlist_tag.addChild(stationtag)
     outfile = os.path.join(outfolder,'%s_dat.xml' % netsource)
+    if progressive:
+        traces = rankTraces(traces,parser=parser,epicenter=epicenter)
+    if records is None:
+        records = []
+    stationcodes = set([record['code'] for record in records])
+    nflushed = len(stationcodes)
+    lastflush = time.time()
+    plotfiles = []
+    for record in iterRecords(traces,parser,vdict,netsource,seedresp=seedresp,doPlot=doPlot,outfolder=outfolder,
+                              deadline=deadline,deadlinePGA=deadlinePGA,jobs=jobs):
+        if not ('pga' in record or 'pgv' in record):
+            continue
+        if 'plotfile' in record:
+            plotfiles.append(record.pop('plotfile'))
+        records.append(record)
+        stationcodes.add(record['code'])
+
+        if progressive:
+            elapsed = time.time() - lastflush
+            if len(stationcodes) - nflushed >= flushStations or elapsed >= flushSeconds:
+                writeXML(records2tag(records),outfile)
+                nflushed = len(stationcodes)
+                lastflush = time.time()
+
+    stationlist_tag = records2tag(records)
     print('Saving to %s' % outfile)
-    stationlist_tag.renderToXML(filename=outfile,ntabs=1)
+    writeXML(stationlist_tag,outfile)
     return (outfile,plotfiles,stationlist_tag)
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import json
+import struct
+
+#third party
+from obspy.core.trace import Trace
+from obspy import read
+import numpy as np
+
+from .cache import encodeValue,decodeValue,SKIPKEYS
+from . import util
+
+MAGIC = b'SMTRACE1' #first bytes of every smtools binary trace file
+EXT = '.smt' #extension of smtools binary trace files
+DTYPE = '<f8' #samples are always stored as little-endian float64
+ALIGN = 8 #the sample block starts on a multiple of this many bytes
+
+def writesmt(traces,filename):
+    """
+    Write traces to an smtools binary trace file.
+
+    The file holds MAGIC, the length of a JSON header (little-endian uint32), the JSON header itself
+    (the stats, offset and npts of each trace), padding, and then the samples of all of the traces as
+    one block of little-endian float64 values.
+    @param traces: List of ObsPy Trace objects (or an ObsPy Stream).
+    @param filename: Output file name.
+    """
+    channels = []
+    offset = 0
+    for trace in traces:
+        stats = dict([(key,value) for key,value in trace.stats.items() if key not in SKIPKEYS])
+        channels.append({'offset':offset,
+                         'npts':len(trace.data),
+                         'stats':encodeValue(stats)})
+        offset += len(trace.data)
+    header = json.dumps({'dtype':DTYPE,'channels':channels}).encode('utf-8')
+    start = len(MAGIC) + 4 + len(header)
+    padding = (ALIGN - start % ALIGN) % ALIGN
+    f = open(filename,'wb')
+    f.write(MAGIC)
+    f.write(struct.pack('<I',len(header)+padding))
+    f.write(header)
+    f.write(b' '*padding)
+    for trace in traces:
+        f.write(np.ascontiguousarray(trace.data,dtype=DTYPE).tobytes())
+    f.close()
+
+def readsmt(filename,headonly=False):
+    """
+    Read traces from an smtools binary trace file, without copying the samples.
+
+    The samples are memory-mapped copy-on-write, so they can be modified in place without changing the file.
+    @param filename: Path to a file written by writesmt().
+    @keyword headonly: If True, do not map the samples (see util.headerTrace()).
+    @return: List of ObsPy Trace objects.
+    """
+    f = open(filename,'rb')
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        f.close()
+        raise ValueError('%s is not an smtools binary trace file.' % filename)
+    hlength = struct.unpack('<I',f.read(4))[0]
+    jdict = json.loads(f.read(hlength).decode('utf-8'))
+    f.close()
+    dataoffset = len(MAGIC) + 4 + hlength
+    npts = sum([channel['npts'] for channel in jdict['channels']])
+    data = None
+    if not headonly and npts:
+        data = np.memmap(filename,dtype=jdict['dtype'],mode='c',offset=dataoffset,shape=(npts,))
+    traces = []
+    for channel in jdict['channels']:
+        header = decodeValue(channel['stats'])
+        if headonly or data is None:
+            header['npts'] = channel['npts']
+            traces.append(util.headerTrace(header))
+            continue
+        offset = channel['offset']
+        traces.append(Trace(data[offset:offset+channel['npts']],header=header))
+    return traces
+
+def convertpickle(picklefile,outfile=None):
+    """
+    Convert an ObsPy PICKLE file (as written by older versions of filtertrace.py) to an smtools binary trace file.
+
+    Note that reading a pickle file can run arbitrary code - only convert files from a trusted source.
+    @param picklefile: Path to pickle file.
+    @keyword outfile: Output file name, or None to replace the .pickle extension with EXT.
+    @return: Output file name.
+    """
+    if outfile is None:
+        fbase = picklefile
+        if fbase.endswith('.pickle'):
+            fbase = fbase[0:-len('.pickle')]
+        outfile = fbase + EXT
+    stream = read(picklefile,format='PICKLE')
+    writesmt(stream,outfile)
+    return outfile
@@ -11,9 +11,8 @@ import re
 from datetime import datetime,timedelta
 from xml.dom import minidom
 import urllib.request, urllib.parse, urllib.error
-import urllib.request, urllib.error, urllib.parse
-import urllib.parse
 import base64
+from concurrent.futures import ThreadPoolExecutor,as_completed
 
 #third party
 import numpy as np
@@ -21,12 +20,11 @@ from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
 from obspy.core.trace import Trace
 from obspy.core.trace import Stats
-import matplotlib.pyplot as plt
 
 #local
 from .fetcher import StrongMotionFetcher,StrongMotionFetcherException
-from .trace2xml import trace2xml
 from . import util
+from . import webclient
 
 #default Turkey spatial search parameters
 LATMIN = 35.81
@@ -40,9 +38,19 @@ TIMEFMT = '%Y-%m-%d %H:%M:%S'
 #MODULE_NAME=earthquake&MODULE_TASK=search
 URLBASE = 'http://kyhdata.deprem.gov.tr/2K/kyhdata_v4.php?dst=TU9EVUxFX05BTUU9ZWFydGhxdWFrZSZNT0RVTEVfVEFTSz1zZWFyY2g%3D'
 
+WORKERS = 4 #number of stations whose pages and data files are downloaded at the same time
+REQUEST_INTERVAL = 0.25 #minimum number of seconds between requests to the Turkey server
+
+def readpage(url):
+    #the Turkey pages are handled as text, and any non-ASCII characters are removed later
+    fh = webclient.urlopen(url)
+    htmldata = fh.read().decode('utf-8','replace')
+    fh.close()
+    return htmldata
+
 class TurkeyFetcher(StrongMotionFetcher):
     def __init__(self):
-        pass
+        self.throttle = webclient.HostThrottle(REQUEST_INTERVAL)
 
     def fetch(self,lat,lon,etime,radius,timewindow,outfolder):
         utctime = etime
@@ -62,22 +70,48 @@ class TurkeyFetcher(StrongMotionFetcher):
 
         urlparts = urllib.parse.urlparse(URLBASE)
         url = urllib.parse.urljoin(urlparts.geturl(),matchingEvent['href'])
-        urllist = self.getDataLinks(url)
+        stationlinks = self.getStationLinks(url)
+
+        #each worker resolves a station's detail page and then downloads its data file, so the
+        #two round trips of one station overlap with those of the others
         datafiles = []
-        for urltpl in urllist:
-            url = urltpl[0]
-            station = urltpl[1]
-            fh = urllib.request.urlopen(url)
-            data = fh.read()
-            fh.close()
-            fname = '%s_%s.txt' % (utctime.strftime('%Y%m%d%H%M%S'),station)
-            localfile = os.path.join(outfolder,fname)
-            sys.stderr.write('Downloading data file %s\n' % fname)
-            f = open(localfile,'wt')
-            f.write(data)
-            f.close()
-            datafiles.append(localfile)
-        return datafiles
+        failed = []
+        pool = ThreadPoolExecutor(max_workers=WORKERS)
+        try:
+            futures = {}
+            for detailurl,station in stationlinks:
+                fname = '%s_%s.txt' % (utctime.strftime('%Y%m%d%H%M%S'),station)
+                localfile = os.path.join(outfolder,fname)
+                futures[pool.submit(self.fetchStation,detailurl,localfile)] = station
+            for future in as_completed(futures):
+                try:
+                    datafiles.append(future.result())
+                except (OSError,ValueError) as error:
+                    failed.append((futures[future],error))
+        finally:
+            pool.shutdown()
+        for station,error in failed:
+            sys.stderr.write('Could not download data for station %s: %s\n' % (station,error))
+        sys.stderr.write('Downloaded %i of %i data files from Turkey.\n' % (len(datafiles),len(stationlinks)))
+        return sorted(datafiles)
+
+    def fetchStation(self,detailurl,localfile):
+        """
+        Download the data file of one station (in a worker thread).
+        @param detailurl: URL of the station detail page, which links to the data file.
+        @param localfile: Path of local output file.
+        @return: localfile.
+        """
+        url = self.getDataLink(detailurl)
+        self.throttle.wait(url)
+        fh = webclient.urlopen(url)
+        data = fh.read()
+        fh.close()
+        f = open(localfile+'.part','wb')
+        f.write(data)
+        f.close()
+        os.replace(localfile+'.part',localfile)
+        return localfile
 
     def getSearchPage(self,utctime,lat,lon,distwindow):
         values = {'from_day':0o1,'from_month':0o1,'from_year':2011,
@@ -109,8 +143,9 @@ class TurkeyFetcher(StrongMotionFetcher):
         values['to_epi_lon'] = xmax
         data = urllib.parse.urlencode(values).encode('ascii')
         req = urllib.request.Request(URLBASE,data)
-        response = urllib.request.urlopen(req)
-        htmldata = response.read()
+        self.throttle.wait(URLBASE)
+        response = webclient.urlopen(req,ttl=webclient.QUERY_TTL)
+        htmldata = response.read().decode('utf-8','replace')
         return htmldata
 
     def getSearchXML(self,htmldata):
@@ -191,10 +226,14 @@ class TurkeyFetcher(StrongMotionFetcher):
                 break
         return matchingEvent
 
-    def getDataLinks(self,url):
-        fh = urllib.request.urlopen(url)
-        htmldata = fh.read()
-        fh.close()
+    def getStationLinks(self,url):
+        """
+        Get the station detail page links from an event page.
+        @param url: URL of event page.
+        @return: List of (detail page URL,station code) tuples.
+        """
+        self.throttle.wait(url)
+        htmldata = readpage(url)
         xmldata2 = self.getSearchXML(htmldata)
         root = minidom.parseString(xmldata2)
         table = root.getElementsByTagName('table')[0]
@@ -213,21 +252,6 @@ class TurkeyFetcher(StrongMotionFetcher):
                     href = anchor.getAttribute('href')
                     urlparts = urllib.parse.urlparse(URLBASE)
                     url = urllib.parse.urljoin(urlparts.geturl(),href)
-                    fh = urllib.request.urlopen(url)
-                    htmldata2 = fh.read()
-                    fh.close()
-                    startidx = 0
-                    while True:
-                        reftag = 'href="'
-                        fidx = htmldata2.find(reftag,startidx)
-                        cidx = htmldata2.find('"',fidx+len(reftag)+1)
-                        href = htmldata2[fidx+len(reftag):cidx]
-                        if href.find('css') > -1:
-                            startidx = cidx
-                            continue
-                        else:
-                            break
-                    url = urllib.parse.urljoin(urlparts.geturl(),href)
                     urllist.append(url)
                 if colidx == 6:
                     anchor = td.getElementsByTagName('a')[0]
@@ -238,24 +262,47 @@ class TurkeyFetcher(StrongMotionFetcher):
         urltuples = list(zip(urllist,stationlist))
         return urltuples
 
+    def getDataLink(self,detailurl):
+        """
+        Scrape the data file link from a station detail page.
+        @param detailurl: URL of station detail page.
+        @return: URL of data file.
+        """
+        self.throttle.wait(detailurl)
+        htmldata2 = readpage(detailurl)
+        startidx = 0
+        while True:
+            reftag = 'href="'
+            fidx = htmldata2.find(reftag,startidx)
+            if fidx < 0:
+                raise ValueError('No data file link found in %s' % detailurl)
+            cidx = htmldata2.find('"',fidx+len(reftag)+1)
+            href = htmldata2[fidx+len(reftag):cidx]
+            if href.find('css') > -1:
+                startidx = cidx
+                continue
+            else:
+                break
+        urlparts = urllib.parse.urlparse(URLBASE)
+        return urllib.parse.urljoin(urlparts.geturl(),href)
+
     def strip_non_ascii(self,string):
         ''' Returns the string without non ASCII characters'''
         stripped = (c for c in string if 0 < ord(c) < 127)
         return ''.join(stripped)
     
-def readturkey(turkeyfile):
+def readturkey(turkeyfile,headonly=False):
     """
     Read strong motion data from a Turkey data file
     @param geonetfile: Path to a valid Turkey data file.
+    @keyword headonly: If True, skip the data blocks, and return traces with no samples (npts is set from the header).
     @return: List of ObsPy Trace objects, containing accelerometer data in m/s.
     """
-    f = open(turkeyfile,'rt')
-    dataOn = False
+    f = open(turkeyfile,'rb')
     header = {}
-    nschannel = []
-    ewchannel = []
-    udchannel = []
-    for line in f.readlines():
+    data = np.zeros((0,3))
+    for line in f:
+        line = line.decode('utf-8','replace')
         if line.strip().startswith('STATION ID'):
             parts = line.strip().split(':')
             header['station'] = parts[1].strip()
@@ -292,17 +339,13 @@ def readturkey(turkeyfile):
             header['sampling_rate'] = 1.0/header['delta']
             continue
         if line.strip().startswith('N-S'):
-            dataOn = True
-            continue
-        if dataOn:
-            parts = line.strip().split()
-            nschannel.append(float(parts[0]))
-            ewchannel.append(float(parts[1]))
-            udchannel.append(float(parts[2]))
+            if headonly:
+                break
+            #the next npts lines hold the N-S,E-W,U-D columns - ignore anything after them
+            lines = f.read().split(b'\n',header['npts'])[0:header['npts']]
+            data = util.decodeBlock(b'\n'.join(lines),ncols=3,npts=header['npts'])
+            break
     f.close()
-    nschannel = np.array(nschannel)
-    ewchannel = np.array(ewchannel)
-    udchannel = np.array(udchannel)
     header['network'] = 'TR'
     header['units'] = 'acc'
     nsheader = header.copy()
@@ -311,15 +354,21 @@ def readturkey(turkeyfile):
     ewheader['channel'] = 'EW'
     udheader = header.copy()
     udheader['channel'] = 'UD'
+    if headonly:
+        tracelist = [util.headerTrace(hdr.copy()) for hdr in [nsheader,ewheader,udheader]]
+        return (tracelist,[nsheader,ewheader,udheader])
+    nschannel = np.ascontiguousarray(data[:,0])
+    ewchannel = np.ascontiguousarray(data[:,1])
+    udchannel = np.ascontiguousarray(data[:,2])
     nsstats = Stats(nsheader)
     nstrace = Trace(nschannel,header=nsstats)
     ewstats = Stats(ewheader)
     ewtrace = Trace(ewchannel,header=ewstats)
     udstats = Stats(udheader)
     udtrace = Trace(udchannel,header=udstats)
-    nstrace.data = nstrace.data * 0.01 #convert to m/s^2
-    ewtrace.data = ewtrace.data * 0.01 #convert to m/s^2
-    udtrace.data = udtrace.data * 0.01 #convert to m/s^2
+    nstrace.data *= 0.01 #convert to m/s^2
+    ewtrace.data *= 0.01 #convert to m/s^2
+    udtrace.data *= 0.01 #convert to m/s^2
     tracelist = [nstrace,ewtrace,udtrace]
     hdrlist = [nsheader,ewheader,udheader]
     return (tracelist,hdrlist)
@@ -11,7 +11,6 @@ import os.path
 import re
 
 #local
-from .trace2xml import trace2xml
 from . import util
 
 #third party
@@ -19,23 +18,31 @@ from obspy.core.trace import Trace
 from obspy.core.trace import Stats
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.util.geodetics import gps2DistAzimuth
-from obspy.signal import rotate
 import numpy as np
-import matplotlib.pyplot as plt
 
 FLOATMATCH = '[0-9]*\.?[0-9]+'
 CHANNEL = {'VERT':'HLZ','N00E':'HLNS','N90E':'HLEW','N00W':'HLNS','N90W':'HLEW','V':'HLZ'}
 
-def readunam(unamfile):
-    f = open(unamfile,'rt')
+NCHANNELS = 3 #number of channels (C1-C3) read from each file
+
+def readunam(unamfile,headonly=False):
+    """
+    Read strong motion data from a UNAM data file.
+    @param unamfile: Path to a valid UNAM data file.
+    @keyword headonly: If True, skip the data block, and return traces with no samples (npts is set from the header).
+    @return: List of ObsPy Trace objects, containing accelerometer data in m/s, and list of header dictionaries.
+    """
+    f = open(unamfile,'rb')
     dataBlockCount = 0
     coordStart = False
     blockStart = False
     hdrdict = {}
-    data = []
-    for line in f.readlines():
+    for line in f:
+        line = line.decode('latin-1')
         if line.startswith('----'):
             dataBlockCount += 1
+            if dataBlockCount == 2:
+                break
             continue
         if line.startswith('CLAVE DE LA ESTACION'):
             hdrdict['station'] = line.split(':')[1].strip()
@@ -100,15 +107,21 @@ def readunam(unamfile):
             except:
                 pass
             continue
-        if dataBlockCount == 2:
-            row = [float(d) for d in line.split()]
-            if len(row) != len(channels):
-                row = np.zeros((1,len(channels))).tolist()[0]
-            data.append(row)
-    f.close()
     hdrdict['network'] = 'MX'
     hdrdict['units'] = 'acc'
-    alldata = np.array(data)/100.0 #convert from Gal (cm/s^2) to m/s^2
+    columns = [np.array([])]*NCHANNELS
+    if not headonly:
+        #the data block runs from the second dashed separator line to the next one (or the end of the file)
+        block = f.read()
+        idx = block.find(b'----')
+        if idx > -1:
+            block = block[0:idx]
+        data = util.decodeBlock(block,ncols=len(channels),npts=max(npts),fillBad=True)
+        for i in range(0,NCHANNELS):
+            column = np.ascontiguousarray(data[:,i])
+            column /= 100.0 #convert from Gal (cm/s^2) to m/s^2
+            columns[i] = column
+    f.close()
 
     #construct header and data array for channel 1
     hdr1 = hdrdict.copy()
@@ -117,7 +130,7 @@ def readunam(unamfile):
     hdr1['channel'] = channels[0]
     hdr1['npts'] = npts[0]
     hdr1['duration'] = durations[0]
-    data1 = alldata[:,0]
+    data1 = columns[0]
     stats1 = Stats(hdr1)
     trace1 = Trace(data1,header=stats1)
 
@@ -128,7 +141,7 @@ def readunam(unamfile):
     hdr2['channel'] = channels[1]
     hdr2['npts'] = npts[1]
     hdr2['duration'] = durations[1]
-    data2 = alldata[:,1]
+    data2 = columns[1]
     stats2 = Stats(hdr2)
     trace2 = Trace(data2,header=stats2)
 
@@ -139,12 +152,14 @@ def readunam(unamfile):
     hdr3['channel'] = channels[2]
     hdr3['npts'] = npts[2]
     hdr3['duration'] = durations[2]
-    data3 = alldata[:,2]
+    data3 = columns[2]
     stats3 = Stats(hdr3)
     trace3 = Trace(data3,header=stats3)
 
     tracelist = [trace1,trace2,trace3]
     headerlist = [hdr1,hdr2,hdr3]
+    if headonly:
+        tracelist = [util.headerTrace(hdr.copy()) for hdr in headerlist]
 
     return (tracelist,headerlist)
     
@@ -154,6 +169,7 @@ if __name__ == '__main__':
     traces,headers = readunam(unamfile)
     trace = traces[0]
     trace.plot()
+    import matplotlib.pyplot as plt
     plt.savefig('unam.png')
     print(trace.data.max())
     print(trace.stats['calib'])
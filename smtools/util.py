@@ -3,6 +3,10 @@ from datetime import datetime
 import argparse
 import os
 import collections
+import warnings
+
+#third party
+#numpy and obspy are imported in the functions that use them, as getdyfi and getstrong import this module at startup
 
 TIMEFMT = '%Y-%m-%dT%H:%M:%S'
 
@@ -17,6 +21,63 @@ def maketime(timestring):
             raise Exception('Could not parse time or date from %s' % timestring)
     return outtime
 
+def decodeBlock(block,ncols=1,npts=None,fillBad=False):
+    """
+    Parse a block of whitespace separated ASCII numbers in one vectorized call.
+
+    @param block: String or bytes containing the data block (all of the data lines of a record).
+    @keyword ncols: Number of columns in the block.  If greater than 1, a 2D (nrows,ncols) array is returned,
+                    otherwise the values are returned in one flat array, in file order.
+    @keyword npts: Maximum number of values (rows, if ncols > 1) to return, or None to return all of them.
+    @keyword fillBad: If True, rows that do not contain exactly ncols numbers are replaced with zeros.
+                      Otherwise, a malformed block raises a ValueError.
+    @return: numpy float64 array.
+    """
+    import numpy as np
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error') #numpy only warns when it stops at unparseable text
+            data = np.fromstring(block,sep=' ')
+        if ncols > 1:
+            if len(data) % ncols:
+                raise ValueError('Found %i values, which is not a multiple of %i columns.' % (len(data),ncols))
+            data = data.reshape((-1,ncols))
+    except (ValueError,DeprecationWarning) as msg:
+        if not fillBad:
+            raise ValueError('Could not parse data block: %s' % str(msg))
+        if isinstance(block,bytes):
+            block = block.decode('ascii','replace')
+        rows = []
+        for line in block.splitlines():
+            if not len(line.strip()):
+                continue
+            try:
+                row = [float(d) for d in line.split()]
+            except ValueError:
+                row = []
+            if len(row) != ncols:
+                row = [0.0]*ncols
+            rows.append(row)
+        data = np.array(rows,dtype=np.float64).reshape((-1,ncols))
+        if ncols == 1:
+            data = data.ravel()
+    if npts is not None:
+        data = data[0:npts]
+    return data
+
+def headerTrace(hdrdict):
+    """
+    Make a trace with no samples, for readers called with headonly=True.
+    @param hdrdict: Dictionary of header values, including npts.
+    @return: ObsPy Trace object with empty data, whose stats npts is the number of samples in the file.
+    """
+    import numpy as np
+    from obspy.core.trace import Trace,Stats
+    npts = int(hdrdict['npts'])
+    trace = Trace(np.array([]),header=Stats(hdrdict))
+    trace.stats['npts'] = npts
+    return trace
+
 def parseEvent(eventxml):
     root = minidom.parse(eventxml)
     eq = root.getElementsByTagName('earthquake')[0]
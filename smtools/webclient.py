@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+#stdlib imports
+import io
+import zlib
+import time
+import threading
+import http.client
+import urllib.parse
+import urllib.request
+import urllib.error
+
+#local imports
+from .httpcache import ResponseCache
+
+DEFAULT_TIMEOUT = 60 #seconds to wait for a connection, or for data on an open connection
+MAXIDLE = 4 #number of idle connections kept open for each host
+MAXREDIRECTS = 5 #number of HTTP redirects followed before giving up
+USER_AGENT = 'smtools/0.1'
+REDIRECT_CODES = [301,302,303,307,308]
+QUERY_TTL = 600 #seconds for which catalog and event query responses are reused without asking the server
+#errors that mean a kept-alive connection was closed by the server while it sat in the pool
+STALE_ERRORS = (http.client.RemoteDisconnected,http.client.BadStatusLine,ConnectionResetError,BrokenPipeError)
+
+class WebResponse(io.BytesIO):
+    """
+    Body of an HTTP response, already read (and decompressed), with the urllib response methods.
+
+    The body is read in full when the response arrives, so that the connection can go straight back
+    to the pool.  The strong motion fetchers all read complete pages and data files anyway.
+    """
+    def __init__(self,url,status,reason,headers,body):
+        io.BytesIO.__init__(self,body)
+        self.url = url
+        self.status = status
+        self.code = status
+        self.reason = reason
+        self.headers = headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+class HTTPClient(object):
+    """
+    HTTP client that keeps connections to each host open between requests.
+
+    Requests ask for gzip compressed responses, and follow redirects.  HTTP errors are raised as
+    urllib.error.HTTPError and connection errors as urllib.error.URLError, as with urllib.request.urlopen(),
+    so callers can switch from one to the other unchanged.  The client can be shared by several threads;
+    each request holds its own connection until the response has been read.
+    """
+    def __init__(self,timeout=DEFAULT_TIMEOUT,maxidle=MAXIDLE):
+        """
+        Constructor
+        @keyword timeout: Default number of seconds to wait for a connection, or for data on an open connection.
+        @keyword maxidle: Number of idle connections kept open for each host.
+        """
+        self.timeout = timeout
+        self.maxidle = maxidle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def getConnection(self,scheme,netloc,timeout):
+        """
+        Get an idle connection to a host from the pool, or open a new one.
+        @param scheme: 'http' or 'https'.
+        @param netloc: Host name (and port).
+        @param timeout: Number of seconds to wait for data.
+        @return: Tuple of (http.client.HTTPConnection,True if the connection has been used before).
+        """
+        key = (scheme,netloc)
+        with self.lock:
+            connections = self.idle.get(key,[])
+            if len(connections):
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return (connection,True)
+        if scheme == 'https':
+            return (http.client.HTTPSConnection(netloc,timeout=timeout),False)
+        return (http.client.HTTPConnection(netloc,timeout=timeout),False)
+
+    def putConnection(self,scheme,netloc,connection):
+        """
+        Return a connection to the pool once its response has been read.
+        @param scheme: 'http' or 'https'.
+        @param netloc: Host name (and port).
+        @param connection: http.client.HTTPConnection object.
+        """
+        key = (scheme,netloc)
+        with self.lock:
+            connections = self.idle.setdefault(key,[])
+            if len(connections) < self.maxidle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+    def request(self,method,url,body=None,headers=None,timeout=None):
+        """
+        Make one HTTP request (without following redirects).
+        @param method: HTTP method ('GET','POST').
+        @param url: URL.
+        @keyword body: Request body bytes, or None.
+        @keyword headers: Dictionary of request headers.
+        @keyword timeout: Number of seconds to wait, or None for the client default.
+        @return: Tuple of (status,reason,http.client.HTTPMessage headers,body bytes).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        allheaders = {'User-Agent':USER_AGENT,
+                      'Accept-Encoding':'gzip'}
+        if headers is not None:
+            for key,value in headers.items():
+                #header names are case-insensitive - don't send two User-Agent headers
+                for oldkey in [oldkey for oldkey in allheaders.keys() if oldkey.lower() == key.lower()]:
+                    del allheaders[oldkey]
+                allheaders[key] = value
+        while True:
+            connection,reused = self.getConnection(parts.scheme,parts.netloc,timeout)
+            try:
+                connection.request(method,path,body=body,headers=allheaders)
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_ERRORS as error:
+                connection.close()
+                if reused:
+                    continue #the server closed the idle connection - try again on a new one
+                raise urllib.error.URLError(error)
+            except http.client.HTTPException as error:
+                #e.g., IncompleteRead or LineTooLong from a truncated or malformed response
+                connection.close()
+                raise urllib.error.URLError(error)
+            except OSError as error:
+                connection.close()
+                raise urllib.error.URLError(error)
+            except:
+                connection.close()
+                raise
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self.putConnection(parts.scheme,parts.netloc,connection)
+        if response.getheader('Content-Encoding','').lower() == 'gzip':
+            try:
+                data = zlib.decompress(data,16+zlib.MAX_WBITS)
+            except zlib.error as error:
+                raise urllib.error.URLError(error)
+        return (response.status,response.reason,response.msg,data)
+
+    def urlopen(self,url,data=None,timeout=None,headers=None):
+        """
+        Open a URL, as with urllib.request.urlopen().
+        @param url: URL string or urllib.request.Request object.
+        @keyword data: Request body bytes (for a POST), or None.
+        @keyword timeout: Number of seconds to wait, or None for the client default.
+        @keyword headers: Dictionary of extra request headers, or None.
+        @return: WebResponse object.
+        """
+        headers = dict(headers or {})
+        if isinstance(url,urllib.request.Request):
+            if data is None:
+                data = url.data
+            headers.update(url.header_items())
+            url = url.full_url
+        if urllib.parse.urlsplit(url).scheme not in ['http','https']:
+            #e.g., ftp:// URLs
+            if timeout is None:
+                timeout = self.timeout
+            return urllib.request.urlopen(url,data=data,timeout=timeout)
+        method = 'GET'
+        if data is not None:
+            method = 'POST'
+            headers.setdefault('Content-Type','application/x-www-form-urlencoded')
+        for i in range(MAXREDIRECTS+1):
+            status,reason,rheaders,body = self.request(method,url,body=data,headers=headers,timeout=timeout)
+            if status not in REDIRECT_CODES or rheaders.get('Location') is None:
+                break
+            url = urllib.parse.urljoin(url,rheaders.get('Location'))
+            if status in [301,302,303] and method == 'POST':
+                #browsers (and urllib) turn a redirected POST into a GET
+                method = 'GET'
+                data = None
+                headers.pop('Content-Type',None)
+        if status >= 400 or status in REDIRECT_CODES:
+            raise urllib.error.HTTPError(url,status,reason,rheaders,io.BytesIO(body))
+        return WebResponse(url,status,reason,rheaders,body)
+
+class HostThrottle(object):
+    """
+    Keep concurrent requests to each host at least a minimum interval apart, so that a pool of
+    fetcher threads does not hammer a slow server.
+    """
+    def __init__(self,interval):
+        """
+        Constructor
+        @param interval: Minimum number of seconds between the starts of requests to the same host.
+        """
+        self.interval = interval
+        self.next = {}
+        self.lock = threading.Lock()
+
+    def wait(self,url):
+        """
+        Block until a request to the host of a URL may start.
+        @param url: URL string.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            now = time.time()
+            start = max(now,self.next.get(host,now))
+            self.next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+CLIENT = HTTPClient() #client shared by all of the smtools modules
+CACHE = ResponseCache() #response cache shared by all of the smtools modules
+
+def urlopen(url,data=None,timeout=None,ttl=None):
+    """
+    Open a URL with the shared HTTPClient, as with urllib.request.urlopen().
+    @param url: URL string or urllib.request.Request object.
+    @keyword data: Request body bytes (for a POST), or None.
+    @keyword timeout: Number of seconds to wait, or None for the default (see setTimeout()).
+    @keyword ttl: For responses worth keeping (e.g., catalog queries), the number of seconds for which the
+                  cached response is used without contacting the server (see httpcache.ResponseCache).
+                  If None, the response cache is not used (unless in offline mode).
+    @return: WebResponse object.
+    """
+    if ttl is None and not CACHE.offline:
+        return CLIENT.urlopen(url,data=data,timeout=timeout)
+    return CACHE.urlopen(CLIENT,url,data=data,timeout=timeout,ttl=ttl or 0)
+
+def setTimeout(timeout):
+    """
+    Set the default timeout of the shared HTTPClient.
+    @param timeout: Number of seconds to wait for a connection, or for data on an open connection.
+    """
+    CLIENT.timeout = timeout
+
+def setOffline(offline):
+    """
+    Turn offline mode on or off.  In offline mode, responses come only from the response cache.
+    @param offline: True to stop contacting servers.
+    """
+    CACHE.offline = offline